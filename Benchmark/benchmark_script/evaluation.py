@@ -0,0 +1,197 @@
+"""
+Post-run evaluation stage
+
+Scores one run directory against a benchmark case. The requested metrics run
+concurrently and share their loaded inputs (actions.json files, screenshot
+lists and the page coverage engine), and results.json is rewritten after each
+metric so a slow or failing metric does not lose the others.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger('evaluation')
+
+METRICS = ('page_coverage', 'action_coverage', 'exact_match')
+
+
+class EvaluationArtifacts:
+    """
+    Inputs of one evaluation, loaded on first use and shared by all metrics
+
+    Args:
+        run_dir (str): Run directory with actions.json and screenshots/
+        benchmark_case_dir (str): Benchmark case directory with actions.json and screenshots/
+    """
+
+    def __init__(self, run_dir, benchmark_case_dir):
+        self.run_dir = run_dir
+        self.benchmark_case_dir = benchmark_case_dir
+        self.test_actions_path = os.path.join(run_dir, "actions.json")
+        self.test_screenshots_dir = os.path.join(run_dir, "screenshots")
+        self.benchmark_actions_path = os.path.join(benchmark_case_dir, "actions.json") if benchmark_case_dir else None
+        self.benchmark_screenshots_dir = os.path.join(benchmark_case_dir, "screenshots") if benchmark_case_dir else None
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, loader):
+        # One lock per artifact, so metrics waiting on different artifacts do not block each other
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._values:
+                self._values[name] = loader()
+            return self._values[name]
+
+    def has_benchmark_actions(self):
+        return bool(self.benchmark_actions_path) and os.path.exists(self.benchmark_actions_path)
+
+    def has_benchmark_screenshots(self):
+        return bool(self.benchmark_screenshots_dir) and os.path.exists(self.benchmark_screenshots_dir)
+
+    def test_actions(self):
+        from .exact_match import load_sequence
+        return self._get("test_actions", lambda: load_sequence(self.test_actions_path))
+
+    def benchmark_actions(self):
+        from .exact_match import load_sequence
+        return self._get("benchmark_actions", lambda: load_sequence(self.benchmark_actions_path))
+
+    def test_screenshots(self):
+        from .page_coverage import find_images
+        return self._get("test_screenshots", lambda: find_images(self.test_screenshots_dir))
+
+    def benchmark_screenshots(self):
+        from .page_coverage import find_images
+        return self._get("benchmark_screenshots", lambda: find_images(self.benchmark_screenshots_dir))
+
+
+def action_sequence(actions):
+    """Wrap loaded actions in an ActionSequence, with the same validation as ActionSequence.load_from_file"""
+    from .action_coverage import ActionSequence
+    sequence = ActionSequence()
+    if isinstance(actions, list):
+        sequence.actions = actions
+    else:
+        logger.error("Action sequence has incorrect format, should be a JSON array")
+    return sequence
+
+
+def evaluate_page_coverage(artifacts, cache_dir=None):
+    if not artifacts.has_benchmark_screenshots():
+        logger.warning("Benchmark screenshots directory not found, cannot calculate page coverage")
+        return None
+    from .page_coverage import get_coverage_engine
+    logger.info("Calculating page coverage...")
+    result = get_coverage_engine().calculate_images(artifacts.test_screenshots(), artifacts.benchmark_screenshots(), cache_dir=cache_dir)
+    logger.info(f"Page coverage: {result['coverage_percentage']:.2f}%")
+    return result
+
+
+def evaluate_action_coverage(artifacts, cache_dir=None):
+    if not artifacts.has_benchmark_actions():
+        logger.warning("Benchmark actions file not found, cannot calculate action coverage")
+        return None
+    from .action_coverage import action_coverage_from_sequences
+    logger.info("Calculating action coverage...")
+    result = action_coverage_from_sequences(action_sequence(artifacts.test_actions()), action_sequence(artifacts.benchmark_actions()))
+    logger.info(f"Action coverage: {result['coverage_percentage']:.2f}%")
+    return result
+
+
+def evaluate_exact_match(artifacts, cache_dir=None):
+    if not artifacts.has_benchmark_actions():
+        logger.warning("Benchmark actions file not found, cannot calculate exact match rate")
+        return None
+    from .exact_match import exact_match_from_sequences
+    logger.info("Calculating exact match rate...")
+    result = exact_match_from_sequences(artifacts.test_actions(), artifacts.benchmark_actions())
+    logger.info(f"Exact match rate: {result['match_percentage']:.2f}%")
+    return result
+
+
+EVALUATORS = {
+    'page_coverage': evaluate_page_coverage,
+    'action_coverage': evaluate_action_coverage,
+    'exact_match': evaluate_exact_match,
+}
+
+
+class ResultsWriter:
+    """Rewrite results.json atomically whenever a metric finishes"""
+
+    def __init__(self, results_path, metrics):
+        self.results_path = results_path
+        self.metrics = list(metrics)
+        self._lock = threading.Lock()
+
+    def write(self, results):
+        with self._lock:
+            # Keep the requested metric order regardless of which one finished first
+            ordered = {name: results[name] for name in self.metrics if name in results}
+            tmp_path = f"{self.results_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(ordered, f, indent=2)
+            os.replace(tmp_path, self.results_path)
+            return ordered
+
+
+def run_evaluation(run_dir, benchmark_case_dir, metrics, cache_dir=None, results_path=None, max_workers=None):
+    """
+    Run the requested metrics concurrently over a run directory
+
+    Args:
+        run_dir (str): Run directory to score
+        benchmark_case_dir (str): Benchmark case directory, None if no case was given
+        metrics (list): Metric names from METRICS
+        cache_dir (str): Embedding cache directory for page coverage
+        results_path (str): Output file, defaults to results.json in run_dir
+        max_workers (int): Metrics evaluated at once, defaults to all of them
+
+    Returns:
+        dict: Results by metric name, as written to results_path. A metric that raised has {"error": message}
+        instead of its results; one skipped for lack of benchmark data is left out.
+
+    Raises:
+        ImportError: If a metric module or one of its dependencies cannot be imported
+    """
+    unknown = [name for name in metrics if name not in EVALUATORS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+
+    artifacts = EvaluationArtifacts(run_dir, benchmark_case_dir)
+    writer = ResultsWriter(results_path or os.path.join(run_dir, "results.json"), metrics)
+    results = {}
+    writer.write(results)
+    if not metrics:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(metrics), thread_name_prefix='evaluation') as executor:
+        futures = {}
+        for name in metrics:
+            futures[executor.submit(EVALUATORS[name], artifacts, cache_dir)] = (name, time.monotonic())
+
+        for future in as_completed(futures):
+            name, start = futures[future]
+            try:
+                result = future.result()
+            except ImportError:
+                # A missing module breaks every run the same way, it is not a failure of this metric
+                raise
+            except Exception as e:
+                logger.exception(f"Metric {name} failed: {e}")
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(results)
+                continue
+            if result is None:
+                continue
+            results[name] = result
+            writer.write(results)
+            logger.info(f"Metric {name} finished in {time.monotonic() - start:.2f}s")
+
+    return writer.write(results)
@@ -1,23 +1,96 @@
 import os
+import time
+import fcntl
+import hashlib
+import uuid
 import numpy as np
 import logging
 from PIL import Image
 import torch
+from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms, models
-from sklearn.metrics.pairwise import cosine_similarity
 import json
 import matplotlib.pyplot as plt
 from collections import defaultdict
+from contextlib import contextmanager
+
+# Importable both as a package module and as a script run from this directory
+if __package__:
+    from .fast_embeddings import FAST_BACKENDS, create_fast_embedding
+else:
+    from fast_embeddings import FAST_BACKENDS, create_fast_embedding
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('page_coverage')
 
+# Shorter side produced by the Resize step of the preprocessing
+RESIZE_SIZE = 256
+
+# Bump when ImageEmbedding.preprocess changes, so cached embeddings are recomputed
+PREPROCESS_VERSION = 1
+
+def preprocess_id(fast_decode=False):
+    """Identify the preprocessing pipeline an embedding was computed with"""
+    return f"v{PREPROCESS_VERSION}" + ("-fast" if fast_decode else "")
+
+def load_image(image_path, fast_decode=False, min_size=RESIZE_SIZE):
+    """
+    Open an image as RGB
+
+    With fast_decode the image is decoded at reduced size while keeping the
+    shorter side at least min_size: JPEG through the decoder draft mode
+    (DCT scaling) and other formats by integer box reduction. Resize(256)
+    discards the full resolution anyway, but the embeddings differ slightly
+    from a full decode.
+    """
+    image = Image.open(image_path)
+    if fast_decode:
+        if image.format == 'JPEG':
+            image.draft('RGB', (min_size, min_size))
+        factor = min(image.size) // min_size
+        if factor >= 2:
+            image = image.reduce(factor)
+    return image.convert('RGB')
+
+class ImageDataset(Dataset):
+    """Decode and preprocess images, run in DataLoader worker processes"""
+
+    def __init__(self, image_paths, preprocess, fast_decode=False):
+        self.image_paths = list(image_paths)
+        self.preprocess = preprocess
+        self.fast_decode = fast_decode
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        path = self.image_paths[index]
+        try:
+            return self.preprocess(load_image(path, self.fast_decode)), path
+        except Exception as e:
+            logger.error(f"Error preprocessing image {path}: {e}")
+            return None, path
+
+def collate_valid_images(batch):
+    """Stack the images that could be preprocessed, skipping failed ones"""
+    valid = [(tensor, path) for tensor, path in batch if tensor is not None]
+    if not valid:
+        return None, []
+    return torch.stack([tensor for tensor, _ in valid]), [path for _, path in valid]
+
 class ImageEmbedding:
     """Image embedding class for computing image embedding vectors"""
     
-    def __init__(self, model_name='resnet50'):
-        """Initialize model"""
+    def __init__(self, model_name='resnet50', num_workers=None, fast_decode=False):
+        """
+        Initialize model
+
+        Args:
+            model_name (str): Embedding model name
+            num_workers (int): Worker processes decoding images for get_batch_embeddings, default min(4, CPU count), 0 decodes on the main thread
+            fast_decode (bool): Decode images at reduced size before preprocessing
+        """
         # Use pre-trained ResNet model
         if model_name == 'resnet50':
             self.model = models.resnet50(pretrained=True)
@@ -40,9 +113,14 @@ class ImageEmbedding:
         logger.info(f"Using device: {self.device}")
         self.model = self.model.to(self.device)
         
+        self.num_workers = min(4, os.cpu_count() or 1) if num_workers is None else num_workers
+        self.fast_decode = fast_decode
+        # Throughput of the last get_batch_embeddings call
+        self.last_throughput = {}
+        
         # Image preprocessing
         self.preprocess = transforms.Compose([
-            transforms.Resize(256),
+            transforms.Resize(RESIZE_SIZE),
             transforms.CenterCrop(224),
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
@@ -52,7 +130,7 @@ class ImageEmbedding:
         """Get embedding vector for an image"""
         try:
             # Load image
-            image = Image.open(image_path).convert('RGB')
+            image = load_image(image_path, self.fast_decode)
             
             # Preprocess image
             image_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
@@ -69,31 +147,45 @@ class ImageEmbedding:
             logger.error(f"Error processing image {image_path}: {e}")
             return None
     
-    def get_batch_embeddings(self, image_paths, batch_size=16):
-        """Get embeddings for a batch of images"""
+    def get_batch_embeddings(self, image_paths, batch_size=16, prefetch_factor=2):
+        """
+        Get embeddings for a batch of images
+
+        Images are decoded and preprocessed by DataLoader workers, which
+        prefetch the next batches while the model runs on the current one.
+        Batches go through pinned memory when running on CUDA.
+        """
         embeddings = {}
-        
+        if not image_paths:
+            return embeddings
+
+        pin_memory = self.device.type == 'cuda'
+        # prefetch_factor is only accepted together with worker processes. Workers are spawned, not
+        # forked: evaluation runs metrics on threads, and forking copies whatever locks they hold
+        loader_kwargs = {'prefetch_factor': prefetch_factor, 'multiprocessing_context': 'spawn'} if self.num_workers > 0 else {}
+        loader = DataLoader(
+            ImageDataset(image_paths, self.preprocess, self.fast_decode),
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=self.num_workers,
+            collate_fn=collate_valid_images,
+            pin_memory=pin_memory,
+            **loader_kwargs
+        )
+
+        start = time.perf_counter()
+        wait_time = 0.0
+        wait_start = start
+
         # Process images in batches
-        for i in range(0, len(image_paths), batch_size):
-            batch_paths = image_paths[i:i+batch_size]
-            batch_tensors = []
-            valid_paths = []
-            
-            # Preprocess each image in the batch
-            for path in batch_paths:
-                try:
-                    image = Image.open(path).convert('RGB')
-                    tensor = self.preprocess(image).unsqueeze(0)
-                    batch_tensors.append(tensor)
-                    valid_paths.append(path)
-                except Exception as e:
-                    logger.error(f"Error preprocessing image {path}: {e}")
-            
-            if not batch_tensors:
+        for batch_tensor, valid_paths in loader:
+            wait_time += time.perf_counter() - wait_start
+            if batch_tensor is None:
+                wait_start = time.perf_counter()
                 continue
-                
-            # Stack tensors and compute embeddings
-            batch_tensor = torch.cat(batch_tensors, 0).to(self.device)
+
+            # Compute embeddings
+            batch_tensor = batch_tensor.to(self.device, non_blocking=pin_memory)
             
             with torch.no_grad():
                 batch_embedding = self.model(batch_tensor)
@@ -102,146 +194,444 @@ class ImageEmbedding:
             batch_embedding = batch_embedding.cpu().numpy()
             for j, path in enumerate(valid_paths):
                 embeddings[path] = batch_embedding[j].squeeze()
+            wait_start = time.perf_counter()
+
+        elapsed = time.perf_counter() - start
+        self.last_throughput = {
+            "images": len(embeddings),
+            "seconds": elapsed,
+            "images_per_second": len(embeddings) / elapsed if elapsed > 0 else None,
+            # Time the model sat idle waiting for decoded batches
+            "decode_wait_seconds": wait_time
+        }
+        logger.info(f"Embedded {len(embeddings)} images in {elapsed:.2f}s "
+                    f"({self.last_throughput['images_per_second'] or 0:.1f} images/s, "
+                    f"{wait_time:.2f}s waiting for decode, {self.num_workers} workers)")
         
         return embeddings
 
+def find_images(directory):
+    """Find all images under a directory, in os.walk order"""
+    image_paths = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                image_paths.append(os.path.join(root, file))
+    return image_paths
+
+def normalize_rows(matrix):
+    """L2-normalize the rows of a matrix; zero rows stay zero (cosine similarity 0, as in sklearn)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, np.finfo(matrix.dtype).tiny)
+
+def stack_embeddings(embeddings):
+    """
+    Stack a path -> embedding dict into a normalized float32 matrix
+
+    Returns:
+        tuple: (list of paths, matrix with one normalized embedding per row)
+    """
+    paths = list(embeddings.keys())
+    if not paths:
+        return paths, np.zeros((0, 0), dtype=np.float32)
+    matrix = np.stack([np.asarray(embeddings[path], dtype=np.float32).ravel() for path in paths])
+    return paths, normalize_rows(matrix)
+
 def calculate_similarity(embedding1, embedding2):
     """Calculate similarity between two embedding vectors"""
     # Use cosine similarity
-    similarity = cosine_similarity(embedding1.reshape(1, -1), embedding2.reshape(1, -1))
-    return similarity[0][0]
+    pair = normalize_rows(np.stack([np.asarray(embedding1, dtype=np.float64).ravel(), np.asarray(embedding2, dtype=np.float64).ravel()]))
+    return float(pair[0] @ pair[1])
+
+def create_embedding_model(model_name='resnet50', num_workers=None, fast_decode=False):
+    """Create a CPU backend from fast_embeddings (phash, dhash, hash, gray, uitree) or a torch ImageEmbedding"""
+    if model_name in FAST_BACKENDS:
+        return create_fast_embedding(model_name, num_workers=num_workers, fast_decode=fast_decode)
+    return ImageEmbedding(model_name, num_workers=num_workers, fast_decode=fast_decode)
+
+def is_cacheable(model_name):
+    """Whether embeddings of the model only depend on the image bytes"""
+    return FAST_BACKENDS[model_name].cacheable if model_name in FAST_BACKENDS else True
+
+def file_content_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def load_benchmark_embeddings(benchmark_dir, model_name='resnet50', cache_file=None):
-    """Load benchmark embedding vectors"""
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache that can be shared between runs and CI workers
+
+    Embeddings are keyed by the SHA-256 of the image bytes, inside a
+    directory per (model name, preprocessing version). Each directory holds a
+    float32 .npy matrix, loaded memory-mapped, and index.json mapping content
+    hashes to matrix rows. Updates write a new matrix file and then replace
+    the index atomically, so readers always see a complete generation.
+    Writers hold an exclusive flock on a lock file from reloading the index
+    to publishing the new one, so concurrent workers never drop each
+    other's rows.
+    Nothing is unpickled, so a cache from another machine is safe to load.
+
+    Args:
+        cache_dir (str): Root directory of the cache
+        model_name (str): Embedding model name
+        preprocess (str): Preprocessing identifier, see preprocess_id
+    """
+
+    FORMAT_VERSION = 1
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = '.lock'
+    # Unreferenced matrices older than this are left over from writers that crashed before publishing
+    STALE_SECONDS = 3600
+
+    def __init__(self, cache_dir, model_name, preprocess):
+        self.model_name = model_name
+        self.preprocess = preprocess
+        self.directory = os.path.join(cache_dir, f"{model_name}-{preprocess}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.rows = {}
+        self.matrix = None
+        self.matrix_file = None
+        self.load()
+
+    def _reset(self):
+        self.rows = {}
+        self.matrix = None
+        self.matrix_file = None
+
+    def load(self):
+        """(Re)load the current generation of the cache"""
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        # A concurrent writer may delete the matrix between reading the index and opening it, retry once
+        for _ in range(2):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except FileNotFoundError:
+                self._reset()
+                return
+            except (OSError, ValueError) as e:
+                logger.error(f"Ignoring unreadable embedding cache index {index_path}: {e}")
+                self._reset()
+                return
+
+            if (index.get('format') != self.FORMAT_VERSION or index.get('model_name') != self.model_name
+                    or index.get('preprocess') != self.preprocess):
+                logger.info(f"Embedding cache in {self.directory} has a different format, model or preprocessing, ignoring it")
+                self._reset()
+                return
+
+            try:
+                self.matrix = np.load(os.path.join(self.directory, index['matrix']), mmap_mode='r', allow_pickle=False)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logger.error(f"Ignoring unreadable embedding cache matrix: {e}")
+                self._reset()
+                return
+            self.rows = index['rows']
+            self.matrix_file = index['matrix']
+            return
+
+        self._reset()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, content_hash):
+        """Return the cached embedding for a content hash, or None"""
+        row = self.rows.get(content_hash)
+        if row is None:
+            return None
+        return np.asarray(self.matrix[row])
+
+    def add(self, embeddings):
+        """
+        Add content hash -> embedding entries and publish a new generation
+
+        Args:
+            embeddings (dict): Content hash -> embedding vector
+        """
+        with self._write_lock():
+            self._add_locked(embeddings)
+
+    @contextmanager
+    def _write_lock(self):
+        with open(os.path.join(self.directory, self.LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _add_locked(self, embeddings):
+        # Pick up rows written by other workers since we loaded
+        self.load()
+        new_hashes = [content_hash for content_hash in embeddings if content_hash not in self.rows]
+        if not new_hashes:
+            return
+
+        new_matrix = np.stack([np.asarray(embeddings[content_hash], dtype=np.float32).ravel() for content_hash in new_hashes])
+        rows = dict(self.rows)
+        offset = 0
+        if self.matrix is not None and len(self.matrix) and self.matrix.shape[1] == new_matrix.shape[1]:
+            offset = len(self.matrix)
+            new_matrix = np.concatenate([np.asarray(self.matrix), new_matrix])
+        else:
+            rows = {}
+        for i, content_hash in enumerate(new_hashes):
+            rows[content_hash] = offset + i
+
+        matrix_file = f"embeddings-{uuid.uuid4().hex}.npy"
+        self._write_atomic(matrix_file, lambda f: np.save(f, new_matrix, allow_pickle=False), 'wb')
+        index = {
+            'format': self.FORMAT_VERSION,
+            'model_name': self.model_name,
+            'preprocess': self.preprocess,
+            'dim': int(new_matrix.shape[1]),
+            'matrix': matrix_file,
+            'rows': rows
+        }
+        self._write_atomic(self.INDEX_FILE, lambda f: json.dump(index, f), 'w')
+
+        previous_file = self.matrix_file
+        self.load()
+        if previous_file and previous_file != self.matrix_file:
+            self._remove(previous_file)
+        self._remove_stale_matrices()
+
+    def _write_atomic(self, name, write, mode):
+        tmp_path = os.path.join(self.directory, f".{name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            # Still mapped by a reader on platforms that forbid it, or already removed by another worker
+            pass
+
+    def _remove_stale_matrices(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if name.startswith('embeddings-') and name.endswith('.npy') and name != self.matrix_file:
+                try:
+                    if now - os.path.getmtime(os.path.join(self.directory, name)) > self.STALE_SECONDS:
+                        self._remove(name)
+                except OSError:
+                    pass
+
+def get_cached_embeddings(image_paths, get_embedding_model, cache=None):
+    """
+    Embed images, reusing cached embeddings for unchanged content
+
+    Args:
+        image_paths (list): Images to embed
+        get_embedding_model (callable): Returns the ImageEmbedding, only called when something must be computed
+        cache (EmbeddingCache): Optional cache
+
+    Returns:
+        dict: path -> embedding, in the order of image_paths
+    """
+    if cache is None:
+        return get_embedding_model().get_batch_embeddings(image_paths)
+
+    hashes = {}
     embeddings = {}
-    
-    # Try to load from cache if available
-    if cache_file and os.path.exists(cache_file):
+    missing = []
+    for path in image_paths:
         try:
-            logger.info(f"Loading embeddings from cache: {cache_file}")
-            with open(cache_file, 'rb') as f:
-                import pickle
-                cached_data = pickle.load(f)
-                if cached_data.get('model_name') == model_name:
-                    return cached_data.get('embeddings', {})
-                else:
-                    logger.info(f"Cache was created with different model ({cached_data.get('model_name')}), recomputing embeddings")
-        except Exception as e:
-            logger.error(f"Error loading cache file: {e}")
-    
-    # Initialize embedding model
-    embedding_model = ImageEmbedding(model_name)
-    
+            hashes[path] = file_content_hash(path)
+        except OSError as e:
+            logger.error(f"Error reading image {path}: {e}")
+            continue
+        embedding = cache.get(hashes[path])
+        if embedding is None:
+            missing.append(path)
+        else:
+            embeddings[path] = embedding
+
+    logger.info(f"Embedding cache: {len(embeddings)} cached, {len(missing)} to compute")
+
+    if missing:
+        computed = get_embedding_model().get_batch_embeddings(missing)
+        try:
+            cache.add({hashes[path]: embedding for path, embedding in computed.items()})
+        except OSError as e:
+            logger.error(f"Error saving embedding cache: {e}")
+        embeddings.update(computed)
+
+    return {path: embeddings[path] for path in image_paths if path in embeddings}
+
+def load_benchmark_embeddings(benchmark_dir, model_name='resnet50', cache_dir=None, embedding_model=None, fast_decode=False):
+    """
+    Load benchmark embedding vectors
+
+    Args:
+        benchmark_dir (str): Directory with benchmark screenshots
+        model_name (str): Embedding model name
+        cache_dir (str): Optional EmbeddingCache directory
+        embedding_model (ImageEmbedding): Model to reuse, created on demand otherwise
+        fast_decode (bool): Decode setting of a model created on demand
+    """
     # Find all images in benchmark directory
-    image_paths = []
-    for root, _, files in os.walk(benchmark_dir):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                image_path = os.path.join(root, file)
-                image_paths.append(image_path)
+    image_paths = find_images(benchmark_dir)
     
     if not image_paths:
         logger.error(f"No images found in benchmark directory: {benchmark_dir}")
-        return embeddings
-    
-    logger.info(f"Computing embeddings for {len(image_paths)} benchmark images")
-    
-    # Compute embeddings in batches
-    embeddings = embedding_model.get_batch_embeddings(image_paths)
+        return {}
     
-    # Save to cache if requested
-    if cache_file:
-        try:
-            logger.info(f"Saving embeddings to cache: {cache_file}")
-            os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
-            with open(cache_file, 'wb') as f:
-                import pickle
-                pickle.dump({
-                    'model_name': model_name,
-                    'embeddings': embeddings
-                }, f)
-        except Exception as e:
-            logger.error(f"Error saving cache file: {e}")
-    
-    return embeddings
+    logger.info(f"Loading embeddings for {len(image_paths)} benchmark images")
 
-def calculate_page_coverage(test_dir, benchmark_dir, similarity_threshold=0.8, model_name='resnet50', cache_file=None):
-    """Calculate page coverage"""
-    # Load benchmark embedding vectors
-    benchmark_embeddings = load_benchmark_embeddings(benchmark_dir, model_name, cache_file)
-    
-    if not benchmark_embeddings:
-        logger.error(f"No valid images found in benchmark directory {benchmark_dir}")
-        return {
+    if embedding_model is not None:
+        fast_decode = embedding_model.fast_decode
+    cache = EmbeddingCache(cache_dir, model_name, preprocess_id(fast_decode)) if cache_dir and is_cacheable(model_name) else None
+
+    def get_embedding_model():
+        # Only load the weights when some image is not cached
+        return embedding_model if embedding_model is not None else create_embedding_model(model_name, fast_decode=fast_decode)
+
+    return get_cached_embeddings(image_paths, get_embedding_model, cache)
+
+class PageCoverageEngine:
+    """
+    Page coverage with a single embedding model and matrix similarity
+
+    The model is loaded once and shared by the benchmark and test embeddings.
+    Embeddings are stacked into L2-normalized matrices so the full
+    test x benchmark cosine similarity is a matrix product, computed in row
+    blocks to bound memory for large runs.
+
+    Args:
+        model_name (str): Embedding model name
+        block_size (int): Number of test rows multiplied at once
+        num_workers (int): Image decode workers, see ImageEmbedding
+        fast_decode (bool): Decode images at reduced size, see ImageEmbedding
+    """
+
+    def __init__(self, model_name='resnet50', block_size=4096, num_workers=None, fast_decode=False):
+        self.model_name = model_name
+        self.block_size = block_size
+        self.num_workers = num_workers
+        self.fast_decode = fast_decode
+        self._embedding_model = None
+        self._caches = {}
+
+    @property
+    def embedding_model(self):
+        # Loaded on first use, a run fully served from the cache never loads the weights
+        if self._embedding_model is None:
+            self._embedding_model = create_embedding_model(self.model_name, num_workers=self.num_workers, fast_decode=self.fast_decode)
+        return self._embedding_model
+
+    def get_cache(self, cache_dir):
+        if not cache_dir or not is_cacheable(self.model_name):
+            return None
+        if cache_dir not in self._caches:
+            self._caches[cache_dir] = EmbeddingCache(cache_dir, self.model_name, preprocess_id(self.fast_decode))
+        return self._caches[cache_dir]
+
+    def embed_images(self, image_paths, cache_dir=None):
+        """Embed images and return (paths, normalized embedding matrix)"""
+        return stack_embeddings(get_cached_embeddings(image_paths, lambda: self.embedding_model, self.get_cache(cache_dir)))
+
+    def load_benchmark(self, benchmark_dir, cache_dir=None):
+        """Load the benchmark embeddings and return (paths, normalized embedding matrix)"""
+        return self.embed_images(find_images(benchmark_dir), cache_dir)
+
+    def best_matches(self, test_matrix, benchmark_matrix):
+        """
+        Find the most similar benchmark row for every test row
+
+        Returns:
+            tuple: (index of the best benchmark row, its cosine similarity) as arrays
+        """
+        best_index = np.empty(len(test_matrix), dtype=np.int64)
+        best_similarity = np.empty(len(test_matrix), dtype=np.float32)
+        benchmark_t = np.ascontiguousarray(benchmark_matrix.T)
+
+        for start in range(0, len(test_matrix), self.block_size):
+            similarity = test_matrix[start:start + self.block_size] @ benchmark_t
+            # argmax returns the first maximum, the same page the pairwise loop kept on ties
+            index = similarity.argmax(axis=1)
+            best_index[start:start + self.block_size] = index
+            best_similarity[start:start + self.block_size] = similarity[np.arange(len(index)), index]
+
+        return best_index, best_similarity
+
+    def calculate(self, test_dir, benchmark_dir, similarity_threshold=0.8, cache_dir=None):
+        """Calculate page coverage, with an optional EmbeddingCache directory shared by benchmark and test images"""
+        return self.calculate_images(find_images(test_dir), find_images(benchmark_dir), similarity_threshold, cache_dir)
+
+    def calculate_images(self, test_images, benchmark_images, similarity_threshold=0.8, cache_dir=None):
+        """Calculate page coverage from already listed test and benchmark images"""
+        empty_result = {
             "covered_pages": 0,
             "total_pages": 0,
             "coverage_percentage": 0.0,
             "details": {}
         }
-    
-    # Initialize embedding model
-    embedding_model = ImageEmbedding(model_name)
-    
-    # Find all images in test directory
-    test_images = []
-    for root, _, files in os.walk(test_dir):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                test_image_path = os.path.join(root, file)
-                test_images.append(test_image_path)
-    
-    if not test_images:
-        logger.error(f"No images found in test directory: {test_dir}")
+
+        # Load benchmark embedding vectors
+        benchmark_paths, benchmark_matrix = self.embed_images(benchmark_images, cache_dir)
+
+        if not benchmark_paths:
+            logger.error(f"No valid benchmark images found ({len(benchmark_images)} listed)")
+            return empty_result
+
+        if not test_images:
+            logger.error(f"No test images found")
+            return empty_result
+
+        logger.info(f"Processing {len(test_images)} test images")
+
+        # Compute test image embeddings in batches
+        test_paths, test_matrix = self.embed_images(test_images, cache_dir)
+
+        # Calculate coverage
+        page_matches = {}
+        if test_paths:
+            best_index, best_similarity = self.best_matches(test_matrix, benchmark_matrix)
+            # If similarity exceeds threshold, consider the page covered
+            for row in np.flatnonzero(best_similarity >= similarity_threshold):
+                page_matches[test_paths[row]] = {
+                    "matched_page": benchmark_paths[best_index[row]],
+                    "similarity": float(best_similarity[row])
+                }
+
+        covered_pages = {match["matched_page"] for match in page_matches.values()}
+
+        # Calculate coverage percentage
+        total_pages = len(benchmark_paths)
+        covered_count = len(covered_pages)
+        coverage_percentage = (covered_count / total_pages) * 100 if total_pages > 0 else 0.0
+
+        # Generate detailed results
         return {
-            "covered_pages": 0,
-            "total_pages": 0,
-            "coverage_percentage": 0.0,
-            "details": {}
+            "covered_pages": covered_count,
+            "total_pages": total_pages,
+            "coverage_percentage": coverage_percentage,
+            "details": page_matches
         }
-    
-    logger.info(f"Processing {len(test_images)} test images")
-    
-    # Compute test image embeddings in batches
-    test_embeddings = embedding_model.get_batch_embeddings(test_images)
-    
-    # Calculate coverage
-    covered_pages = set()
-    page_matches = {}
-    
-    for test_path, test_embedding in test_embeddings.items():
-        # Calculate similarity with all benchmark images
-        best_match = None
-        best_similarity = 0.0
-        
-        for benchmark_path, benchmark_embedding in benchmark_embeddings.items():
-            similarity = calculate_similarity(test_embedding, benchmark_embedding)
-            
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match = benchmark_path
-        
-        # If similarity exceeds threshold, consider the page covered
-        if best_similarity >= similarity_threshold:
-            covered_pages.add(best_match)
-            page_matches[test_path] = {
-                "matched_page": best_match,
-                "similarity": float(best_similarity)
-            }
-    
-    # Calculate coverage percentage
-    total_pages = len(benchmark_embeddings)
-    covered_count = len(covered_pages)
-    coverage_percentage = (covered_count / total_pages) * 100 if total_pages > 0 else 0.0
-    
-    # Generate detailed results
-    result = {
-        "covered_pages": covered_count,
-        "total_pages": total_pages,
-        "coverage_percentage": coverage_percentage,
-        "details": page_matches
-    }
-    
-    return result
+
+# Engines by model name, so repeated metric runs in one process load the weights once
+_engines = {}
+
+def get_coverage_engine(model_name='resnet50', num_workers=None, fast_decode=False):
+    """Return the shared PageCoverageEngine for a model and decode setting"""
+    key = (model_name, num_workers, fast_decode)
+    if key not in _engines:
+        _engines[key] = PageCoverageEngine(model_name, num_workers=num_workers, fast_decode=fast_decode)
+    return _engines[key]
+
+def calculate_page_coverage(test_dir, benchmark_dir, similarity_threshold=0.8, model_name='resnet50', cache_dir=None, num_workers=None, fast_decode=False):
+    """Calculate page coverage"""
+    return get_coverage_engine(model_name, num_workers, fast_decode).calculate(test_dir, benchmark_dir, similarity_threshold, cache_dir)
 
 def visualize_page_coverage(coverage_result, output_path=None):
     """Visualize page coverage results"""
@@ -290,12 +680,13 @@ def visualize_page_coverage(coverage_result, output_path=None):
     except Exception as e:
         logger.error(f"Error creating visualization: {e}")
 
-def generate_coverage_report(test_dir, benchmark_dir, output_path, similarity_threshold=0.8, model_name='resnet50'):
+def generate_coverage_report(test_dir, benchmark_dir, output_path, similarity_threshold=0.8, model_name='resnet50', num_workers=None, fast_decode=False):
     """Generate a comprehensive page coverage report"""
     # Calculate coverage
     coverage_result = calculate_page_coverage(
         test_dir, benchmark_dir, similarity_threshold, model_name,
-        cache_file=os.path.join(os.path.dirname(output_path), "embeddings_cache.pkl")
+        cache_dir=os.path.join(os.path.dirname(output_path), "embedding_cache"),
+        num_workers=num_workers, fast_decode=fast_decode
     )
     
     # Group matches by benchmark page
@@ -308,11 +699,7 @@ def generate_coverage_report(test_dir, benchmark_dir, output_path, similarity_th
         })
     
     # Find uncovered benchmark pages
-    all_benchmark_pages = set()
-    for root, _, files in os.walk(benchmark_dir):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                all_benchmark_pages.add(os.path.join(root, file))
+    all_benchmark_pages = set(find_images(benchmark_dir))
     
     covered_pages = set(benchmark_matches.keys())
     uncovered_pages = all_benchmark_pages - covered_pages
@@ -362,17 +749,20 @@ if __name__ == "__main__":
     parser.add_argument('test_dir', help='Directory containing test screenshots')
     parser.add_argument('benchmark_dir', help='Directory containing benchmark screenshots')
     parser.add_argument('--threshold', '-t', type=float, default=0.8, help='Similarity threshold (default: 0.8)')
-    parser.add_argument('--model', '-m', default='resnet50', choices=['resnet18', 'resnet50', 'vgg16'], 
-                        help='Model to use for embeddings (default: resnet50)')
+    parser.add_argument('--model', '-m', default='resnet50', choices=['resnet18', 'resnet50', 'vgg16'] + list(FAST_BACKENDS), 
+                        help='Model to use for embeddings (default: resnet50); the CPU backends are calibrated with fast_embeddings.py')
     parser.add_argument('--report', '-r', help='Path to save detailed report')
+    parser.add_argument('--workers', type=int, help='Image decode worker processes (default: min(4, CPU count), 0 = main thread)')
+    parser.add_argument('--fast-decode', action='store_true', help='Decode screenshots at reduced size before preprocessing')
+    parser.add_argument('--cache-dir', help='Embedding cache directory, reused across runs')
     parser.add_argument('--visualize', '-v', action='store_true', help='Visualize results')
     
     args = parser.parse_args()
     
     if args.report:
-        generate_coverage_report(args.test_dir, args.benchmark_dir, args.report, args.threshold, args.model)
+        generate_coverage_report(args.test_dir, args.benchmark_dir, args.report, args.threshold, args.model, args.workers, args.fast_decode)
     else:
-        result = calculate_page_coverage(args.test_dir, args.benchmark_dir, args.threshold, args.model)
+        result = calculate_page_coverage(args.test_dir, args.benchmark_dir, args.threshold, args.model, cache_dir=args.cache_dir, num_workers=args.workers, fast_decode=args.fast_decode)
         print(f"Page coverage: {result['coverage_percentage']:.2f}% ({result['covered_pages']}/{result['total_pages']})")
         
         if args.visualize:
@@ -4,10 +4,14 @@ import logging
 import re
 import datetime
 from collections import defaultdict
-from PIL import Image
 import cv2
 import numpy as np
-import imagehash
+
+# Importable both as a package module and as a script run from this directory
+if __package__:
+    from .fast_embeddings import load_gray, phash_bits, pack_bits, PHASH_IMAGE_SIZE
+else:
+    from fast_embeddings import load_gray, phash_bits, pack_bits, PHASH_IMAGE_SIZE
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -80,6 +84,10 @@ def calculate_action_coverage(test_sequence_path, benchmark_sequence_path):
     benchmark_sequence = ActionSequence()
     benchmark_sequence.load_from_file(benchmark_sequence_path)
     
+    return action_coverage_from_sequences(test_sequence, benchmark_sequence)
+
+def action_coverage_from_sequences(test_sequence, benchmark_sequence):
+    """Calculate action coverage of already loaded ActionSequence objects"""
     if not test_sequence.actions or not benchmark_sequence.actions:
         logger.error("Test sequence or benchmark sequence is empty")
         return {
@@ -123,17 +131,17 @@ def calculate_action_coverage(test_sequence_path, benchmark_sequence_path):
         "details": details
     }
 
-def extract_timestamp_from_filename(filename):
-    """Extract timestamp from filename using regex"""
-    # Common timestamp patterns in filenames
-    patterns = [
-        r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})',  # YYYY-MM-DD_HH-MM-SS
-        r'(\d{4}\d{2}\d{2}_\d{2}\d{2}\d{2})',      # YYYYMMDD_HHMMSS
-        r'(\d{10,13})'                             # Unix timestamp (seconds or milliseconds)
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, filename)
+# Common timestamp patterns in filenames
+TIMESTAMP_PATTERNS = [
+    re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})'),  # YYYY-MM-DD_HH-MM-SS
+    re.compile(r'(\d{4}\d{2}\d{2}_\d{2}\d{2}\d{2})'),      # YYYYMMDD_HHMMSS
+    re.compile(r'(\d{10,13})')                             # Unix timestamp (seconds or milliseconds)
+]
+
+def parse_filename_timestamp(filename):
+    """Extract a timestamp from a file name using the known patterns, None if there is none"""
+    for pattern in TIMESTAMP_PATTERNS:
+        match = pattern.search(filename)
         if match:
             timestamp_str = match.group(1)
             # Convert to datetime or timestamp based on format
@@ -148,81 +156,252 @@ def extract_timestamp_from_filename(filename):
                     return float(timestamp_str) / (1000 if len(timestamp_str) > 10 else 1)
             except ValueError:
                 continue
+    return None
+
+def extract_timestamp_from_filename(filename, directory=None):
+    """Extract timestamp from filename using regex, falling back to the file's ctime"""
+    timestamp = parse_filename_timestamp(os.path.basename(filename))
+    if timestamp is not None:
+        return timestamp
     
     try:
-        return os.path.getctime(filename)
-    except:
+        return os.path.getctime(os.path.join(directory, filename) if directory else filename)
+    except OSError:
         return 0
 
-def find_closest_screenshot(screenshots_dir, timestamp, max_time_diff=5):
-    """Find the screenshot closest to the given timestamp"""
-    if not os.path.exists(screenshots_dir):
-        return None
-    
-    screenshot_files = [f for f in os.listdir(screenshots_dir) 
-                       if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    
-    if not screenshot_files:
-        return None
-    
-    # Convert timestamp to float if it's a string
+def parse_timestamp(timestamp):
+    """Convert a log timestamp (number, numeric string or ISO 8601 string) to seconds, None if invalid"""
     if isinstance(timestamp, str):
         try:
-            timestamp = float(timestamp)
+            return float(timestamp)
         except ValueError:
             try:
                 dt = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                timestamp = dt.timestamp()
+                return dt.timestamp()
             except ValueError:
                 logger.error(f"Could not parse timestamp: {timestamp}")
                 return None
+    return float(timestamp)
+
+class ScreenshotTimeline:
+    """
+    Screenshots of a directory sorted by timestamp
+
+    File names are parsed once; timestamps are kept in a sorted numpy array
+    so the closest screenshot is found by binary search. The directory is
+    re-listed only when its modification time changes, and new screenshots
+    taken during a live run are inserted without reparsing the others.
+
+    Args:
+        screenshots_dir (str): Directory with the screenshots
+    """
+
+    def __init__(self, screenshots_dir):
+        self.screenshots_dir = screenshots_dir
+        self.timestamps = np.zeros(0, dtype=np.float64)
+        self.paths = []
+        self._file_timestamps = {}
+        self._mtime = None
+        self.refresh()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _rebuild(self):
+        names = sorted(self._file_timestamps, key=self._file_timestamps.get)
+        self.timestamps = np.array([self._file_timestamps[name] for name in names], dtype=np.float64)
+        self.paths = [os.path.join(self.screenshots_dir, name) for name in names]
+
+    def refresh(self, force=False):
+        """Pick up screenshots added or removed since the last refresh"""
+        try:
+            mtime = os.stat(self.screenshots_dir).st_mtime_ns
+        except OSError:
+            self._file_timestamps = {}
+            self._mtime = None
+            self._rebuild()
+            return
+        if mtime == self._mtime and not force:
+            return
+        self._mtime = mtime
+
+        names = {f for f in os.listdir(self.screenshots_dir)
+                 if f.lower().endswith(('.png', '.jpg', '.jpeg'))}
+        added = names.difference(self._file_timestamps)
+        removed = set(self._file_timestamps).difference(names)
+
+        for name in removed:
+            del self._file_timestamps[name]
+        new_entries = sorted((extract_timestamp_from_filename(name, self.screenshots_dir), name) for name in added)
+        for timestamp, name in new_entries:
+            self._file_timestamps[name] = timestamp
+
+        if removed:
+            self._rebuild()
+        elif new_entries:
+            new_timestamps = np.array([timestamp for timestamp, _ in new_entries], dtype=np.float64)
+            positions = np.searchsorted(self.timestamps, new_timestamps, side='right')
+            self.timestamps = np.insert(self.timestamps, positions, new_timestamps)
+            # Insert from the back so earlier positions stay valid
+            for position, (_, name) in reversed(list(zip(positions, new_entries))):
+                self.paths.insert(int(position), os.path.join(self.screenshots_dir, name))
+
+    def closest(self, timestamp, max_time_diff=5):
+        """Return the screenshot closest to timestamp if within max_time_diff seconds, else None"""
+        if not self.paths:
+            return None
+        index = int(np.searchsorted(self.timestamps, timestamp))
+        best = None
+        min_diff = float('inf')
+        # Only the neighbours around the insertion point can be closest; prefer the earlier one on ties
+        for candidate in (index - 1, index):
+            if 0 <= candidate < len(self.paths):
+                time_diff = abs(self.timestamps[candidate] - timestamp)
+                if time_diff < min_diff:
+                    min_diff = time_diff
+                    best = candidate
+        if best is None or min_diff > max_time_diff:
+            return None
+        return self.paths[best]
+
+# Timelines by directory, refreshed incrementally on each lookup
+_screenshot_timelines = {}
+
+def get_screenshot_timeline(screenshots_dir):
+    """Return the ScreenshotTimeline of a directory, refreshed if the directory changed"""
+    key = os.path.abspath(screenshots_dir)
+    timeline = _screenshot_timelines.get(key)
+    if timeline is None:
+        timeline = _screenshot_timelines[key] = ScreenshotTimeline(screenshots_dir)
+    else:
+        timeline.refresh()
+    return timeline
+
+def find_closest_screenshot(screenshots_dir, timestamp, max_time_diff=5):
+    """
+    Find the screenshot closest to the given timestamp
+
+    screenshots_dir is a directory or a prebuilt ScreenshotTimeline.
+    """
+    if isinstance(screenshots_dir, ScreenshotTimeline):
+        timeline = screenshots_dir
+        timeline.refresh()
+    elif not os.path.exists(screenshots_dir):
+        return None
+    else:
+        timeline = get_screenshot_timeline(screenshots_dir)
     
-    closest_file = None
-    min_diff = float('inf')
-    
-    for file in screenshot_files:
-        file_path = os.path.join(screenshots_dir, file)
-        file_timestamp = extract_timestamp_from_filename(file)
-        
-        time_diff = abs(file_timestamp - timestamp)
-        if time_diff < min_diff and time_diff <= max_time_diff:
-            min_diff = time_diff
-            closest_file = file_path
+    # Convert timestamp to float if it's a string
+    timestamp = parse_timestamp(timestamp)
+    if timestamp is None:
+        return None
     
-    return closest_file
+    return timeline.closest(timestamp, max_time_diff)
+
+# Popcount of every byte value, used when numpy has no bitwise_count (numpy < 2.0)
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount64(values):
+    """Number of set bits of each uint64 value"""
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+def compute_phash(image_paths):
+    """
+    64-bit perceptual hashes (same values as imagehash.phash) packed as uint64
+
+    Returns:
+        tuple: (paths that could be read, uint64 array of their hashes)
+    """
+    valid_paths = []
+    pixels = []
+    for path in image_paths:
+        try:
+            pixels.append(load_gray(path, (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)))
+            valid_paths.append(path)
+        except Exception as e:
+            logger.error(f"Error processing reference image {path}: {e}")
+    if not pixels:
+        return valid_paths, np.zeros(0, dtype=np.uint64)
+    return valid_paths, pack_bits(phash_bits(np.stack(pixels)))
+
+class ReferencePageIndex:
+    """
+    Perceptual hashes of the reference screenshots, built once per directory
+
+    Lookups compare a screenshot hash with all references at once:
+    XOR against the packed uint64 hashes and popcount for the Hamming distance.
+
+    Args:
+        reference_dir (str): Directory with one screenshot per page, named after the page
+    """
+
+    def __init__(self, reference_dir):
+        self.reference_dir = reference_dir
+        ref_files = [f for f in os.listdir(reference_dir)
+                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        paths, self.hashes = compute_phash([os.path.join(reference_dir, f) for f in ref_files])
+        self.page_names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+    def __len__(self):
+        return len(self.page_names)
+
+    def nearest(self, phash):
+        """
+        Find the reference page closest to a packed hash
+
+        Returns:
+            tuple: (page name, Hamming distance), (None, inf) without references
+        """
+        if not self.page_names:
+            return None, float('inf')
+        distances = popcount64(self.hashes ^ np.uint64(phash))
+        # argmin keeps the first reference on ties, like the sequential scan did
+        best = int(np.argmin(distances))
+        return self.page_names[best], int(distances[best])
+
+    def match(self, screenshot_path, max_distance=10):
+        """Return the page of a screenshot if its distance is below max_distance, else None"""
+        paths, hashes = compute_phash([screenshot_path])
+        if not paths:
+            return None
+        page_name, distance = self.nearest(hashes[0])
+        return page_name if distance < max_distance else None
+
+# Reference indexes by directory, rebuilt when the directory content changes
+_reference_indexes = {}
+
+def get_reference_index(reference_dir):
+    """Return the ReferencePageIndex of a directory, building it on first use"""
+    key = os.path.abspath(reference_dir)
+    mtime = os.path.getmtime(reference_dir)
+    cached = _reference_indexes.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, ReferencePageIndex(reference_dir))
+        _reference_indexes[key] = cached
+    return cached[1]
 
 def detect_page_from_screenshot(screenshot_path, reference_screenshots=None):
-    """Detect page type from screenshot using image comparison or ML techniques"""
+    """
+    Detect page type from screenshot using image comparison or ML techniques
+
+    reference_screenshots is a reference directory or a prebuilt ReferencePageIndex.
+    """
     if not os.path.exists(screenshot_path):
         return None
     
-    if reference_screenshots and os.path.exists(reference_screenshots):
-        target_img = Image.open(screenshot_path)
-        target_hash = imagehash.phash(target_img)
-        
-        # Find the most similar reference screenshot
-        best_match = None
-        min_diff = float('inf')
-        
-        ref_files = [f for f in os.listdir(reference_screenshots) 
-                    if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        
-        for ref_file in ref_files:
-            ref_path = os.path.join(reference_screenshots, ref_file)
-            try:
-                ref_img = Image.open(ref_path)
-                ref_hash = imagehash.phash(ref_img)
-                
-                diff = target_hash - ref_hash
-                if diff < min_diff:
-                    min_diff = diff
-                    page_name = os.path.splitext(ref_file)[0]
-                    best_match = page_name
-            except Exception as e:
-                logger.error(f"Error processing reference image {ref_path}: {e}")
-        
+    reference_index = None
+    if isinstance(reference_screenshots, ReferencePageIndex):
+        reference_index = reference_screenshots
+    elif reference_screenshots and os.path.exists(reference_screenshots):
+        reference_index = get_reference_index(reference_screenshots)
+
+    if reference_index is not None:
         # If the difference is small enough, return the matched page
-        if min_diff < 10:  # Threshold can be adjusted
+        best_match = reference_index.match(screenshot_path, max_distance=10)  # Threshold can be adjusted
+        if best_match:
             return best_match
     
     try:
@@ -246,6 +425,11 @@ def detect_page_from_screenshot(screenshot_path, reference_screenshots=None):
 def generate_action_sequence(screenshots_dir, actions_log_path, output_path=None, reference_screenshots=None):
     """Generate action sequence based on screenshots and action logs"""
     sequence = ActionSequence()
+
+    # Index the screenshots and hash the reference screenshots once for the whole log
+    timeline = ScreenshotTimeline(screenshots_dir) if screenshots_dir and os.path.exists(screenshots_dir) else None
+    if reference_screenshots and not isinstance(reference_screenshots, ReferencePageIndex) and os.path.exists(reference_screenshots):
+        reference_screenshots = ReferencePageIndex(reference_screenshots)
     
     try:
         with open(actions_log_path, 'r') as f:
@@ -265,8 +449,8 @@ def generate_action_sequence(screenshots_dir, actions_log_path, output_path=None
                 
                 next_page = params.get("next_page", None)
                 
-                if screenshots_dir and os.path.exists(screenshots_dir):
-                    screenshot_path = find_closest_screenshot(screenshots_dir, timestamp)
+                if timeline is not None:
+                    screenshot_path = find_closest_screenshot(timeline, timestamp)
                     
                     if screenshot_path and not next_page:
                         detected_page = detect_page_from_screenshot(screenshot_path, reference_screenshots)
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 import logging
 import glob
 
@@ -7,17 +8,96 @@ import glob
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('benchmark_loader')
 
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+def file_signature(path, with_hash=True, chunk_size=1 << 20):
+    """Size, modification time and (optionally) SHA-256 of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        signature["sha256"] = digest.hexdigest()
+    return signature
+
+def same_file(signature, previous):
+    """Whether a file is unchanged since previous was recorded, compared on size and mtime"""
+    if signature is None or previous is None:
+        return signature is None and previous is None
+    return signature["size"] == previous.get("size") and signature["mtime_ns"] == previous.get("mtime_ns")
+
+def list_screenshots(screenshots_dir):
+    if not screenshots_dir or not os.path.exists(screenshots_dir):
+        return []
+    return sorted(glob.glob(os.path.join(screenshots_dir, "*.png")))
+
 class BenchmarkCase:
-    """Benchmark test case class"""
+    """
+    Benchmark test case class
+
+    A case created from a case directory loads its actions and screenshots on
+    first access; until then action_count and screenshot_count come from the
+    suite manifest.
+    """
     
-    def __init__(self, case_id, name, apk_path=None):
+    def __init__(self, case_id, name, apk_path=None, case_dir=None, action_count=None, screenshot_count=None):
         """Initialize benchmark test case"""
         self.case_id = case_id
         self.name = name
         self.apk_path = apk_path
-        self.screenshots = []
-        self.actions = []
+        self.case_dir = case_dir
         self.description = ""
+        self._screenshots = None if case_dir else []
+        self._actions = None if case_dir else []
+        self._action_count = action_count
+        self._screenshot_count = screenshot_count
+    
+    @property
+    def actions(self):
+        if self._actions is None:
+            self._actions = []
+            actions_path = os.path.join(self.case_dir, "actions.json")
+            if os.path.exists(actions_path):
+                try:
+                    with open(actions_path, 'r') as f:
+                        self._actions = json.load(f)
+                except Exception as e:
+                    logger.error(f"Error loading action sequence {actions_path}: {e}")
+        return self._actions
+    
+    @actions.setter
+    def actions(self, actions):
+        self._actions = actions
+    
+    @property
+    def screenshots(self):
+        if self._screenshots is None:
+            self._screenshots = list_screenshots(os.path.join(self.case_dir, "screenshots"))
+        return self._screenshots
+    
+    @screenshots.setter
+    def screenshots(self, screenshots):
+        self._screenshots = screenshots
+    
+    @property
+    def action_count(self):
+        """Number of actions, without loading them when the manifest knows it"""
+        if self._actions is None and self._action_count is not None:
+            return self._action_count
+        return len(self.actions)
+    
+    @property
+    def screenshot_count(self):
+        """Number of screenshots, without listing them when the manifest knows it"""
+        if self._screenshots is None and self._screenshot_count is not None:
+            return self._screenshot_count
+        return len(self.screenshots)
     
     def add_screenshot(self, screenshot_path):
         """Add screenshot"""
@@ -79,76 +159,175 @@ class BenchmarkCase:
         return None
 
 class BenchmarkLoader:
-    """Benchmark loader"""
+    """
+    Benchmark loader
+
+    The suite is described by a manifest (manifest.json in the benchmark
+    directory) holding every case's id, name, description, APK path and the
+    size, mtime and hash of its files. Loading only stats the case files and
+    re-reads those that changed since the manifest was written; actions and
+    screenshots are loaded lazily by BenchmarkCase. Loading never writes to
+    the benchmark directory, the manifest is only written by index().
+    """
     
     def __init__(self, benchmark_dir):
         """Initialize loader"""
         self.benchmark_dir = benchmark_dir
+        self.manifest_path = os.path.join(benchmark_dir, MANIFEST_FILE)
+        # Manifest entries of the last load_cases() call
+        self.manifest_entries = {}
         self.cases = []
+        self._cases_by_id = {}
+        self._cases_by_name = {}
+    
+    def _add_case(self, case):
+        self.cases.append(case)
+        self._cases_by_id.setdefault(case.case_id, case)
+        # The first case with a name wins, like the linear scan it replaces
+        self._cases_by_name.setdefault(case.name.lower(), case)
+    
+    def read_manifest(self):
+        """Return the manifest's case entries by directory name, empty if it is missing or outdated"""
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable manifest {self.manifest_path}: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("cases", {})
+    
+    def write_manifest(self, entries):
+        """Write the manifest atomically; a read-only benchmark directory only loses the speedup"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": MANIFEST_VERSION, "cases": entries}, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"Could not write manifest {self.manifest_path}: {e}")
     
-    def load_cases(self):
-        """Load all test cases"""
+    def index_case(self, case_dir, case_id, previous=None):
+        """
+        Build the manifest entry of a case directory, reusing previous when its files are unchanged
+
+        Returns:
+            dict: Manifest entry, or None if the directory has no config.json
+        """
+        previous = previous or {}
+        config_path = os.path.join(case_dir, "config.json")
+        actions_path = os.path.join(case_dir, "actions.json")
+        screenshots_dir = os.path.join(case_dir, "screenshots")
+        
+        config_signature = file_signature(config_path, with_hash=False)
+        if config_signature is None:
+            return None
+        actions_signature = file_signature(actions_path, with_hash=False)
+        screenshots_signature = file_signature(screenshots_dir, with_hash=False)
+        
+        entry = dict(previous)
+        entry["case_id"] = case_id
+        
+        if not same_file(config_signature, previous.get("config")):
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+            entry["name"] = config.get("name", f"Case {case_id}")
+            entry["description"] = config.get("description", "")
+            entry["apk_path"] = config.get("apk_path")
+            entry["config"] = file_signature(config_path)
+        
+        if not same_file(actions_signature, previous.get("actions")):
+            entry["actions"] = file_signature(actions_path)
+            entry["action_count"] = None
+            if entry["actions"] is not None:
+                try:
+                    with open(actions_path, 'r') as f:
+                        entry["action_count"] = len(json.load(f))
+                except Exception as e:
+                    logger.error(f"Error loading action sequence {actions_path}: {e}")
+        
+        # A directory's mtime changes when screenshots are added, removed or renamed
+        if not same_file(screenshots_signature, previous.get("screenshots")):
+            entry["screenshots"] = screenshots_signature
+            entry["screenshot_count"] = len(list_screenshots(screenshots_dir))
+        
+        return entry
+    
+    def load_cases(self, use_manifest=True):
+        """
+        Load all test cases
+
+        Args:
+            use_manifest (bool): Reuse the manifest entries of unchanged cases, otherwise re-read every case
+
+        Returns:
+            list: Loaded test cases
+        """
+        self.cases = []
+        self._cases_by_id = {}
+        self._cases_by_name = {}
+        
+        previous_entries = self.read_manifest() if use_manifest else {}
+        entries = {}
+        
         # Find all test case directories
         case_dirs = glob.glob(os.path.join(self.benchmark_dir, "case_*"))
         
         for case_dir in sorted(case_dirs):
-            case_id = int(os.path.basename(case_dir).split("_")[1])
+            dir_name = os.path.basename(case_dir)
+            try:
+                case_id = int(dir_name.split("_")[1])
+            except ValueError:
+                logger.warning(f"Skipping {case_dir}: not a numbered case directory")
+                continue
             
-            # Load test case configuration
-            config_path = os.path.join(case_dir, "config.json")
-            if os.path.exists(config_path):
-                try:
-                    with open(config_path, 'r') as f:
-                        config = json.load(f)
-                    
-                    case = BenchmarkCase(case_id, config.get("name", f"Case {case_id}"))
-                    case.set_description(config.get("description", ""))
-                    
-                    # Set APK path
-                    apk_path = config.get("apk_path")
-                    if apk_path:
-                        if os.path.isabs(apk_path):
-                            case.apk_path = apk_path
-                        else:
-                            case.apk_path = os.path.join(self.benchmark_dir, apk_path)
-                    
-                    # Load screenshots
-                    screenshots_dir = os.path.join(case_dir, "screenshots")
-                    if os.path.exists(screenshots_dir):
-                        for screenshot in sorted(glob.glob(os.path.join(screenshots_dir, "*.png"))):
-                            case.add_screenshot(screenshot)
-                    
-                    # Load action sequence
-                    actions_path = os.path.join(case_dir, "actions.json")
-                    if os.path.exists(actions_path):
-                        try:
-                            with open(actions_path, 'r') as f:
-                                actions = json.load(f)
-                            case.actions = actions
-                        except Exception as e:
-                            logger.error(f"Error loading action sequence {actions_path}: {e}")
-                    
-                    self.cases.append(case)
-                    
-                except Exception as e:
-                    logger.error(f"Error loading test case {case_dir}: {e}")
+            try:
+                entry = self.index_case(case_dir, case_id, previous_entries.get(dir_name))
+                if entry is None:
+                    continue
+                entries[dir_name] = entry
+                
+                case = BenchmarkCase(case_id, entry["name"], case_dir=case_dir,
+                                     action_count=entry.get("action_count"),
+                                     screenshot_count=entry.get("screenshot_count"))
+                case.set_description(entry.get("description", ""))
+                
+                # Set APK path
+                apk_path = entry.get("apk_path")
+                if apk_path:
+                    if os.path.isabs(apk_path):
+                        case.apk_path = apk_path
+                    else:
+                        case.apk_path = os.path.join(self.benchmark_dir, apk_path)
+                
+                self._add_case(case)
+                
+            except Exception as e:
+                logger.error(f"Error loading test case {case_dir}: {e}")
+        
+        self.manifest_entries = entries
+        if use_manifest and entries != previous_entries:
+            logger.info(f"Manifest {self.manifest_path} is outdated, run the index command to refresh it")
         
         logger.info(f"Loaded {len(self.cases)} test cases")
         return self.cases
     
+    def index(self):
+        """Re-read every test case and write the suite manifest"""
+        self.load_cases(use_manifest=False)
+        self.write_manifest(self.manifest_entries)
+        return self.cases
+    
     def get_case_by_id(self, case_id):
         """Get test case by ID"""
-        for case in self.cases:
-            if case.case_id == case_id:
-                return case
-        return None
+        return self._cases_by_id.get(case_id)
     
     def get_case_by_name(self, name):
         """Get test case by name"""
-        for case in self.cases:
-            if case.name.lower() == name.lower():
-                return case
-        return None
+        return self._cases_by_name.get(name.lower())
     
     def save_cases(self, output_dir):
         """Save test cases to output directory"""
@@ -182,7 +361,7 @@ class BenchmarkLoader:
         
         case = BenchmarkCase(case_id, name, apk_path)
         case.set_description(description)
-        self.cases.append(case)
+        self._add_case(case)
         
         return case
     
@@ -238,13 +417,14 @@ if __name__ == "__main__":
         print("Usage: python benchmark_loader.py <benchmark_dir> [command] [args...]")
         print("Commands:")
         print("  list                     - List all test cases")
+        print("  index                    - Rebuild the suite manifest")
         print("  export <case_id> <path>  - Export test case to action sequence")
         print("  import <seq_path> <name> - Import action sequence as test case")
         sys.exit(1)
     
     benchmark_dir = sys.argv[1]
     loader = BenchmarkLoader(benchmark_dir)
-    cases = loader.load_cases()
+    cases = loader.index() if sys.argv[2:3] == ["index"] else loader.load_cases()
     
     if len(sys.argv) > 2:
         command = sys.argv[2]
@@ -254,8 +434,11 @@ if __name__ == "__main__":
             for case in cases:
                 print(f"  Case {case.case_id}: {case.name}")
                 print(f"    APK: {case.apk_path}")
-                print(f"    Screenshots: {len(case.screenshots)}")
-                print(f"    Actions: {len(case.actions)}")
+                print(f"    Screenshots: {case.screenshot_count}")
+                print(f"    Actions: {case.action_count}")
+        
+        elif command == "index":
+            print(f"Indexed {len(cases)} test cases into {loader.manifest_path}")
         
         elif command == "export" and len(sys.argv) > 4:
             case_id = int(sys.argv[3])
@@ -282,5 +465,5 @@ if __name__ == "__main__":
         for case in cases:
             print(f"  Case {case.case_id}: {case.name}")
             print(f"    APK: {case.apk_path}")
-            print(f"    Screenshots: {len(case.screenshots)}")
-            print(f"    Actions: {len(case.actions)}") 
\ No newline at end of file
+            print(f"    Screenshots: {case.screenshot_count}")
+            print(f"    Actions: {case.action_count}") 
\ No newline at end of file
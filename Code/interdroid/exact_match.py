@@ -1,9 +1,14 @@
 import os
 import json
+import time
+import heapq
+import random
 import logging
 import numpy as np
 from difflib import SequenceMatcher
 import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -18,12 +23,184 @@ def load_sequence(file_path):
         logger.error(f"Error loading file {file_path}: {e}")
         return []
 
+class TokenVocabulary:
+    """
+    Intern sequence items (action dicts, strings, ...) to integer tokens
+
+    Items are keyed by their canonical JSON, so dicts that compare equal get
+    the same token regardless of key order. Comparing small ints is much
+    cheaper than comparing dicts, and unlike dicts they are hashable, which
+    SequenceMatcher requires.
+    """
+
+    def __init__(self):
+        self.tokens = {}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @staticmethod
+    def canonical_key(item):
+        return json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+
+    def token(self, item):
+        key = self.canonical_key(item)
+        token = self.tokens.get(key)
+        if token is None:
+            token = self.tokens[key] = len(self.tokens)
+        return token
+
+    def encode(self, sequence):
+        """Return the list of tokens of a sequence"""
+        return [self.token(item) for item in sequence]
+
+def intern_sequences(*sequences):
+    """Encode sequences with a shared TokenVocabulary, returns one token list per sequence"""
+    vocabulary = TokenVocabulary()
+    return [vocabulary.encode(sequence) for sequence in sequences]
+
+def _popcount(value):
+    return value.bit_count() if hasattr(value, 'bit_count') else bin(value).count('1')
+
+def match_masks(tokens):
+    """Bit i of masks[token] is set where tokens[i] == token, the precomputation of the bit-parallel algorithms"""
+    masks = {}
+    for i, token in enumerate(tokens):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+def lcs_prefix_lengths(a, b, masks=None):
+    """
+    LCS length of a against every prefix of b, bit-parallel (Allison-Dix / Hyyro)
+
+    The DP column of a is held in one Python int, so each item of b costs a
+    few big-int operations over len(a) / 64 machine words.
+
+    Returns:
+        list: lengths[j] = LCS(a, b[:j]) for j in 0..len(b)
+    """
+    m = len(a)
+    masks = match_masks(a) if masks is None else masks
+    all_bits = (1 << m) - 1
+    v = all_bits
+    lengths = [0]
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & all_bits
+        lengths.append(m - _popcount(v))
+    return lengths
+
+def lcs_length(a, b, masks=None):
+    """LCS length of two token sequences, bit-parallel"""
+    if len(a) < len(b) and masks is None:
+        a, b = b, a
+    m = len(a)
+    if m == 0 or not b:
+        return 0
+    masks = match_masks(a) if masks is None else masks
+    all_bits = (1 << m) - 1
+    v = all_bits
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & all_bits
+    return m - _popcount(v)
+
+def edit_distance(a, b, masks=None):
+    """
+    Levenshtein distance of two token sequences, bit-parallel (Myers / Hyyro)
+
+    Args:
+        a, b (list): Token sequences
+        masks (dict): Optional match_masks(a), reused when a is compared many times
+    """
+    m = len(a)
+    if m == 0:
+        return len(b)
+    masks = match_masks(a) if masks is None else masks
+    all_bits = (1 << m) - 1
+    high_bit = 1 << (m - 1)
+    positive = all_bits
+    negative = 0
+    score = m
+    for token in b:
+        equal = masks.get(token, 0)
+        x_vertical = equal | negative
+        x_horizontal = ((((equal & positive) + positive) & all_bits) ^ positive) | equal
+        horizontal_positive = negative | (~(x_horizontal | positive) & all_bits)
+        horizontal_negative = positive & x_horizontal
+        if horizontal_positive & high_bit:
+            score += 1
+        elif horizontal_negative & high_bit:
+            score -= 1
+        # Shifting in a 1 makes the first row 0, 1, 2, ... (global distance, not substring search)
+        horizontal_positive = ((horizontal_positive << 1) | 1) & all_bits
+        horizontal_negative = (horizontal_negative << 1) & all_bits
+        positive = horizontal_negative | (~(x_vertical | horizontal_positive) & all_bits)
+        negative = horizontal_positive & x_vertical
+    return score
+
+def _lcs_pairs_dp(a, b, a_offset, b_offset, pairs):
+    # Quadratic DP with backtracking, used for the small leaves of the Hirschberg recursion
+    m, n = len(a), len(b)
+    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    for i in range(1, m + 1):
+        row, previous = dp[i], dp[i - 1]
+        item = a[i - 1]
+        for j in range(1, n + 1):
+            if item == b[j - 1]:
+                row[j] = previous[j - 1] + 1
+            else:
+                row[j] = max(previous[j], row[j - 1])
+    i, j = m, n
+    leaf = []
+    while i > 0 and j > 0:
+        if a[i - 1] == b[j - 1]:
+            leaf.append((a_offset + i - 1, b_offset + j - 1))
+            i -= 1
+            j -= 1
+        elif dp[i - 1][j] > dp[i][j - 1]:
+            i -= 1
+        else:
+            j -= 1
+    pairs.extend(reversed(leaf))
+
+def lcs_pairs(a, b, leaf_size=4096):
+    """
+    Index pairs (i, j) of a longest common subsequence, Hirschberg's linear-memory reconstruction
+
+    The split point of every recursion level is found from the forward and
+    reverse bit-parallel LCS lengths, so memory stays O(len(a) + len(b)).
+    Sub-problems with at most leaf_size cells are solved with the plain DP.
+    """
+    pairs = []
+    # Explicit stack instead of recursion, processed left to right so pairs come out in order
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_start, a_end, b_start, b_end = stack.pop()
+        sub_a, sub_b = a[a_start:a_end], b[b_start:b_end]
+        if not sub_a or not sub_b:
+            continue
+        if len(sub_a) * len(sub_b) <= leaf_size or len(sub_a) == 1:
+            _lcs_pairs_dp(sub_a, sub_b, a_start, b_start, pairs)
+            continue
+
+        middle = len(sub_a) // 2
+        forward = lcs_prefix_lengths(sub_a[:middle], sub_b)
+        backward = lcs_prefix_lengths(sub_a[middle:][::-1], sub_b[::-1])
+        n = len(sub_b)
+        split = max(range(n + 1), key=lambda k: forward[k] + backward[n - k])
+
+        stack.append((a_start + middle, a_end, b_start + split, b_end))
+        stack.append((a_start, a_start + middle, b_start, b_start + split))
+    return pairs
+
 def calculate_exact_match(test_sequence_path, benchmark_sequence_path):
     """Calculate exact match rate"""
     # Load test sequence and benchmark sequence
-    test_sequence = load_sequence(test_sequence_path)
-    benchmark_sequence = load_sequence(benchmark_sequence_path)
-    
+    return exact_match_from_sequences(load_sequence(test_sequence_path), load_sequence(benchmark_sequence_path))
+
+def exact_match_from_sequences(test_sequence, benchmark_sequence):
+    """Calculate exact match rate of already loaded sequences"""
     if not test_sequence or not benchmark_sequence:
         logger.error("Test sequence or benchmark sequence is empty")
         return {
@@ -33,15 +210,19 @@ def calculate_exact_match(test_sequence_path, benchmark_sequence_path):
             "details": {}
         }
     
+    test_tokens, benchmark_tokens = intern_sequences(test_sequence, benchmark_sequence)
+    return exact_match_from_tokens(SequenceMatcher(None, test_tokens, benchmark_tokens))
+
+def exact_match_from_tokens(matcher):
+    """Exact match result from a SequenceMatcher over interned test and benchmark tokens"""
     # Use longest common subsequence algorithm to calculate matches
-    matcher = SequenceMatcher(None, test_sequence, benchmark_sequence)
     matches = matcher.get_matching_blocks()
     
     # Calculate number of exact matching steps
     exact_matches = sum(match.size for match in matches if match.size > 0)
     
     # Calculate match rate
-    total_steps = len(benchmark_sequence)
+    total_steps = len(matcher.b)
     match_percentage = (exact_matches / total_steps) * 100 if total_steps > 0 else 0.0
     
     # Generate detailed information
@@ -65,6 +246,18 @@ def calculate_exact_match(test_sequence_path, benchmark_sequence_path):
 
 def find_longest_matching_subsequence(test_sequence, benchmark_sequence):
     """Find longest matching subsequence"""
+    test_tokens, benchmark_tokens = intern_sequences(test_sequence, benchmark_sequence)
+    return [
+        {
+            "test_index": i,
+            "benchmark_index": j,
+            "action": test_sequence[i]
+        }
+        for i, j in lcs_pairs(test_tokens, benchmark_tokens)
+    ]
+
+def find_longest_matching_subsequence_reference(test_sequence, benchmark_sequence):
+    """Find longest matching subsequence with the full DP table, kept as the reference implementation"""
     # Dynamic programming algorithm to find longest common subsequence
     m = len(test_sequence)
     n = len(benchmark_sequence)
@@ -113,53 +306,128 @@ def calculate_sequence_similarity(test_sequence, benchmark_sequence):
             "normalized_edit_distance": 0.0
         }
     
+    test_tokens, benchmark_tokens = intern_sequences(test_sequence, benchmark_sequence)
+    return similarity_from_tokens(SequenceMatcher(None, test_tokens, benchmark_tokens))
+
+def similarity_from_tokens(matcher, test_masks=None):
+    """
+    Similarity metrics from a SequenceMatcher over interned test and benchmark tokens
+
+    Args:
+        matcher (SequenceMatcher): Matcher with the test tokens as a and the benchmark tokens as b
+        test_masks (dict): Optional match_masks of the test tokens, reused across benchmarks
+    """
+    test_tokens, benchmark_tokens = matcher.a, matcher.b
+
     # Calculate exact match using SequenceMatcher
-    matcher = SequenceMatcher(None, test_sequence, benchmark_sequence)
     match_ratio = matcher.ratio()
     
     # Calculate Jaccard similarity (set-based)
-    test_set = set(str(item) for item in test_sequence)
-    benchmark_set = set(str(item) for item in benchmark_sequence)
+    test_set = set(test_tokens)
+    benchmark_set = set(benchmark_tokens)
     
     intersection = len(test_set.intersection(benchmark_set))
     union = len(test_set.union(benchmark_set))
     jaccard = intersection / union if union > 0 else 0.0
     
     # Calculate Levenshtein edit distance
-    def levenshtein_distance(s1, s2):
-        if len(s1) < len(s2):
-            return levenshtein_distance(s2, s1)
-        
-        if len(s2) == 0:
-            return len(s1)
-        
-        previous_row = range(len(s2) + 1)
-        for i, c1 in enumerate(s1):
-            current_row = [i + 1]
-            for j, c2 in enumerate(s2):
-                insertions = previous_row[j + 1] + 1
-                deletions = current_row[j] + 1
-                substitutions = previous_row[j] + (c1 != c2)
-                current_row.append(min(insertions, deletions, substitutions))
-            previous_row = current_row
-        
-        return previous_row[-1]
-    
-    # Convert sequences to strings for edit distance calculation
-    test_str = [str(item) for item in test_sequence]
-    benchmark_str = [str(item) for item in benchmark_sequence]
-    
-    edit_distance = levenshtein_distance(test_str, benchmark_str)
-    max_len = max(len(test_sequence), len(benchmark_sequence))
-    normalized_edit_distance = 1 - (edit_distance / max_len) if max_len > 0 else 0.0
+    distance = edit_distance(test_tokens, benchmark_tokens, test_masks)
+    max_len = max(len(test_tokens), len(benchmark_tokens))
+    normalized_edit_distance = 1 - (distance / max_len) if max_len > 0 else 0.0
     
     return {
         "exact_match_percentage": match_ratio * 100,
         "jaccard_similarity": jaccard * 100,
-        "edit_distance": edit_distance,
+        "edit_distance": distance,
         "normalized_edit_distance": normalized_edit_distance * 100
     }
 
+def levenshtein_distance_reference(s1, s2):
+    """Levenshtein distance with the row-by-row Python DP, kept as the reference implementation"""
+    if len(s1) < len(s2):
+        return levenshtein_distance_reference(s2, s1)
+    
+    if len(s2) == 0:
+        return len(s1)
+    
+    previous_row = range(len(s2) + 1)
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1
+            deletions = current_row[j] + 1
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+    
+    return previous_row[-1]
+
+def random_action_sequence(length, alphabet_size, rng):
+    """Random sequence of action dicts drawn from alphabet_size distinct actions"""
+    action_types = ["click", "press", "swipe", "keyboard_input", "special_action"]
+    return [
+        {"action_type": action_types[k % len(action_types)], "action_detail": str(k)}
+        for k in (rng.randrange(alphabet_size) for _ in range(length))
+    ]
+
+def benchmark_algorithms(lengths=(100, 500, 2000), alphabet_size=20, seed=0, reference_limit=2000):
+    """
+    Compare the bit-parallel algorithms with the reference implementations for correctness and speed
+
+    Args:
+        lengths (iterable): Sequence lengths to test (test and benchmark have the same length)
+        alphabet_size (int): Number of distinct actions
+        seed (int): Random seed
+        reference_limit (int): Longest length the quadratic reference implementations are run for
+
+    Returns:
+        list: One dict per length with timings in seconds and correctness flags
+    """
+    rng = random.Random(seed)
+    rows = []
+    for length in lengths:
+        test_sequence = random_action_sequence(length, alphabet_size, rng)
+        benchmark_sequence = random_action_sequence(length, alphabet_size, rng)
+        row = {"length": length}
+
+        start = time.perf_counter()
+        test_tokens, benchmark_tokens = intern_sequences(test_sequence, benchmark_sequence)
+        row["intern"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        lcs = lcs_length(test_tokens, benchmark_tokens)
+        row["lcs_length"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pairs = find_longest_matching_subsequence(test_sequence, benchmark_sequence)
+        row["lcs_hirschberg"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        distance = edit_distance(test_tokens, benchmark_tokens)
+        row["edit_distance"] = time.perf_counter() - start
+
+        # The reconstruction must be a common subsequence of the optimal length
+        row["lcs_valid"] = (
+            len(pairs) == lcs
+            and all(test_sequence[p["test_index"]] == benchmark_sequence[p["benchmark_index"]] for p in pairs)
+            and all(p["test_index"] < q["test_index"] and p["benchmark_index"] < q["benchmark_index"] for p, q in zip(pairs, pairs[1:]))
+        )
+
+        if length <= reference_limit:
+            start = time.perf_counter()
+            reference_lcs = find_longest_matching_subsequence_reference(test_sequence, benchmark_sequence)
+            row["lcs_reference"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            reference_distance = levenshtein_distance_reference([str(item) for item in test_sequence], [str(item) for item in benchmark_sequence])
+            row["edit_distance_reference"] = time.perf_counter() - start
+
+            row["lcs_correct"] = len(reference_lcs) == lcs
+            row["edit_distance_correct"] = reference_distance == distance
+
+        rows.append(row)
+    return rows
+
 def generate_match_report(test_sequence_path, benchmark_sequence_path, output_path):
     """Generate match report"""
     # Load sequences
@@ -171,7 +439,7 @@ def generate_match_report(test_sequence_path, benchmark_sequence_path, output_pa
         return False
     
     # Calculate match rate
-    match_result = calculate_exact_match(test_sequence_path, benchmark_sequence_path)
+    match_result = exact_match_from_sequences(test_sequence, benchmark_sequence)
     
     # Find longest matching subsequence
     lcs = find_longest_matching_subsequence(test_sequence, benchmark_sequence)
@@ -268,7 +536,101 @@ def visualize_sequence_match(test_sequence, benchmark_sequence, output_path=None
         logger.error(f"Error generating visualization: {e}")
         return False
 
-def compare_multiple_sequences(test_sequence_path, benchmark_dir, output_path=None):
+def find_benchmark_sequences(benchmark_dir):
+    """Benchmark sequence files in a directory, or the path itself if it is a single JSON file"""
+    if os.path.isdir(benchmark_dir):
+        return sorted(os.path.join(benchmark_dir, f) for f in os.listdir(benchmark_dir) if f.endswith('.json'))
+    # Assume benchmark_dir is a single file
+    if os.path.exists(benchmark_dir) and benchmark_dir.endswith('.json'):
+        return [benchmark_dir]
+    return []
+
+# Test sequence of the current batch, set once per worker process by _init_batch_worker
+_batch_test_tokens = None
+_batch_test_masks = None
+
+def _init_batch_worker(test_tokens):
+    global _batch_test_tokens, _batch_test_masks
+    _batch_test_tokens = test_tokens
+    _batch_test_masks = match_masks(test_tokens)
+
+def _score_tokens(test_tokens, test_masks, benchmark_tokens):
+    matcher = SequenceMatcher(None, test_tokens, benchmark_tokens)
+    return exact_match_from_tokens(matcher), similarity_from_tokens(matcher, test_masks)
+
+def _score_batch_pair(benchmark_tokens):
+    return _score_tokens(_batch_test_tokens, _batch_test_masks, benchmark_tokens)
+
+class BatchSequenceComparator:
+    """
+    Score one test sequence against a whole set of benchmark sequences
+
+    The benchmark sequences are loaded and interned once, so comparing several
+    test sequences only encodes the test side. The test encoding and its match
+    masks are shared by every pair, and pairs are spread over a process pool.
+
+    Args:
+        benchmark_dir (str): Directory of benchmark sequence JSON files, or a single file
+        max_workers (int): Worker processes, defaults to the CPU count
+        min_parallel (int): Below this many benchmarks pairs are scored in-process
+    """
+
+    def __init__(self, benchmark_dir, max_workers=None, min_parallel=16):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_parallel = min_parallel
+        self.vocabulary = TokenVocabulary()
+        self.benchmarks = []
+        for benchmark_file in find_benchmark_sequences(benchmark_dir):
+            benchmark_sequence = load_sequence(benchmark_file)
+            if not benchmark_sequence:
+                logger.warning(f"Benchmark sequence {benchmark_file} is empty or invalid")
+                continue
+            self.benchmarks.append((os.path.basename(benchmark_file), self.vocabulary.encode(benchmark_sequence)))
+
+    def __len__(self):
+        return len(self.benchmarks)
+
+    def _score_all(self, test_tokens):
+        benchmark_tokens = [tokens for _, tokens in self.benchmarks]
+        if self.max_workers <= 1 or len(benchmark_tokens) < self.min_parallel:
+            test_masks = match_masks(test_tokens)
+            return [_score_tokens(test_tokens, test_masks, tokens) for tokens in benchmark_tokens]
+
+        chunksize = max(1, len(benchmark_tokens) // (4 * self.max_workers))
+        # Spawn rather than fork, the comparator may run on an evaluation thread while other threads hold locks
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_batch_worker, initargs=(test_tokens,)) as executor:
+            return list(executor.map(_score_batch_pair, benchmark_tokens, chunksize=chunksize))
+
+    def compare(self, test_sequence, top_k=None):
+        """
+        Compare a test sequence with every benchmark
+
+        Args:
+            test_sequence (list): Test action sequence
+            top_k (int): Only return the best top_k benchmarks
+
+        Returns:
+            list: {"benchmark_file", "match_result", "similarity"} dicts sorted by match percentage (descending)
+        """
+        test_tokens = self.vocabulary.encode(test_sequence)
+        results = [
+            {
+                "benchmark_file": name,
+                "match_result": match_result,
+                "similarity": similarity
+            }
+            for (name, _), (match_result, similarity) in zip(self.benchmarks, self._score_all(test_tokens))
+        ]
+
+        def sort_key(result):
+            return result["match_result"]["match_percentage"]
+
+        if top_k is not None:
+            return heapq.nlargest(top_k, results, key=sort_key)
+        return sorted(results, key=sort_key, reverse=True)
+
+def compare_multiple_sequences(test_sequence_path, benchmark_dir, output_path=None, top_k=None, max_workers=None):
     """Compare a test sequence against multiple benchmark sequences"""
     # Load test sequence
     test_sequence = load_sequence(test_sequence_path)
@@ -276,46 +638,19 @@ def compare_multiple_sequences(test_sequence_path, benchmark_dir, output_path=No
         logger.error(f"Test sequence {test_sequence_path} is empty or invalid")
         return None
     
-    # Find all benchmark sequences in the directory
-    benchmark_files = []
-    if os.path.isdir(benchmark_dir):
-        benchmark_files = [os.path.join(benchmark_dir, f) for f in os.listdir(benchmark_dir) 
-                          if f.endswith('.json')]
-    else:
-        # Assume benchmark_dir is a single file
-        if os.path.exists(benchmark_dir) and benchmark_dir.endswith('.json'):
-            benchmark_files = [benchmark_dir]
-    
-    if not benchmark_files:
+    comparator = BatchSequenceComparator(benchmark_dir, max_workers=max_workers)
+    if not comparator.benchmarks:
         logger.error(f"No benchmark sequences found in {benchmark_dir}")
         return None
     
-    # Compare with each benchmark
-    results = []
-    for benchmark_file in benchmark_files:
-        benchmark_sequence = load_sequence(benchmark_file)
-        if not benchmark_sequence:
-            logger.warning(f"Benchmark sequence {benchmark_file} is empty or invalid")
-            continue
-        
-        # Calculate match and similarity
-        match_result = calculate_exact_match(test_sequence_path, benchmark_file)
-        similarity = calculate_sequence_similarity(test_sequence, benchmark_sequence)
-        
-        results.append({
-            "benchmark_file": os.path.basename(benchmark_file),
-            "match_result": match_result,
-            "similarity": similarity
-        })
-    
-    # Sort results by match percentage (descending)
-    results.sort(key=lambda x: x["match_result"]["match_percentage"], reverse=True)
+    # Compare with each benchmark, sorted by match percentage (descending)
+    results = comparator.compare(test_sequence, top_k=top_k)
     
     # Generate report
     report = {
         "test_sequence": os.path.basename(test_sequence_path),
         "test_sequence_length": len(test_sequence),
-        "benchmark_count": len(results),
+        "benchmark_count": len(comparator),
         "results": results,
         "timestamp": datetime.datetime.now().isoformat()
     }
@@ -339,9 +674,18 @@ if __name__ == "__main__":
         print("Usage: python exact_match.py <test_sequence_path> <benchmark_sequence_path> [output_report_path]")
         print("       python exact_match.py compare <test_sequence_path> <benchmark_dir> [output_report_path]")
         print("       python exact_match.py visualize <test_sequence_path> <benchmark_sequence_path> [output_image_path]")
+        print("       python exact_match.py benchmark <length> [<length> ...]")
         sys.exit(1)
     
-    if sys.argv[1] == "compare":
+    if sys.argv[1] == "benchmark":
+        lengths = [int(length) for length in sys.argv[2:]]
+        for row in benchmark_algorithms(lengths):
+            print(f"length {row['length']}:")
+            for key, value in row.items():
+                if key != "length":
+                    print(f"  {key}: {value:.4f}s" if isinstance(value, float) else f"  {key}: {value}")
+    
+    elif sys.argv[1] == "compare":
         if len(sys.argv) < 4:
             print("Usage: python exact_match.py compare <test_sequence_path> <benchmark_dir> [output_report_path]")
             sys.exit(1)
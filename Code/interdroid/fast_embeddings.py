@@ -0,0 +1,384 @@
+"""
+Lightweight CPU embedding backends for page coverage
+
+These backends expose the same get_batch_embeddings interface as
+page_coverage.ImageEmbedding but need neither torch nor model weights:
+
+- phash / dhash / hash: perceptual hashes computed for a whole batch with
+  numpy, returned as +1/-1 bit vectors so that cosine similarity is
+  1 - 2 * hamming_distance / bits
+- gray: a downsampled, zero-mean grayscale thumbnail, whose cosine
+  similarity is the pixel correlation of the two screens
+- uitree: a feature-hashed signature of the UI hierarchy XML stored next to
+  the screenshot (ui_trees/step_N_ui.xml or hierarchy_files/N.xml)
+
+calibrate() compares their page matches with a ResNet reference.
+"""
+
+import os
+import time
+import zlib
+import logging
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger('fast_embeddings')
+
+HASH_SIZE = 8
+# pHash is computed from the DCT of a (HASH_SIZE * 4)^2 thumbnail, as in imagehash
+PHASH_IMAGE_SIZE = HASH_SIZE * 4
+# Portrait thumbnail (width, height) for the grayscale descriptor
+GRAY_SIZE = (24, 48)
+UI_TREE_DIM = 512
+
+_RESAMPLE = getattr(Image, 'Resampling', Image).LANCZOS
+
+
+def load_gray(image_path, size, fast_decode=False):
+    """
+    Load an image as a grayscale float32 array resized to size (width, height)
+
+    With fast_decode, JPEG images are decoded with DCT scaling and other
+    formats reduced by an integer factor before the final resize.
+    """
+    image = Image.open(image_path)
+    if fast_decode:
+        if image.format == 'JPEG':
+            image.draft('L', (size[0] * 4, size[1] * 4))
+        factor = min(image.size[0] // (size[0] * 4), image.size[1] // (size[1] * 4))
+        if factor >= 2:
+            image = image.reduce(factor)
+    return np.asarray(image.convert('L').resize(size, _RESAMPLE), dtype=np.float32)
+
+
+def dct_matrix(n):
+    """Unnormalized DCT-II matrix, D @ x matches scipy.fftpack.dct(x)"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return (2 * np.cos(np.pi * k * (2 * i + 1) / (2 * n))).astype(np.float64)
+
+
+_DCT = dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def phash_bits(pixels, hash_size=HASH_SIZE):
+    """
+    Perceptual hash of a stack of (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE) grayscale images
+
+    Returns:
+        np.ndarray: (n, hash_size * hash_size) boolean bits, same bit order as imagehash.phash
+    """
+    pixels = np.asarray(pixels, dtype=np.float64)
+    # 2D DCT of the whole batch: along the rows (axis 1) then along the columns (axis 2)
+    coefficients = _DCT @ pixels @ _DCT.T
+    low_frequency = coefficients[:, :hash_size, :hash_size].reshape(len(pixels), -1)
+    median = np.median(low_frequency, axis=1, keepdims=True)
+    return low_frequency > median
+
+
+def dhash_bits(pixels):
+    """
+    Difference hash of a stack of (HASH_SIZE, HASH_SIZE + 1) grayscale images
+
+    Returns:
+        np.ndarray: (n, HASH_SIZE * HASH_SIZE) boolean bits, same bit order as imagehash.dhash
+    """
+    pixels = np.asarray(pixels)
+    return (pixels[:, :, 1:] > pixels[:, :, :-1]).reshape(len(pixels), -1)
+
+
+def pack_bits(bits):
+    """Pack (n, 64) boolean bits into n uint64 values, most significant bit first"""
+    packed = np.packbits(np.asarray(bits, dtype=np.uint8), axis=1)
+    return packed.view('>u8').astype(np.uint64).ravel()
+
+
+def find_ui_tree(image_path):
+    """Find the UI hierarchy XML recorded with a screenshot, or None"""
+    directory, filename = os.path.split(image_path)
+    stem = os.path.splitext(filename)[0]
+    parent = os.path.dirname(directory)
+    candidates = [
+        # Dataset/benchmark records: screenshots/step_N.png -> ui_trees/step_N_ui.xml
+        os.path.join(parent, 'ui_trees', f"{stem}_ui.xml"),
+        # Interdroid runs: screenshots/N.jpg -> hierarchy_files/N.xml
+        os.path.join(parent, 'hierarchy_files', f"{stem}.xml"),
+        os.path.join(directory, f"{stem}.xml"),
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _feature_index(feature, dim):
+    # crc32 is stable across processes, unlike the salted built-in hash
+    value = zlib.crc32(feature.encode('utf-8'))
+    return value % dim, 1.0 if (value >> 31) & 1 else -1.0
+
+
+def ui_tree_signature(xml_path, dim=UI_TREE_DIM):
+    """
+    Signed feature-hashing signature of the structure of a UI hierarchy
+
+    Features are widget classes, parent>child class pairs, classes at their
+    depth and resource ids; text is ignored since it changes between runs.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    root = ET.parse(xml_path).getroot()
+    stack = [(root, 0, '')]
+    while stack:
+        node, depth, parent_class = stack.pop()
+        node_class = node.get('class') or node.tag
+        features = [f"c:{node_class}", f"p:{parent_class}>{node_class}", f"d:{depth}:{node_class}"]
+        resource_id = node.get('resource-id')
+        if resource_id:
+            features.append(f"r:{resource_id}")
+        for feature in features:
+            index, sign = _feature_index(feature, dim)
+            vector[index] += sign
+        stack.extend((child, depth + 1, node_class) for child in node)
+    return vector
+
+
+class FastEmbedding:
+    """
+    Base class of the CPU backends, mirroring ImageEmbedding.get_batch_embeddings
+
+    Args:
+        num_workers (int): Threads decoding images, default min(8, CPU count)
+        fast_decode (bool): Decode at reduced size before the final resize
+    """
+
+    model_name = None
+    # Whether the embedding depends only on the image bytes (and can go into the EmbeddingCache)
+    cacheable = True
+
+    def __init__(self, num_workers=None, fast_decode=False):
+        self.num_workers = num_workers or min(8, os.cpu_count() or 1)
+        self.fast_decode = fast_decode
+        self.last_throughput = {}
+
+    def embed_one(self, image_path):
+        """Return the embedding of one image"""
+        raise NotImplementedError
+
+    def embed_batch(self, image_paths, vectors):
+        """Turn per-image intermediate arrays into embeddings, default is to return them unchanged"""
+        return vectors
+
+    def get_embedding(self, image_path):
+        return self.get_batch_embeddings([image_path]).get(image_path)
+
+    def get_batch_embeddings(self, image_paths, batch_size=256):
+        """Get embeddings for a batch of images"""
+        embeddings = {}
+        start = time.perf_counter()
+
+        def load(path):
+            try:
+                return path, self.embed_one(path)
+            except Exception as e:
+                logger.error(f"Error processing image {path}: {e}")
+                return path, None
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for i in range(0, len(image_paths), batch_size):
+                loaded = [(path, vector) for path, vector in executor.map(load, image_paths[i:i + batch_size]) if vector is not None]
+                if not loaded:
+                    continue
+                paths = [path for path, _ in loaded]
+                batch = self.embed_batch(paths, np.stack([vector for _, vector in loaded]))
+                for path, embedding in zip(paths, batch):
+                    embeddings[path] = embedding
+
+        elapsed = time.perf_counter() - start
+        self.last_throughput = {
+            "images": len(embeddings),
+            "seconds": elapsed,
+            "images_per_second": len(embeddings) / elapsed if elapsed > 0 else None
+        }
+        logger.info(f"{self.model_name}: embedded {len(embeddings)} images in {elapsed:.2f}s "
+                    f"({self.last_throughput['images_per_second'] or 0:.1f} images/s)")
+        return embeddings
+
+
+class PHashEmbedding(FastEmbedding):
+    """pHash as a +1/-1 vector of 64 bits"""
+
+    model_name = 'phash'
+
+    def embed_one(self, image_path):
+        return load_gray(image_path, (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), self.fast_decode)
+
+    def embed_batch(self, image_paths, vectors):
+        return np.where(phash_bits(vectors), 1.0, -1.0).astype(np.float32)
+
+
+class DHashEmbedding(FastEmbedding):
+    """dHash as a +1/-1 vector of 64 bits"""
+
+    model_name = 'dhash'
+
+    def embed_one(self, image_path):
+        return load_gray(image_path, (HASH_SIZE + 1, HASH_SIZE), self.fast_decode)
+
+    def embed_batch(self, image_paths, vectors):
+        return np.where(dhash_bits(vectors), 1.0, -1.0).astype(np.float32)
+
+
+class CombinedHashEmbedding(FastEmbedding):
+    """pHash and dHash concatenated into a 128 bit +1/-1 vector"""
+
+    model_name = 'hash'
+
+    def embed_one(self, image_path):
+        image = Image.open(image_path)
+        if self.fast_decode and image.format == 'JPEG':
+            image.draft('L', (PHASH_IMAGE_SIZE * 4, PHASH_IMAGE_SIZE * 4))
+        gray = image.convert('L')
+        phash_pixels = np.asarray(gray.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), _RESAMPLE), dtype=np.float32)
+        dhash_pixels = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), _RESAMPLE), dtype=np.float32)
+        return np.concatenate([phash_pixels.ravel(), dhash_pixels.ravel()])
+
+    def embed_batch(self, image_paths, vectors):
+        split = PHASH_IMAGE_SIZE * PHASH_IMAGE_SIZE
+        phash_pixels = vectors[:, :split].reshape(-1, PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+        dhash_pixels = vectors[:, split:].reshape(-1, HASH_SIZE, HASH_SIZE + 1)
+        bits = np.concatenate([phash_bits(phash_pixels), dhash_bits(dhash_pixels)], axis=1)
+        return np.where(bits, 1.0, -1.0).astype(np.float32)
+
+
+class GrayEmbedding(FastEmbedding):
+    """Zero-mean downsampled grayscale thumbnail; cosine similarity is the pixel correlation"""
+
+    model_name = 'gray'
+
+    def embed_one(self, image_path):
+        pixels = load_gray(image_path, GRAY_SIZE, self.fast_decode).ravel()
+        return pixels - pixels.mean()
+
+
+class UITreeEmbedding(FastEmbedding):
+    """Feature-hashed UI hierarchy signature; screenshots without a hierarchy get a zero vector"""
+
+    model_name = 'uitree'
+    # The embedding comes from the XML, not from the image bytes the cache is keyed on
+    cacheable = False
+
+    def embed_one(self, image_path):
+        xml_path = find_ui_tree(image_path)
+        if xml_path is None:
+            logger.warning(f"No UI hierarchy found for {image_path}, it will not match any page")
+            return np.zeros(UI_TREE_DIM, dtype=np.float32)
+        return ui_tree_signature(xml_path)
+
+
+FAST_BACKENDS = {
+    backend.model_name: backend
+    for backend in (PHashEmbedding, DHashEmbedding, CombinedHashEmbedding, GrayEmbedding, UITreeEmbedding)
+}
+
+
+def create_fast_embedding(model_name, num_workers=None, fast_decode=False):
+    """Create a CPU backend by name, see FAST_BACKENDS"""
+    if model_name not in FAST_BACKENDS:
+        raise ValueError(f"Unknown fast embedding backend: {model_name}")
+    return FAST_BACKENDS[model_name](num_workers=num_workers, fast_decode=fast_decode)
+
+
+def calibrate(test_dir, benchmark_dir, backends=None, reference_model='resnet50', reference_threshold=0.8, cache_dir=None):
+    """
+    Measure how well each fast backend reproduces the page matches of a reference model
+
+    For every backend the similarity threshold that maximizes agreement with
+    the reference (same matched benchmark page, or no match, per test image)
+    is searched, and agreement, coverage and embedding time are reported.
+
+    Returns:
+        dict: backend name -> calibration results, plus the reference under "reference"
+    """
+    if __package__:
+        from .page_coverage import PageCoverageEngine, find_images
+    else:
+        from page_coverage import PageCoverageEngine, find_images
+
+    test_images = find_images(test_dir)
+    benchmark_images = find_images(benchmark_dir)
+
+    def run(model_name, use_cache):
+        engine = PageCoverageEngine(model_name)
+        start = time.perf_counter()
+        benchmark_paths, benchmark_matrix = engine.embed_images(benchmark_images, cache_dir if use_cache else None)
+        test_paths, test_matrix = engine.embed_images(test_images, cache_dir if use_cache else None)
+        elapsed = time.perf_counter() - start
+        best_index, best_similarity = engine.best_matches(test_matrix, benchmark_matrix)
+        matches = {path: (benchmark_paths[index], similarity) for path, index, similarity in zip(test_paths, best_index, best_similarity)}
+        return matches, len(benchmark_paths), elapsed
+
+    # The reference may come from the cache, its timing is only meaningful when computed
+    reference_matches, total_pages, reference_time = run(reference_model, use_cache=True)
+    reference = {path: page if similarity >= reference_threshold else None for path, (page, similarity) in reference_matches.items()}
+    reference_covered = {page for page in reference.values() if page is not None}
+
+    results = {
+        "reference": {
+            "model": reference_model,
+            "threshold": reference_threshold,
+            "coverage_percentage": len(reference_covered) / total_pages * 100 if total_pages else 0.0,
+            "seconds": reference_time
+        }
+    }
+
+    for backend in backends or list(FAST_BACKENDS):
+        matches, _, elapsed = run(backend, use_cache=False)
+        best = None
+        for threshold in np.round(np.arange(0.0, 1.0, 0.01), 2):
+            agreement = np.mean([
+                (matches[path][0] if path in matches and matches[path][1] >= threshold else None) == page
+                for path, page in reference.items()
+            ]) if reference else 0.0
+            if best is None or agreement > best[1]:
+                best = (float(threshold), float(agreement))
+
+        threshold, agreement = best
+        covered = {page for page, similarity in matches.values() if similarity >= threshold}
+        results[backend] = {
+            "threshold": threshold,
+            "agreement": agreement,
+            "coverage_percentage": len(covered) / total_pages * 100 if total_pages else 0.0,
+            "seconds": elapsed,
+            "speedup": reference_time / elapsed if elapsed > 0 else None
+        }
+        logger.info(f"{backend}: agreement {agreement:.1%} at threshold {threshold:.2f}, "
+                    f"coverage {results[backend]['coverage_percentage']:.2f}% vs {results['reference']['coverage_percentage']:.2f}%, "
+                    f"{elapsed:.2f}s")
+
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Calibrate the fast page coverage backends against a ResNet reference')
+    parser.add_argument('test_dir', help='Directory containing test screenshots')
+    parser.add_argument('benchmark_dir', help='Directory containing benchmark screenshots')
+    parser.add_argument('--backends', nargs='+', choices=list(FAST_BACKENDS), help='Backends to calibrate (default: all)')
+    parser.add_argument('--reference', default='resnet50', help='Reference model (default: resnet50)')
+    parser.add_argument('--threshold', '-t', type=float, default=0.8, help='Reference similarity threshold (default: 0.8)')
+    parser.add_argument('--cache-dir', help='Embedding cache directory for the reference embeddings')
+    parser.add_argument('--output', '-o', help='Path to save the calibration results as JSON')
+
+    args = parser.parse_args()
+
+    results = calibrate(args.test_dir, args.benchmark_dir, args.backends, args.reference, args.threshold, args.cache_dir)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,312 @@
+import json
+
+# Tool definitions for the action vocabulary used by main.py (click/press/swipe/keyboard_input/special_action/end).
+# Each creator returns the OpenAI-style function definition and a function that turns the call arguments
+# into the action dict executed by main.py, or an error message to feed back to the model.
+
+def initialize_agent_actions(component_ids):
+    possible_action_functions = {}
+    function_map = {}
+    current_context.set_components(component_ids)
+    function_creators = [create_click_action_definition, create_press_action_definition, create_swipe_action_definition, create_keyboard_input_action_definition, create_special_action_definition, create_end_definition]
+
+    for function_creator in function_creators:
+        function_def, func = function_creator()
+        possible_action_functions[function_def['function']['name']] = function_def
+        function_map[function_def['function']['name']] = func
+
+    return possible_action_functions, function_map
+
+class Context:
+    def __init__(self):
+        self.component_ids = []
+
+    def set_components(self, component_ids):
+        self.component_ids = sorted(int(component_id) for component_id in component_ids)
+
+    def get_component_ids(self):
+        return self.component_ids
+
+    def has_component(self, component_id):
+        return component_id in self.component_ids
+
+
+current_context = Context()
+
+SPECIAL_KEYS = ["KEY_BACK", "KEY_HOME", "KEY_ENTER"]
+SWIPE_DIRECTIONS = ["up", "down", "left", "right"]
+
+
+def _parse_component_id(component_id):
+    try:
+        return int(component_id), None
+    except (TypeError, ValueError):
+        return None, f'"{component_id}" is not a component ID. Please use the number shown in the top-left corner of a red box.'
+
+def _missing_component_error(component_id):
+    return f'The component with ID {component_id} does not exist on the current screen. Please select one of the component IDs {current_context.get_component_ids()}.'
+
+
+def click(component_id, action_description=''):
+    component_id, error = _parse_component_id(component_id)
+    if error is not None:
+        return None, error
+    if not current_context.has_component(component_id):
+        return None, _missing_component_error(component_id)
+
+    return {"action_type": "click", "action_detail": str(component_id), "action_description": action_description}, None
+
+def create_click_action_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "click",
+            "description": "Use this function to click on the target component.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "component_id": {
+                        "type": "integer",
+                        "enum": current_context.get_component_ids(),
+                        "description": "The ID of the target component, shown in the top-left corner of its red box.",
+                    },
+                    "action_description": {
+                        "type": "string",
+                        "description": "The description of the action",
+                    }
+                },
+                "required": ["component_id", "action_description"]
+            }
+        }
+    }, click
+
+
+def press(component_id, action_description=''):
+    component_id, error = _parse_component_id(component_id)
+    if error is not None:
+        return None, error
+    if not current_context.has_component(component_id):
+        return None, _missing_component_error(component_id)
+
+    return {"action_type": "press", "action_detail": str(component_id), "action_description": action_description}, None
+
+def create_press_action_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "press",
+            "description": "Use this function to long press on the target component.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "component_id": {
+                        "type": "integer",
+                        "enum": current_context.get_component_ids(),
+                        "description": "The ID of the target component, shown in the top-left corner of its red box.",
+                    },
+                    "action_description": {
+                        "type": "string",
+                        "description": "The description of the action",
+                    }
+                },
+                "required": ["component_id", "action_description"]
+            }
+        }
+    }, press
+
+
+def swipe(direction, distance, begin_component_id=None, action_description=''):
+    direction = str(direction).lower()
+    if direction not in SWIPE_DIRECTIONS:
+        return None, f'"{direction}" is not a valid swipe direction. Please use one of {SWIPE_DIRECTIONS}.'
+    try:
+        distance = int(distance)
+    except (TypeError, ValueError):
+        return None, f'The swipe distance "{distance}" must be a number of pixels.'
+
+    action_detail = {"direction": direction, "distance": str(distance)}
+    if begin_component_id is not None:
+        begin_component_id, error = _parse_component_id(begin_component_id)
+        if error is not None:
+            return None, error
+        if not current_context.has_component(begin_component_id):
+            return None, _missing_component_error(begin_component_id)
+        action_detail["begin_component_id"] = str(begin_component_id)
+
+    return {"action_type": "swipe", "action_detail": action_detail, "action_description": action_description}, None
+
+def create_swipe_action_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "swipe",
+            "description": "Use this function to swipe on the screen, optionally starting from a component.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "direction": {
+                        "type": "string",
+                        "enum": SWIPE_DIRECTIONS,
+                        "description": "The direction of the swipe",
+                    },
+                    "distance": {
+                        "type": "integer",
+                        "description": "The distance of the swipe in pixels",
+                    },
+                    "begin_component_id": {
+                        "type": "integer",
+                        "enum": current_context.get_component_ids(),
+                        "description": "The ID of the component to begin the swipe from. Omit to swipe from the center of the screen.",
+                    },
+                    "action_description": {
+                        "type": "string",
+                        "description": "The description of the action",
+                    }
+                },
+                "required": ["direction", "distance", "action_description"]
+            }
+        }
+    }, swipe
+
+
+def keyboard_input(text, action_description=''):
+    if not isinstance(text, str) or len(text) == 0:
+        return None, 'The keyboard input must be a non-empty string.'
+
+    return {"action_type": "keyboard_input", "action_detail": text, "action_description": action_description}, None
+
+def create_keyboard_input_action_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "keyboard_input",
+            "description": "Use this function to type text with the keyboard. You often need to click on an input box first before you can start typing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "text": {
+                        "type": "string",
+                        "description": "The keyboard input content",
+                    },
+                    "action_description": {
+                        "type": "string",
+                        "description": "The description of the action",
+                    }
+                },
+                "required": ["text", "action_description"]
+            }
+        }
+    }, keyboard_input
+
+
+def special_action(key, action_description=''):
+    if key not in SPECIAL_KEYS:
+        return None, f'"{key}" is not a supported special action. Please use one of {SPECIAL_KEYS}.'
+
+    return {"action_type": "special_action", "action_detail": key, "action_description": action_description}, None
+
+def create_special_action_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "special_action",
+            "description": "Use this function to press a system key: KEY_BACK returns to the previous page, KEY_HOME returns to the HOME desktop and KEY_ENTER presses the Enter key.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "key": {
+                        "type": "string",
+                        "enum": SPECIAL_KEYS,
+                        "description": "The key to press",
+                    },
+                    "action_description": {
+                        "type": "string",
+                        "description": "The description of the action",
+                    }
+                },
+                "required": ["key", "action_description"]
+            }
+        }
+    }, special_action
+
+
+def end(action_description='the action is to end the current task'):
+    return {"action_type": "end", "action_detail": "end", "action_description": action_description}, None
+
+def create_end_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "end",
+            "description": "Use this function to end the current task.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action_description": {
+                        "type": "string",
+                        "description": "The description of the action",
+                    }
+                },
+                "required": []
+            }
+        }
+    }, end
+
+
+def call_agent_action(function_map, name, arguments):
+    """
+    Run a tool call against the function map
+
+    Returns:
+        tuple: (action dict, None) or (None, error message for the model)
+    """
+    if name not in function_map:
+        return None, f'"{name}" is not a supported action. Please use one of {list(function_map.keys())}.'
+
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments) if arguments.strip() else {}
+        except ValueError as e:
+            return None, f'The arguments of "{name}" are not valid JSON: {e}'
+
+    try:
+        return function_map[name](**arguments)
+    except TypeError as e:
+        return None, f'Invalid arguments for "{name}": {e}'
+
+
+def validate_json_action(function_map, action):
+    """
+    Validate an action written in the JSON format of get_action_prompt by mapping it onto the tool functions
+
+    Returns:
+        tuple: (normalized action dict, None) or (None, error message for the model)
+    """
+    if not isinstance(action, dict) or 'action_type' not in action:
+        return None, 'The output must be a JSON object with "action_type", "action_detail" and "action_description".'
+
+    action_type = action['action_type']
+    action_detail = action.get('action_detail')
+    description = action.get('action_description', '')
+
+    if action_type in ['click', 'press']:
+        arguments = {'component_id': action_detail}
+    elif action_type == 'swipe':
+        if not isinstance(action_detail, dict):
+            return None, 'The "action_detail" of a swipe must be an object with "direction", "distance" and optionally "begin_component_id".'
+        arguments = {
+            'direction': action_detail.get('direction'),
+            'distance': action_detail.get('distance'),
+            'begin_component_id': action_detail.get('begin_component_id')
+        }
+    elif action_type == 'keyboard_input':
+        arguments = {'text': action_detail}
+    elif action_type == 'special_action':
+        arguments = {'key': action_detail.get('action_type') if isinstance(action_detail, dict) else action_detail}
+    elif action_type == 'end':
+        arguments = {}
+    else:
+        return None, f'"{action_type}" is not a supported action type. Please use one of {list(function_map.keys())}.'
+
+    arguments['action_description'] = description
+    return call_agent_action(function_map, action_type, arguments)
@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import sys
 import logging
@@ -19,8 +20,9 @@ def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Interdroid: Automated Testing Tool')
     
-    # Required arguments
-    parser.add_argument('-o', '--output', required=True, help='Output directory')
+    # Required arguments (unless --eval-only is given)
+    parser.add_argument('-o', '--output', help='Output directory')
+    parser.add_argument('--eval-only', metavar='RUN_DIR', help='Re-score an existing run_* directory without running the test')
     
     # Test related parameters
     parser.add_argument('--case', type=int, help='Specify which test case to run from the Benchmark')
@@ -35,7 +37,10 @@ def parse_arguments():
     test_methods.add_argument('--action-coverage', action='store_true', help='Calculate action coverage')
     test_methods.add_argument('--exact-match', action='store_true', help='Calculate exact match rate')
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.output and not args.eval_only:
+        parser.error("the following arguments are required: -o/--output")
+    return args
 
 def parse_time(time_str):
     """Parse time string to seconds"""
@@ -63,15 +68,43 @@ def setup_output_dir(output_dir):
     
     return run_dir
 
+def load_run_case(run_dir):
+    """Benchmark case recorded in the args.json of an existing run"""
+    try:
+        with open(os.path.join(run_dir, "args.json")) as f:
+            return json.load(f).get("case")
+    except (OSError, ValueError):
+        return None
+
+def evaluate(args, run_dir):
+    """Calculate the requested metrics for a run and save them to results.json"""
+    from interdroid.evaluation import run_evaluation, METRICS
+    
+    case = args.case if args.case is not None else load_run_case(run_dir)
+    benchmark_case_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
+                                      "Benchmark", f"case_{case}") if case else None
+    # The embedding cache sits next to the runs, so benchmark screenshots are embedded once
+    output_dir = args.output or os.path.dirname(os.path.abspath(run_dir))
+    
+    metrics = [name for name in METRICS if getattr(args, name)]
+    return run_evaluation(run_dir, benchmark_case_dir, metrics, cache_dir=os.path.join(output_dir, "embedding_cache"))
+
 def main():
     """Main function"""
     args = parse_arguments()
     
+    if args.eval_only:
+        if not os.path.isdir(args.eval_only):
+            logger.error(f"Run directory not found: {args.eval_only}")
+            sys.exit(1)
+        evaluate(args, args.eval_only)
+        logger.info(f"Evaluation completed. Results saved to {args.eval_only}")
+        return
+    
     # Create output directory with timestamp
     run_dir = setup_output_dir(args.output)
     
     # Save run parameters
-    import json
     with open(os.path.join(run_dir, "args.json"), "w") as f:
         json.dump(vars(args), f, indent=2)
     
@@ -109,53 +142,10 @@ def main():
     # Run the LLM-based test
     logger.info("Starting LLM-based intelligent testing")
     from interdroid.main import main as llm_main
-    llm_main(args.record)
-    
-    # Calculate metrics if requested
-    results = {}
-    
-    if args.page_coverage:
-        from interdroid.page_coverage import calculate_page_coverage
-        benchmark_screenshots_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                               "Benchmark", f"case_{args.case}", "screenshots") if args.case else None
-        
-        if benchmark_screenshots_dir and os.path.exists(benchmark_screenshots_dir):
-            logger.info("Calculating page coverage...")
-            screenshots_dir = os.path.join(run_dir, "screenshots")
-            results["page_coverage"] = calculate_page_coverage(screenshots_dir, benchmark_screenshots_dir)
-            logger.info(f"Page coverage: {results['page_coverage']['coverage_percentage']:.2f}%")
-        else:
-            logger.warning("Benchmark screenshots directory not found, cannot calculate page coverage")
-    
-    if args.action_coverage:
-        from interdroid.action_coverage import calculate_action_coverage
-        benchmark_actions_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                            "Benchmark", f"case_{args.case}", "actions.json") if args.case else None
-        
-        if benchmark_actions_path and os.path.exists(benchmark_actions_path):
-            logger.info("Calculating action coverage...")
-            actions_json_path = os.path.join(run_dir, "actions.json")
-            results["action_coverage"] = calculate_action_coverage(actions_json_path, benchmark_actions_path)
-            logger.info(f"Action coverage: {results['action_coverage']['coverage_percentage']:.2f}%")
-        else:
-            logger.warning("Benchmark actions file not found, cannot calculate action coverage")
-    
-    if args.exact_match:
-        from interdroid.exact_match import calculate_exact_match
-        benchmark_actions_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                            "Benchmark", f"case_{args.case}", "actions.json") if args.case else None
-        
-        if benchmark_actions_path and os.path.exists(benchmark_actions_path):
-            logger.info("Calculating exact match rate...")
-            actions_json_path = os.path.join(run_dir, "actions.json")
-            results["exact_match"] = calculate_exact_match(actions_json_path, benchmark_actions_path)
-            logger.info(f"Exact match rate: {results['exact_match']['match_percentage']:.2f}%")
-        else:
-            logger.warning("Benchmark actions file not found, cannot calculate exact match rate")
-    
-    # Save results
-    with open(os.path.join(run_dir, "results.json"), "w") as f:
-        json.dump(results, f, indent=2)
+    llm_main(args.record, output_dir=run_dir)
+    
+    # Calculate metrics if requested, results.json is updated as each one finishes
+    evaluate(args, run_dir)
     
     logger.info(f"Test run completed. Results saved to {run_dir}")
 
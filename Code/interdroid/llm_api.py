@@ -1,19 +1,114 @@
 from abc import ABC, abstractmethod
 import requests
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Iterator, Tuple
+from http import HTTPStatus
 import base64
+import json
 from pathlib import Path
 import re
+import time
 import dashscope
 from openai import OpenAI
 
+from llm_usage import UsageRecord, measure_request
+from prompt_assembler import StaticPrefix
+
 class BaseLLMAPI(ABC):
     """Base class for LLM API"""
+
+    # Whether chat_completion accepts OpenAI-style `tools` and `json_mode=True`
+    supports_tools = False
+    supports_json_mode = False
+
+    # Optional llm_usage.UsageTracker; calls are tagged with the `prompt_type` and `step` kwargs
+    usage_tracker = None
+
+    # Whether to mark the end of a StaticPrefix with an explicit `cache_control` breakpoint
+    cache_control = False
     
     @abstractmethod
     def chat_completion(self, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
         pass
 
+    @abstractmethod
+    def stream_chat_completion(self, messages: List[Dict[str, Any]], **kwargs) -> Iterator[str]:
+        """Yield the generated text incrementally as it arrives from the provider"""
+        pass
+
+    @abstractmethod
+    def get_response_text(self, response: Any) -> str:
+        """Extract the generated text from a chat_completion response, raising if the request failed"""
+        pass
+
+    def get_tool_calls(self, response: Any) -> List[Tuple[str, Union[str, Dict[str, Any]]]]:
+        """Extract (function name, arguments) pairs from a chat_completion response"""
+        return []
+
+    @staticmethod
+    def parse_tool_calls(tool_calls: Optional[List[Dict[str, Any]]]) -> List[Tuple[str, Union[str, Dict[str, Any]]]]:
+        parsed = []
+        for tool_call in tool_calls or []:
+            function = tool_call.get("function", tool_call)
+            parsed.append((function["name"], function.get("arguments") or {}))
+        return parsed
+
+    def set_usage_tracker(self, usage_tracker):
+        self.usage_tracker = usage_tracker
+
+    @staticmethod
+    def normalize_usage(usage: Any) -> Tuple[int, int, int]:
+        """Map the provider specific usage block to (prompt tokens, completion tokens, cached prompt tokens)"""
+        if usage is None:
+            return 0, 0, 0
+        if not isinstance(usage, dict):
+            usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+        prompt_tokens = usage.get("prompt_tokens", usage.get("input_tokens")) or 0
+        completion_tokens = usage.get("completion_tokens", usage.get("output_tokens")) or 0
+        details = usage.get("prompt_tokens_details") or usage.get("input_tokens_details") or {}
+        cached_tokens = details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0
+        return int(prompt_tokens), int(completion_tokens), int(cached_tokens)
+
+    def _record_usage(self, formatted_messages: List[Dict[str, Any]], start: float, usage: Any, kwargs: Dict[str, Any], stream: bool = False, error: Optional[str] = None):
+        if self.usage_tracker is None:
+            return
+        prompt_tokens, completion_tokens, cached_tokens = self.normalize_usage(usage)
+        image_count, request_bytes = measure_request(formatted_messages)
+        self.usage_tracker.record(UsageRecord(
+            provider=type(self).__name__,
+            model=self.model,
+            prompt_type=kwargs.get("prompt_type", "other"),
+            step=kwargs.get("step"),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            image_count=image_count,
+            request_bytes=request_bytes,
+            latency=time.monotonic() - start,
+            stream=stream,
+            error=error
+        ))
+
+    def mark_cacheable(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a copy of a formatted message whose last content item is a cache breakpoint"""
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        content = list(content)
+        content[-1] = dict(content[-1], cache_control={"type": "ephemeral"})
+        return dict(message, content=content)
+
+    def format_messages(self, messages: List[Union[Dict[str, Any], tuple, StaticPrefix]]) -> List[Dict[str, Any]]:
+        formatted_messages = []
+        for message in messages:
+            if isinstance(message, StaticPrefix):
+                formatted_messages.extend(message.format_for(self))
+            elif isinstance(message, dict):
+                formatted_messages.append(message)
+            elif isinstance(message, tuple):
+                role, content = message
+                formatted_messages.append(self.format_message(role, content))
+        return formatted_messages
+
     @staticmethod
     def encode_image_to_base64(image_path: Union[str, Path]) -> str:
         with open(image_path, "rb") as image_file:
@@ -39,6 +134,9 @@ class BaseLLMAPI(ABC):
 
 class SiliconFlowAPI(BaseLLMAPI):
     """Silicon Flow API Implementation"""
+
+    supports_tools = True
+    supports_json_mode = True
     
     def __init__(self, api_key: str, model: str = "deepseek-ai/DeepSeek-V3"):
         self.api_key = api_key
@@ -91,8 +189,8 @@ class SiliconFlowAPI(BaseLLMAPI):
                 
         return {"role": role, "content": formatted_content}
 
-    def chat_completion(
-        self, 
+    def _build_payload(
+        self,
         messages: List[Union[Dict[str, Any], tuple]],
         stream: bool = False,
         max_tokens: int = 4096,
@@ -103,20 +201,11 @@ class SiliconFlowAPI(BaseLLMAPI):
         stop: Optional[List[str]] = None,
         **kwargs
     ) -> Dict[str, Any]:
-        
-        formatted_messages = []
-        for message in messages:
-            if isinstance(message, dict):
-                formatted_messages.append(message)
-            elif isinstance(message, tuple):
-                role, content = message
-                formatted_messages.append(self.format_message(role, content))
-                
-        import json
+        formatted_messages = self.format_messages(messages)
+
         with open('msg.json', 'w', encoding='utf-8') as f:
             json.dump(formatted_messages, f, ensure_ascii=False, indent=2)
 
-        
         payload = {
             "model": self.model,
             "messages": formatted_messages,
@@ -133,22 +222,80 @@ class SiliconFlowAPI(BaseLLMAPI):
         
         if kwargs.get("tools"):
             payload["tools"] = kwargs["tools"]
-            
-        headers = {
+            payload["tool_choice"] = kwargs.get("tool_choice", "auto")
+
+        if kwargs.get("json_mode"):
+            payload["response_format"] = {"type": "json_object"}
+
+        return payload
+
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
-        response = requests.post(self.base_url, json=payload, headers=headers)
 
-        return response.json()
+    def chat_completion(
+        self, 
+        messages: List[Union[Dict[str, Any], tuple]],
+        stream: bool = False,
+        **kwargs
+    ) -> Dict[str, Any]:
+        payload = self._build_payload(messages, stream=stream, **kwargs)
+        start = time.monotonic()
+        try:
+            response = requests.post(self.base_url, json=payload, headers=self._headers()).json()
+        except Exception as e:
+            self._record_usage(payload["messages"], start, None, kwargs, error=str(e))
+            raise
+
+        self._record_usage(payload["messages"], start, response.get("usage"), kwargs, error=None if response.get("choices") else str(response))
+        return response
+
+    def get_response_text(self, response: Dict[str, Any]) -> str:
+        if not response.get("choices"):
+            raise RuntimeError(f"SiliconFlow request failed: {response}")
+        return response["choices"][0]["message"].get("content") or ""
+
+    def get_tool_calls(self, response: Dict[str, Any]) -> List[Tuple[str, Union[str, Dict[str, Any]]]]:
+        return self.parse_tool_calls(response["choices"][0]["message"].get("tool_calls"))
+
+    def stream_chat_completion(self, messages: List[Union[Dict[str, Any], tuple]], **kwargs) -> Iterator[str]:
+        """Stream the completion as server-sent events and yield the content deltas"""
+        payload = self._build_payload(messages, stream=True, **kwargs)
+        start = time.monotonic()
+        usage = None
+        error = None
+
+        try:
+            with requests.post(self.base_url, json=payload, headers=self._headers(), stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yield content
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._record_usage(payload["messages"], start, usage, kwargs, stream=True, error=error)
 
 class DashScopeAPI(BaseLLMAPI):
     """DashScope API Implementation"""
     
-    def __init__(self, api_key: str, model: str = "qwen2.5-vl-72b-instruct"):
+    def __init__(self, api_key: str, model: str = "qwen2.5-vl-72b-instruct", cache_control: bool = False):
         dashscope.api_key = api_key
         self.model = model
+        self.cache_control = cache_control
         self._client = dashscope
         
     def process_image(self, image: Union[str, Path]) -> Dict[str, Any]:
@@ -195,32 +342,89 @@ class DashScopeAPI(BaseLLMAPI):
         **kwargs
     ) -> Dict[str, Any]:
         
-        formatted_messages = []
-        for message in messages:
-            if isinstance(message, dict):
-                formatted_messages.append(message)
-            elif isinstance(message, tuple):
-                role, content = message
-                formatted_messages.append(self.format_message(role, content))
+        formatted_messages = self.format_messages(messages)
 
-        response = self._client.MultiModalConversation.call(
-            model=self.model,
-            messages=formatted_messages,
-            stream=stream,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            top_k=top_k,
-            repetition_penalty=frequency_penalty,
-            stop=stop,
-        )
+        start = time.monotonic()
+        try:
+            response = self._client.MultiModalConversation.call(
+                model=self.model,
+                messages=formatted_messages,
+                stream=stream,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                repetition_penalty=frequency_penalty,
+                stop=stop,
+            )
+        except Exception as e:
+            self._record_usage(formatted_messages, start, None, kwargs, error=str(e))
+            raise
+
+        if not stream:
+            error = None if response["status_code"] == HTTPStatus.OK else f"{response['code']} {response['message']}"
+            self._record_usage(formatted_messages, start, response["usage"], kwargs, error=error)
         
         return response
 
+    def get_response_text(self, response: Dict[str, Any]) -> str:
+        if response["status_code"] != HTTPStatus.OK:
+            raise RuntimeError(f"DashScope request failed: {response['code']} {response['message']}")
+        content = response["output"]["choices"][0]["message"]["content"]
+        return "".join(item["text"] for item in content if "text" in item)
+
+    def stream_chat_completion(
+        self,
+        messages: List[Union[Dict[str, Any], tuple]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        frequency_penalty: float = 1.0,
+        stop: Optional[List[str]] = None,
+        **kwargs
+    ) -> Iterator[str]:
+        """Stream the completion with incremental output and yield the text deltas"""
+        formatted_messages = self.format_messages(messages)
+        start = time.monotonic()
+        usage = None
+        error = None
+
+        try:
+            responses = self._client.MultiModalConversation.call(
+                model=self.model,
+                messages=formatted_messages,
+                stream=True,
+                incremental_output=True,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                repetition_penalty=frequency_penalty,
+                stop=stop,
+            )
+
+            for chunk in responses:
+                if chunk["status_code"] != HTTPStatus.OK:
+                    raise RuntimeError(f"DashScope request failed: {chunk['code']} {chunk['message']}")
+                # usage is cumulative, the last chunk carries the totals
+                usage = chunk["usage"] or usage
+                for item in chunk["output"]["choices"][0]["message"]["content"]:
+                    if item.get("text"):
+                        yield item["text"]
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._record_usage(formatted_messages, start, usage, kwargs, stream=True, error=error)
+
 class OpenAIAPI(BaseLLMAPI):
     """OpenAI API Implementation"""
+
+    supports_tools = True
+    supports_json_mode = True
     
-    def __init__(self, api_key: str, model: str = "gpt-4-vision-preview", base_url: Optional[str] = None):
+    def __init__(self, api_key: str, model: str = "gpt-4-vision-preview", base_url: Optional[str] = None, cache_control: bool = False):
         """
         Initialize OpenAI API client
         
@@ -228,8 +432,10 @@ class OpenAIAPI(BaseLLMAPI):
             api_key: OpenAI API key
             model: Model name, default is gpt-4-vision-preview
             base_url: Base API URL for custom endpoints
+            cache_control: Send explicit cache breakpoints (for compatible endpoints that support them)
         """
         self.model = model
+        self.cache_control = cache_control
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         
     def process_image(self, image: Union[str, Path]) -> Dict[str, Any]:
@@ -302,40 +508,93 @@ class OpenAIAPI(BaseLLMAPI):
             frequency_penalty: Frequency penalty parameter
             presence_penalty: Presence penalty parameter
             stop: Stop sequences
-            **kwargs: Additional parameters
+            **kwargs: Additional parameters (`tools`/`tool_choice` for function calling, `json_mode` for JSON output)
         """
-        formatted_messages = []
-        for message in messages:
-            if isinstance(message, dict):
-                formatted_messages.append(message)
-            elif isinstance(message, tuple):
-                role, content = message
-                formatted_messages.append(self.format_message(role, content))
+        formatted_messages = self.format_messages(messages)
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=formatted_messages,
-            stream=stream,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty,
-            stop=stop,
-        )
+        extra_params = {}
+        if kwargs.get("tools"):
+            extra_params["tools"] = kwargs["tools"]
+            extra_params["tool_choice"] = kwargs.get("tool_choice", "auto")
+        if kwargs.get("json_mode"):
+            extra_params["response_format"] = {"type": "json_object"}
+        if stream:
+            extra_params["stream_options"] = {"include_usage": True}
+
+        start = time.monotonic()
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=formatted_messages,
+                stream=stream,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                frequency_penalty=frequency_penalty,
+                presence_penalty=presence_penalty,
+                stop=stop,
+                **extra_params
+            )
+        except Exception as e:
+            # streamed calls are recorded by stream_chat_completion once the stream is consumed
+            if not stream:
+                self._record_usage(formatted_messages, start, None, kwargs, error=str(e))
+            raise
         
         if stream:
             return response
+
+        self._record_usage(formatted_messages, start, response.usage, kwargs)
         
+        message = response.choices[0].message
         return {
             "choices": [{
                 "message": {
-                    "role": response.choices[0].message.role,
-                    "content": response.choices[0].message.content
+                    "role": message.role,
+                    "content": message.content,
+                    "tool_calls": [
+                        {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                        for tool_call in message.tool_calls or []
+                    ]
                 }
-            }]
+            }],
+            "usage": response.usage.model_dump() if response.usage is not None else None
         }
 
+    def get_response_text(self, response: Dict[str, Any]) -> str:
+        return response["choices"][0]["message"]["content"] or ""
+
+    def get_tool_calls(self, response: Dict[str, Any]) -> List[Tuple[str, Union[str, Dict[str, Any]]]]:
+        return self.parse_tool_calls(response["choices"][0]["message"].get("tool_calls"))
+
+    def stream_chat_completion(self, messages: List[Union[Dict[str, Any], tuple]], **kwargs) -> Iterator[str]:
+        """
+        Stream chat completion from OpenAI API and yield the content deltas
+        
+        Args:
+            messages: List of messages
+            **kwargs: Same parameters as chat_completion
+        """
+        # Format once here so the request can be measured; chat_completion passes formatted dicts through
+        formatted_messages = self.format_messages(messages)
+        kwargs["stream"] = True
+        start = time.monotonic()
+        usage = None
+        error = None
+
+        try:
+            for chunk in self.chat_completion(formatted_messages, **kwargs):
+                # with include_usage the final chunk has no choices and carries the usage
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._record_usage(formatted_messages, start, usage, kwargs, stream=True, error=error)
+
 # Usage examples
 if __name__ == "__main__":
     # api = SiliconFlowAPI(
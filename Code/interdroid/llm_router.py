@@ -0,0 +1,340 @@
+"""
+Failover and hedged-request router over multiple LLM providers
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional, Union, Iterator, Tuple
+
+from llm_api import BaseLLMAPI, SiliconFlowAPI, DashScopeAPI, OpenAIAPI
+
+logger = logging.getLogger('llm_router')
+
+
+class AllProvidersFailedError(RuntimeError):
+    """Raised when no provider could answer a request"""
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__("All LLM providers failed: " + "; ".join(errors))
+
+
+class LatencyHistogram:
+    """Latency histogram with fixed log-scale buckets (in seconds) and a sliding window for percentiles"""
+
+    BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, window: int = 256):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS, latency)] += 1
+            self.samples.append(latency)
+            self.count += 1
+            self.total += latency
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"<={bound}s" for bound in self.BUCKETS] + [f">{self.BUCKETS[-1]}s"]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class ProviderState:
+    """Health and latency tracking for a single provider"""
+
+    def __init__(self, name: str, client: BaseLLMAPI, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.name = name
+        self.client = client
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.completion_latency = LatencyHistogram()
+        self.first_token_latency = LatencyHistogram()
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.unhealthy_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_success(self, latency: float, first_token: bool = False):
+        (self.first_token_latency if first_token else self.completion_latency).observe(latency)
+        with self._lock:
+            self.consecutive_failures = 0
+            self.total_successes += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                # Take the provider out of rotation; it is retried once the cooldown expires
+                self.unhealthy_until = time.monotonic() + self.cooldown
+                logger.warning(f"Provider {self.name} marked unhealthy for {self.cooldown}s after {self.consecutive_failures} consecutive failures")
+
+
+class LLMRouter(BaseLLMAPI):
+    """
+    Route requests over several BaseLLMAPI backends
+
+    Providers are ordered by health and median latency. A failing provider is
+    skipped in favour of the next one, and with hedging enabled a second
+    provider is fired when the first has not answered within its latency
+    percentile. Responses are normalized to the OpenAI-style dict returned by
+    OpenAIAPI, with the answering provider under "provider".
+    """
+
+    def __init__(
+        self,
+        providers: List[Tuple[str, BaseLLMAPI]],
+        hedge: bool = False,
+        hedge_percentile: float = 95,
+        initial_hedge_delay: float = 10.0,
+        min_hedge_delay: float = 1.0,
+        failure_threshold: int = 3,
+        cooldown: float = 60.0
+    ):
+        if not providers:
+            raise ValueError("LLMRouter requires at least one provider")
+        self.providers = [ProviderState(name, client, failure_threshold, cooldown) for name, client in providers]
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.providers), thread_name_prefix='llm_router')
+
+    @property
+    def supports_tools(self) -> bool:
+        # Providers without tool support answer in text, which callers parse as a fallback
+        return any(provider.client.supports_tools for provider in self.providers)
+
+    @property
+    def supports_json_mode(self) -> bool:
+        return any(provider.client.supports_json_mode for provider in self.providers)
+
+    def set_usage_tracker(self, usage_tracker):
+        # Usage is recorded by the backends, so hedged and failed attempts are accounted too
+        self.usage_tracker = usage_tracker
+        for provider in self.providers:
+            provider.client.set_usage_tracker(usage_tracker)
+
+    def _ranked_providers(self) -> List[ProviderState]:
+        def sort_key(item):
+            index, provider = item
+            median = provider.completion_latency.percentile(50)
+            # Providers without samples yet keep their configured order ahead of measured ones
+            return (not provider.healthy, median if median is not None else 0.0, index)
+
+        return [provider for _, provider in sorted(enumerate(self.providers), key=sort_key)]
+
+    def _hedge_delay(self, provider: ProviderState) -> float:
+        threshold = provider.completion_latency.percentile(self.hedge_percentile)
+        if threshold is None:
+            threshold = self.initial_hedge_delay
+        return max(self.min_hedge_delay, threshold)
+
+    def _call(self, provider: ProviderState, messages, kwargs) -> Dict[str, Any]:
+        kwargs = dict(kwargs)
+        if not provider.client.supports_tools:
+            kwargs.pop("tools", None)
+            kwargs.pop("tool_choice", None)
+        if not provider.client.supports_json_mode:
+            kwargs.pop("json_mode", None)
+
+        start = time.monotonic()
+        try:
+            response = provider.client.chat_completion(messages, **kwargs)
+            text = provider.client.get_response_text(response)
+            tool_calls = provider.client.get_tool_calls(response)
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - start)
+
+        return {
+            "choices": [{
+                "message": {
+                    "role": "assistant",
+                    "content": text,
+                    "tool_calls": [{"name": name, "arguments": arguments} for name, arguments in tool_calls]
+                }
+            }],
+            "provider": provider.name
+        }
+
+    def chat_completion(self, messages: List[Union[Dict[str, Any], tuple]], **kwargs) -> Dict[str, Any]:
+        kwargs.pop("stream", None)
+        ranked = self._ranked_providers()
+        if self.hedge and len(ranked) > 1:
+            return self._hedged_completion(ranked, messages, kwargs)
+
+        errors = []
+        for provider in ranked:
+            try:
+                return self._call(provider, messages, kwargs)
+            except Exception as e:
+                logger.warning(f"Provider {provider.name} failed: {e}")
+                errors.append(f"{provider.name}: {e}")
+
+        raise AllProvidersFailedError(errors)
+
+    def _hedged_completion(self, ranked: List[ProviderState], messages, kwargs) -> Dict[str, Any]:
+        candidates = iter(ranked)
+        futures = {}
+        errors = []
+
+        def launch():
+            provider = next(candidates, None)
+            if provider is not None:
+                futures[self._executor.submit(self._call, provider, messages, kwargs)] = provider
+            return provider
+
+        primary = launch()
+        hedged = False
+
+        while futures:
+            timeout = None if hedged else self._hedge_delay(primary)
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # The primary is slower than its usual percentile, race a second provider against it
+                hedged = True
+                backup = launch()
+                if backup is not None:
+                    logger.info(f"Provider {primary.name} exceeded {timeout:.1f}s, hedging with {backup.name}")
+                continue
+
+            for future in done:
+                provider = futures.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    logger.warning(f"Provider {provider.name} failed: {e}")
+                    errors.append(f"{provider.name}: {e}")
+                    replacement = launch()
+                    if provider is primary and replacement is not None:
+                        # The failover provider takes the primary's place, hedging then waits on its latency
+                        primary = replacement
+
+        raise AllProvidersFailedError(errors)
+
+    def stream_chat_completion(self, messages: List[Union[Dict[str, Any], tuple]], **kwargs) -> Iterator[str]:
+        """Stream from the best provider, failing over to the next one until the first chunk has arrived"""
+        errors = []
+        for provider in self._ranked_providers():
+            start = time.monotonic()
+            try:
+                stream = provider.client.stream_chat_completion(messages, **kwargs)
+                # Skip empty deltas (e.g. the role-only first chunk), a stream without any text is a failure
+                first_chunk = next((chunk for chunk in stream if chunk), None)
+            except Exception as e:
+                provider.record_failure()
+                logger.warning(f"Provider {provider.name} failed: {e}")
+                errors.append(f"{provider.name}: {e}")
+                continue
+            if first_chunk is None:
+                provider.record_failure()
+                logger.warning(f"Provider {provider.name} returned an empty response")
+                errors.append(f"{provider.name}: empty response")
+                continue
+
+            provider.record_success(time.monotonic() - start, first_token=True)
+            yield first_chunk
+            try:
+                yield from stream
+            except Exception:
+                # Too late to fail over once text was yielded, but the error still counts against the provider
+                provider.record_failure()
+                raise
+            return
+
+        raise AllProvidersFailedError(errors)
+
+    def get_response_text(self, response: Dict[str, Any]) -> str:
+        return response["choices"][0]["message"]["content"]
+
+    def get_tool_calls(self, response: Dict[str, Any]) -> List[Tuple[str, Union[str, Dict[str, Any]]]]:
+        return self.parse_tool_calls(response["choices"][0]["message"].get("tool_calls"))
+
+    def get_latency_histograms(self) -> Dict[str, Any]:
+        """Per-provider latency histograms and health counters"""
+        return {
+            provider.name: {
+                "healthy": provider.healthy,
+                "successes": provider.total_successes,
+                "failures": provider.total_failures,
+                "completion_latency": provider.completion_latency.to_dict(),
+                "first_token_latency": provider.first_token_latency.to_dict()
+            }
+            for provider in self.providers
+        }
+
+
+PROVIDER_FACTORIES = {
+    'openai': lambda llm: OpenAIAPI(
+        api_key=llm['openai_api_key'],
+        model=llm['openai_model'],
+        base_url=llm.get('openai_base_url'),
+        cache_control=str(llm.get('openai_cache_control', 'false')).lower() == 'true'
+    ),
+    'dashscope': lambda llm: DashScopeAPI(
+        api_key=llm['dashscope_api_key'],
+        model=llm['dashscope_model'],
+        cache_control=str(llm.get('dashscope_cache_control', 'false')).lower() == 'true'
+    ),
+    'siliconflow': lambda llm: SiliconFlowAPI(
+        api_key=llm['siliconflow_api_key'],
+        model=llm['siliconflow_model']
+    ),
+}
+
+
+def create_llm_client(config) -> LLMRouter:
+    """
+    Create the action LLM client from config.ini
+
+    The [router] section lists the providers in order of preference; each
+    provider reads its key and model from the [llm] section. Without a
+    [router] section only the OpenAI provider is used.
+    """
+    router_config = config['router'] if config.has_section('router') else {}
+    names = [name.strip() for name in router_config.get('providers', 'openai').split(',') if name.strip()]
+
+    providers = []
+    for name in names:
+        if name not in PROVIDER_FACTORIES:
+            raise ValueError(f"Unknown LLM provider in config.ini: {name}")
+        providers.append((name, PROVIDER_FACTORIES[name](config['llm'])))
+
+    return LLMRouter(
+        providers,
+        hedge=str(router_config.get('hedge', 'false')).lower() == 'true',
+        hedge_percentile=float(router_config.get('hedge_percentile', 95)),
+        initial_hedge_delay=float(router_config.get('initial_hedge_delay', 10)),
+        failure_threshold=int(router_config.get('failure_threshold', 3)),
+        cooldown=float(router_config.get('cooldown', 60))
+    )
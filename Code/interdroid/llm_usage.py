@@ -0,0 +1,149 @@
+"""
+Token and cost accounting for LLM calls
+"""
+
+import json
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional, Tuple
+
+
+@dataclass
+class UsageRecord:
+    provider: str = field(
+        default=None, metadata={"desc": "Client class that served the call"}
+    )
+    model: str = field(
+        default=None, metadata={"desc": "Model name"}
+    )
+    prompt_type: str = field(
+        default="other", metadata={"desc": "Which prompt was sent (action, monitor, reference, ...)"}
+    )
+    step: Optional[int] = field(
+        default=None, metadata={"desc": "Agent step the call belongs to"}
+    )
+    prompt_tokens: int = field(
+        default=0, metadata={"desc": "Input tokens reported by the provider"}
+    )
+    completion_tokens: int = field(
+        default=0, metadata={"desc": "Output tokens reported by the provider"}
+    )
+    cached_tokens: int = field(
+        default=0, metadata={"desc": "Prompt tokens served from the provider's prompt cache"}
+    )
+    image_count: int = field(
+        default=0, metadata={"desc": "Number of images in the request"}
+    )
+    request_bytes: int = field(
+        default=0, metadata={"desc": "Size of the serialized request messages"}
+    )
+    latency: float = field(
+        default=0.0, metadata={"desc": "Wall time of the call in seconds"}
+    )
+    stream: bool = field(
+        default=False, metadata={"desc": "Whether the response was streamed"}
+    )
+    error: Optional[str] = field(
+        default=None, metadata={"desc": "Error message if the call failed"}
+    )
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def measure_request(formatted_messages: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Count the images and serialized bytes of already formatted messages"""
+    image_count = 0
+    for message in formatted_messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for item in content:
+                if isinstance(item, dict) and (item.get("type") == "image_url" or "image" in item):
+                    image_count += 1
+
+    request_bytes = len(json.dumps(formatted_messages, ensure_ascii=False).encode('utf-8'))
+    return image_count, request_bytes
+
+
+class UsageTracker:
+    """
+    Collect UsageRecords from every LLM client and aggregate them
+
+    Args:
+        prices (dict): Optional model -> (prompt price, completion price) per 1K tokens
+    """
+
+    AGGREGATE_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "image_count", "request_bytes", "latency")
+
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.prices = prices or {}
+        self.records: List[UsageRecord] = []
+        self._lock = threading.Lock()
+
+    def record(self, usage_record: UsageRecord):
+        with self._lock:
+            self.records.append(usage_record)
+
+    def cost(self, usage_record: UsageRecord) -> Optional[float]:
+        # config keys are lowercased by configparser
+        price = self.prices.get(str(usage_record.model).lower())
+        if price is None:
+            return None
+        prompt_price, completion_price = price
+        return (usage_record.prompt_tokens * prompt_price + usage_record.completion_tokens * completion_price) / 1000
+
+    def _aggregate(self, records: List[UsageRecord]) -> Dict[str, Any]:
+        totals = {name: 0 for name in self.AGGREGATE_FIELDS}
+        totals["calls"] = len(records)
+        totals["failed_calls"] = 0
+        totals["cost"] = 0.0 if self.prices else None
+
+        for usage_record in records:
+            for name in self.AGGREGATE_FIELDS:
+                totals[name] += getattr(usage_record, name)
+            if usage_record.error is not None:
+                totals["failed_calls"] += 1
+            cost = self.cost(usage_record)
+            if cost is not None:
+                totals["cost"] += cost
+
+        totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+        totals["cache_hit_rate"] = totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else None
+        return totals
+
+    def _group_by(self, key: str, records: List[UsageRecord]) -> Dict[str, Any]:
+        groups = defaultdict(list)
+        for usage_record in records:
+            groups[str(getattr(usage_record, key))].append(usage_record)
+        return {name: self._aggregate(group) for name, group in groups.items()}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            records = list(self.records)
+
+        return {
+            "run": self._aggregate(records),
+            "per_step": self._group_by("step", records),
+            "per_prompt_type": self._group_by("prompt_type", records),
+            "per_provider": self._group_by("provider", records),
+            "calls": [usage_record.to_dict() for usage_record in records]
+        }
+
+    def save(self, output_path: str):
+        """Write the aggregates atomically, so the file can be refreshed after every step"""
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_path, output_path)
+
+
+def load_prices(config) -> Dict[str, Tuple[float, float]]:
+    """Read `model = prompt_price, completion_price` (per 1K tokens) entries from the [pricing] section"""
+    prices = {}
+    if config.has_section('pricing'):
+        for model, value in config['pricing'].items():
+            prompt_price, completion_price = [float(price) for price in value.split(',')]
+            prices[model.lower()] = (prompt_price, completion_price)
+    return prices
@@ -3,11 +3,16 @@ import os
 import json
 import time
 import shutil
+import threading
 from PIL import Image
 import base64
 import cv2
 
 from llm_api import DashScopeAPI, OpenAIAPI
+from llm_router import create_llm_client, AllProvidersFailedError
+from llm_usage import UsageTracker, load_prices
+from prompt_assembler import StaticPrefix, assemble_messages
+from functions.agent_actions import initialize_agent_actions, call_agent_action, validate_json_action
 from record import Record
 from logger import Log
 # from build_rag_dataset_local import RAGDatasetBuilder
@@ -16,10 +21,135 @@ from prompts import *
 from utils import *
 from actions import *
 
+# Seconds to wait before asking again after a failed action request, doubled after every further failure
+LLM_RETRY_DELAY = 10
+MAX_LLM_RETRY_DELAY = 120
 
+# Failed action requests in a row (no provider answered, or no usable action) after which the run ends
+MAX_CONSECUTIVE_FAILURES = 5
 
-def main(specified_record=None):
+# Number of times an unusable action is sent back to the model for correction
+MAX_ACTION_REPAIRS = 2
+
+
+class ActionParseError(Exception):
+    """Raised when the model did not produce a usable action within the repair budget"""
+    pass
+
+
+# Thread finishing the last streamed response, joined before the next LLM request
+_drain_thread = None
+
+
+def join_stream_drain():
+    """Wait until the rest of the last streamed response has been received and logged"""
+    global _drain_thread
+    if _drain_thread is not None:
+        _drain_thread.join()
+        _drain_thread = None
+
+
+def stream_next_action(llm_client, messages, logger, **kwargs):
+    """
+    Stream the LLM response and return as soon as the first complete action JSON is available
+
+    The rest of the response (usually the model's explanation) is drained in a
+    background thread and logged, so the action can be executed while the
+    model is still generating. The thread is joined by join_stream_drain(),
+    which runs before the next request.
+
+    Returns:
+        tuple: (action dict, response text up to the end of the action JSON, not the full response)
+    """
+    join_stream_drain()
+    stream = llm_client.stream_chat_completion(messages, **kwargs)
+    extractor = IncrementalJSONExtractor()
+
+    for chunk in stream:
+        if extractor.feed(chunk) is not None:
+            break
+
+    if extractor.result is None:
+        logger.info(f"LLM response: {extractor.buffer}")
+        return None, extractor.buffer
+
+    partial_response = extractor.buffer
+
+    def drain():
+        try:
+            for chunk in stream:
+                extractor.feed(chunk)
+        except Exception as e:
+            logger.warning(f"Error while draining LLM stream: {e}")
+        logger.info(f"LLM response: {extractor.buffer}")
+
+    global _drain_thread
+    _drain_thread = threading.Thread(target=drain, daemon=True)
+    _drain_thread.start()
+
+    return extractor.result, partial_response
+
+
+def request_next_action(llm_client, messages, component_ids, logger, action_mode='tools', max_repairs=MAX_ACTION_REPAIRS, step=None):
+    """
+    Ask the LLM for the next action and validate it against the current screen
+
+    With action_mode 'tools' the action tools are offered through native
+    function calling, 'json' asks for JSON output, and 'stream' parses the
+    streamed text (also used when the client supports neither). Unusable
+    answers are sent back with the error for at most max_repairs corrections.
+
+    Returns:
+        tuple: (action dict, raw response text, only up to the action JSON when streamed)
+    """
+    tools, function_map = initialize_agent_actions(component_ids)
+    conversation = list(messages)
+    error = None
+
+    for attempt in range(max_repairs + 1):
+        usage_tags = {"prompt_type": "action" if attempt == 0 else "action_repair", "step": step}
+        if action_mode == 'tools' and llm_client.supports_tools:
+            response = llm_client.chat_completion(conversation, max_tokens=512, tools=list(tools.values()), tool_choice="required", **usage_tags)
+            logger.info(f"LLM response: {response}")
+            text = llm_client.get_response_text(response)
+            tool_calls = llm_client.get_tool_calls(response)
+            if tool_calls:
+                name, arguments = tool_calls[0]
+                action, error = call_agent_action(function_map, name, arguments)
+                text = text or f"{name}({arguments})"
+            else:
+                action, error = validate_json_action(function_map, IncrementalJSONExtractor().feed(text))
+        elif action_mode == 'json' and llm_client.supports_json_mode:
+            response = llm_client.chat_completion(conversation, max_tokens=512, json_mode=True, **usage_tags)
+            logger.info(f"LLM response: {response}")
+            text = llm_client.get_response_text(response)
+            action, error = validate_json_action(function_map, IncrementalJSONExtractor().feed(text))
+        else:
+            action, text = stream_next_action(llm_client, conversation, logger, max_tokens=512, **usage_tags)
+            action, error = validate_json_action(function_map, action)
+
+        if error is None:
+            return action, text
+
+        logger.warning(f"Unusable action (attempt {attempt + 1}/{max_repairs + 1}): {error}")
+        conversation = conversation + [
+            ("assistant", [text or "<empty response>"]),
+            ("user", [get_action_repair_prompt(error)])
+        ]
+
+    raise ActionParseError(error)
+
+
+def save_llm_stats(llm_client, usage_tracker, output_dir):
+    """Write the token/cost accounting and provider latency histograms to the output directory"""
+    usage_tracker.save(os.path.join(output_dir, 'llm_usage.json'))
+    with open(os.path.join(output_dir, 'llm_latency.json'), 'w', encoding='utf-8') as f:
+        json.dump(llm_client.get_latency_histograms(), f, indent=2)
+
+
+def main(specified_record=None, output_dir=None):
     action_history = []
+    output_dir = output_dir or os.getcwd()
     original_app = None  # Will be set when recording the first action
     reference_steps_count = 0
     
@@ -27,10 +157,10 @@ def main(specified_record=None):
     config = configparser.ConfigParser()
     config.read('config.ini')
 
-    llm_client = OpenAIAPI(
-        api_key=config['llm']['openai_api_key'],
-        model=config['llm']['openai_model']
-    )
+    llm_client = create_llm_client(config)
+    usage_tracker = UsageTracker(load_prices(config))
+    llm_client.set_usage_tracker(usage_tracker)
+    action_mode = config['llm'].get('action_mode', 'tools')
 
     # initialize logger
     logger = Log().logger
@@ -130,79 +260,63 @@ def main(specified_record=None):
     screenshots_dir = os.path.join(data_dir, similar_record, "screenshots")
     first_screenshot_path = os.path.join(screenshots_dir, "step_0.png")
 
-    # Add previous user question and assistant answer to chat_history
-    chat_history = []
+    # The reference example is sent in front of every step as a byte-identical StaticPrefix,
+    # so providers with prompt caching only bill it in full once per task
+    reference_prefix = None
 
-    # If similar record is found, add it to chat_history as in-context learning example
+    # If similar record is found, add it to the prefix as in-context learning example
     if similar_record and os.path.exists('combined_screenshots.png'):
 
-        chat_history.append(
+        reference_messages = [
             ("user", [
                 first_screenshot_path,
                 get_reference_question_prompt(similar_record_data.get('target'))
-            ])
-        )
-
-        logger.info(("user", [
-            first_screenshot_path,
-            get_reference_question_prompt(similar_record_data.get('target'))
-        ]))
-            
-
-        chat_history.append(
+            ]),
             ("assistant", [
                 "./combined_screenshots.png",
                 get_reference_answer_prompt(similar_record_data.get('target'), similar_record_data.get('steps'))
             ])
-        )
-
-        logger.info(("assistant", [
-            "./combined_screenshots.png",
-            get_reference_answer_prompt(similar_record_data.get('target'), similar_record_data.get('steps'))
-        ]))
-
-        chat_history.append(
-            ("user", [
-                get_thinking_prompt()
-            ])
-        )
+        ]
+        for message in reference_messages:
+            logger.info(message)
+        reference_prefix = StaticPrefix(reference_messages)
 
-        logger.info(("user", [
+        thinking_message = ("user", [
             get_thinking_prompt()
-        ]))
-
-        response = llm_client.chat_completion(chat_history, max_tokens=1024)
+        ])
 
-        logger.info(f"LLM response: {response}")
+        logger.info(thinking_message)
 
         try:
-            inference = response["output"]["choices"][0]["message"]["content"][0]['text']
-        except:
+            response = llm_client.chat_completion(assemble_messages(reference_prefix, thinking_message), max_tokens=1024, prompt_type="reference", step=record.current_steps)
+            logger.info(f"LLM response: {response}")
+            inference = llm_client.get_response_text(response)
+        except AllProvidersFailedError as e:
+            logger.error(f"Reference analysis failed: {e}")
             inference = "LLM call failed"
 
         # print(inference)
 
         logger.info(inference)
 
-        chat_history.append(
+        reference_prefix = reference_prefix.extend([
+            thinking_message,
             ("assistant", [
                 inference
             ])
-        )
+        ])
 
         # input("Press Enter to continue...")
-    # This processing can shorten context and reduce token consumption
-    processed_chat_history = chat_history
         
 
     # Initialize monitor_feedback
     monitor_feedback = None
 
+    # Action requests that failed in a row at the current step
+    consecutive_failures = 0
+
     # Modify this part to loop until receiving end instruction
     while True:
-        # Reset chat_history to processed_chat_history in each loop
-        # This processing can shorten context and reduce token consumption
-        chat_history = processed_chat_history
         # Record initial application
         if not original_app and record.get_running_info():
             original_app = record.get_running_info().get('app', '')
@@ -218,19 +332,7 @@ def main(specified_record=None):
         processed_screenshot_path = 'processed_current_screenshot.png'
         cv2.imwrite(processed_screenshot_path, processed_screenshot)
 
-        chat_history.append(
-            ("user", [
-                processed_screenshot_path,
-                get_action_prompt(
-                    similar_record_data.get('target'), 
-                    str(current_component_info), 
-                    str(action_history),
-                    monitor_feedback
-                )
-            ])
-        )
-
-        logger.info(("user", [
+        step_message = ("user", [
             processed_screenshot_path,
             get_action_prompt(
                 similar_record_data.get('target'), 
@@ -238,26 +340,42 @@ def main(specified_record=None):
                 str(action_history),
                 monitor_feedback
             )
-        ]))
+        ])
 
-        # Reset monitor_feedback
-        monitor_feedback = None
-        
-        # Call LLM to generate next action
-        response = llm_client.chat_completion(chat_history, max_tokens=512)
-
-        logger.info(f"LLM response: {response}")
+        logger.info(step_message)
 
-        # input("Press Enter to continue...")
+        # Only the current step follows the reference prefix, this shortens context and reduces token consumption
+        chat_history = assemble_messages(reference_prefix, step_message)
 
+        # Call LLM to generate next action
         try:
-            next_steps = response["output"]["choices"][0]["message"]["content"][0]['text']
-        except:
-            next_steps = "LLM call failed"
+            json_next_steps, next_steps = request_next_action(
+                llm_client,
+                chat_history,
+                [item['id'] for item in current_component_info],
+                logger,
+                action_mode=action_mode,
+                step=record.current_steps
+            )
+        except (AllProvidersFailedError, ActionParseError) as e:
+            consecutive_failures += 1
+            reason = "No LLM provider answered" if isinstance(e, AllProvidersFailedError) else f"No usable action after {MAX_ACTION_REPAIRS} repairs"
+            if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                logger.error(f"{reason}, giving up after {consecutive_failures} failed requests at step {record.current_steps}: {e}")
+                break
+            delay = min(LLM_RETRY_DELAY * 2 ** (consecutive_failures - 1), MAX_LLM_RETRY_DELAY)
+            logger.error(f"{reason} ({consecutive_failures}/{MAX_CONSECUTIVE_FAILURES}), retrying in {delay}s: {e}")
+            time.sleep(delay)
+            continue
+
+        consecutive_failures = 0
+
+        # Reset monitor_feedback
+        monitor_feedback = None
 
+        # When streamed, this is the response up to the action, the full text is logged once received
         print(next_steps)
         
-        json_next_steps = extract_json_from_str(next_steps)
         logger.info(f"LLM suggested next action: {str(json_next_steps)}")
         action_history.append(json_next_steps)
 
@@ -279,10 +397,12 @@ def main(specified_record=None):
 
             print("monitor running...")
             
-            monitor_response = llm_client.chat_completion(monitor_history, max_tokens=512)
+            monitor_response = None
             
             try:
-                monitor_result = monitor_response["output"]["choices"][0]["message"]["content"][0]['text']
+                join_stream_drain()
+                monitor_response = llm_client.chat_completion(monitor_history, max_tokens=512, prompt_type="monitor", step=record.current_steps)
+                monitor_result = llm_client.get_response_text(monitor_response)
                 monitor_result = extract_json_from_str(monitor_result)
                     
                 logger.info(f"Monitor analysis: {monitor_result}")
@@ -349,8 +469,8 @@ def main(specified_record=None):
                 draw_text_action(record.current_steps, f"Input: {action_detail}")
                 keyboard_input(action_detail, record.device_name)
             elif action_type == "special_action":
-                draw_text_action(record.current_steps, f"Special Action: {action_detail['action_type']}")
-                special_action(action_detail['action_type'], record.device_name)
+                draw_text_action(record.current_steps, f"Special Action: {action_detail}")
+                special_action(action_detail, record.device_name)
             else:
                 raise ValueError(f"action type {action_type} not supported")
         
@@ -362,6 +482,12 @@ def main(specified_record=None):
         current_component_path = record.get_cur_components_path()
         logger.info(f"Updated page information - Screenshot path: {current_screenshot_path}")
 
+        save_llm_stats(llm_client, usage_tracker, output_dir)
+
+    join_stream_drain()
+    logger.info(f"LLM provider latency: {json.dumps(llm_client.get_latency_histograms())}")
+    logger.info(f"LLM usage: {json.dumps(usage_tracker.summary()['run'])}")
+    save_llm_stats(llm_client, usage_tracker, output_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,283 @@
+"""
+Append-only checkpoint log of the agent memory
+
+A checkpoint file starts with MAGIC and is followed by frames of
+(payload length, CRC32) headers and JSON payloads. Every frame holds what
+changed since the previous one: new working memory steps, new or updated
+task results, the widget_knowledge_map entries touched since the last frame
+and the storage entry ids. Restoring replays the frames in order; a frame
+cut short by a crash fails its length or CRC check and ends the replay.
+The log is compacted into a single full frame once it has compact_after
+frames, so restore time stays bounded on long runs.
+
+Nothing is unpickled, but the payloads only keep the JSON form of the
+memory: tasks come back without their explored GUI states, working memory
+actions as RestoredAction without a target widget, and droidbot events in
+task results as their to_dict() form.
+"""
+
+from collections import defaultdict
+import logging
+import json
+import os
+import struct
+import time
+import zlib
+
+from .working_memory import WorkingMemory
+from ..types.action import Action
+from ..types.task import Task
+
+logger = logging.getLogger('memory')
+
+MAGIC = b'IDMEMCK1'
+FRAME_HEADER = struct.Struct('>II')
+
+
+def write_frame(f, payload):
+    f.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)))
+    f.write(payload)
+
+
+def read_frames(path):
+    """Return the payloads of all complete frames of a checkpoint file and the offset where they end"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if not data.startswith(MAGIC):
+        raise ValueError(f'{path} is not a memory checkpoint')
+
+    frames = []
+    offset = len(MAGIC)
+    while offset + FRAME_HEADER.size <= len(data):
+        length, crc = FRAME_HEADER.unpack_from(data, offset)
+        payload = data[offset + FRAME_HEADER.size:offset + FRAME_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning(f'Ignoring incomplete checkpoint frame at byte {offset} of {path}')
+            break
+        frames.append(payload)
+        offset += FRAME_HEADER.size + length
+    return frames, offset
+
+
+def json_default(value):
+    # droidbot events and anything else with a dict form, the rest is kept as text
+    to_dict = getattr(value, 'to_dict', None)
+    return to_dict() if callable(to_dict) else str(value)
+
+
+class RestoredAction(Action):
+    """
+    Working memory action read back from a checkpoint
+
+    Renders and records like the action it was exported from, but its target
+    widget is gone and its events are their dict forms.
+    """
+
+    def __init__(self, exported):
+        super().__init__()
+        self.event_type = exported['event_type']
+        self.text = exported['text']
+        self.direction = exported['direction']
+        self.name = exported['name']
+        self.events = exported['events']
+        self.action_str = exported['action_str']
+        self.action_record_str = exported['action_record_str']
+        self.reproducible_record = exported['reproducible_record']
+
+    def get_action_str(self):
+        return self.action_str
+
+    def get_action_record_str(self):
+        return self.action_record_str
+
+    def get_reproducible_record(self):
+        return dict(self.reproducible_record)
+
+
+def export_step_description(description):
+    if not isinstance(description, Action):
+        return {'text': description}
+    return {'action': {
+        'event_type': description.event_type,
+        'text': description.text,
+        'direction': description.direction,
+        'name': description.name,
+        'events': [json_default(event) for event in description.events],
+        'action_str': description.get_action_str(),
+        'action_record_str': description.get_action_record_str(),
+        'reproducible_record': description.get_reproducible_record()
+    }}
+
+
+def import_step_description(exported):
+    if 'action' in exported:
+        return RestoredAction(exported['action'])
+    return exported['text']
+
+
+def export_task(task):
+    return task.to_dict() if task is not None else None
+
+
+def import_task(exported):
+    return Task.from_dict(exported) if exported is not None else None
+
+
+def export_widget_entry(entry):
+    exported = dict(entry)
+    exported['action_count'] = dict(entry.get('action_count', {}))
+    return exported
+
+
+def import_widget_entry(entry):
+    imported = dict(entry)
+    imported['action_count'] = defaultdict(lambda: 0, entry.get('action_count', {}))
+    return imported
+
+
+class MemoryCheckpoint:
+    """
+    Periodic checkpoints of a Memory into an append-only log
+
+    Args:
+        memory (Memory): Memory to checkpoint
+        path (str): Checkpoint file
+        every_n_steps (int): Write a frame every this many step_completed() calls
+        compact_after (int): Rewrite the log as one full frame once it has this many frames
+    """
+
+    def __init__(self, memory, path, every_n_steps=10, compact_after=100):
+        self.memory = memory
+        self.path = path
+        self.every_n_steps = every_n_steps
+        self.compact_after = compact_after
+        self.steps_since_write = 0
+        self.frame_count = 0
+        self._mark_written()
+
+    def _mark_written(self):
+        # Remember what the log already covers, the next frame only carries what changed since
+        self._working_memory = self.memory.working_memory
+        self._written_steps = len(self.memory.working_memory.steps)
+        self._written_task = self.memory.working_memory.task
+        self.memory.task_memory.dirty_results.clear()
+        self.memory.widget_knowledge.dirty_widgets.clear()
+
+    def _delta(self, full=False):
+        memory = self.memory
+        working_memory = memory.working_memory
+        reset = full or working_memory is not self._working_memory or len(working_memory.steps) < self._written_steps
+        new_steps = working_memory.steps if reset else working_memory.steps[self._written_steps:]
+
+        task_results = memory.task_memory.task_results
+        if not full:
+            task_results = {summary: task_results[summary] for summary in memory.task_memory.dirty_results if summary in task_results}
+
+        knowledge_map = memory.widget_knowledge.widget_knowledge_map
+        if full:
+            widgets = [(page, signature) for page, entries in knowledge_map.items() for signature in entries]
+        else:
+            widgets = [(page, signature) for page, signature in memory.widget_knowledge.dirty_widgets
+                       if signature in knowledge_map.get(page, {})]
+        summary_cache = memory.widget_knowledge.summary_cache
+
+        return {
+            'full': full,
+            'written_at': time.time(),
+            'working_memory': {
+                'reset': reset,
+                'task': export_task(working_memory.task) if reset or working_memory.task is not self._written_task else None,
+                'steps': [(export_step_description(step.description), step.step_type, step.created_at, step.page) for step in new_steps]
+            },
+            'task_results': task_results,
+            'widget_knowledge': [
+                (page, signature, export_widget_entry(knowledge_map[page][signature]), summary_cache.get((page, signature)))
+                for page, signature in widgets
+            ],
+            'entry_ids': {'history': memory.history.entry_id, 'knowledge': memory.knowledge.entry_id}
+        }
+
+    def write(self, full=False):
+        """Append a frame with the changes since the last one (or everything when full)"""
+        start = time.time()
+        # Storage ids in the frame must refer to entries that are actually stored
+        self.memory.flush()
+
+        full = full or self.frame_count == 0 or self.frame_count >= self.compact_after
+        payload = json.dumps(self._delta(full=full), default=json_default, separators=(',', ':')).encode('utf-8')
+
+        if full:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC)
+                write_frame(f, payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.frame_count = 1
+        else:
+            with open(self.path, 'ab') as f:
+                write_frame(f, payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self.frame_count += 1
+
+        self._mark_written()
+        self.steps_since_write = 0
+        logger.info(f'Wrote {"full" if full else "incremental"} memory checkpoint ({len(payload)} bytes) in {time.time() - start:.2f}s')
+
+    def step(self):
+        """Count an agent step and write a frame every every_n_steps steps"""
+        self.steps_since_write += 1
+        if self.steps_since_write >= self.every_n_steps:
+            self.write()
+
+    def _apply(self, frame):
+        memory = self.memory
+
+        working_memory_frame = frame['working_memory']
+        if working_memory_frame['reset']:
+            memory.working_memory = WorkingMemory(import_task(working_memory_frame['task']))
+        elif working_memory_frame['task'] is not None:
+            memory.working_memory.register_task(import_task(working_memory_frame['task']))
+        for description, step_type, created_at, page in working_memory_frame['steps']:
+            memory.working_memory.add_step(import_step_description(description), page, step_type=step_type, created_at=created_at)
+
+        memory.task_memory.task_results.update(frame['task_results'])
+
+        spatial_memory = memory.widget_knowledge
+        for page, signature, entry, cached_summary in frame['widget_knowledge']:
+            spatial_memory.widget_knowledge_map.setdefault(page, {})[signature] = import_widget_entry(entry)
+            if cached_summary is not None:
+                spatial_memory.summary_cache[(page, signature)] = tuple(cached_summary)
+
+        # Never hand out an id the checkpointed run already used
+        memory.history.entry_id = max(memory.history.entry_id, frame['entry_ids']['history'])
+        memory.knowledge.entry_id = max(memory.knowledge.entry_id, frame['entry_ids']['knowledge'])
+
+    def restore(self):
+        """
+        Replay the checkpoint log into the memory
+
+        Returns:
+            bool: Whether a checkpoint was found and restored
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        start = time.time()
+        frames, end = read_frames(self.path)
+        for payload in frames:
+            self._apply(json.loads(payload))
+        if end < os.path.getsize(self.path):
+            # Drop the torn frame, frames appended after it could not be read back
+            os.truncate(self.path, end)
+
+        self.frame_count = len(frames)
+        self._mark_written()
+        logger.info(f'Restored memory from {len(frames)} checkpoint frames in {time.time() - start:.2f}s '
+                    f'({len(self.memory.working_memory.steps)} working memory steps, '
+                    f'{len(self.memory.task_memory.task_results)} task results, '
+                    f'{sum(len(entries) for entries in self.memory.widget_knowledge.widget_knowledge_map.values())} widgets)')
+        return len(frames) > 0
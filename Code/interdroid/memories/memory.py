@@ -1,5 +1,14 @@
 from collections import defaultdict
 import chromadb
+import atexit
+import configparser
+import bisect
+import copy
+import heapq
+import itertools
+import logging
+import operator
+import threading
 import time
 import os
 import re
@@ -8,68 +17,341 @@ import json
 from .working_memory import WorkingMemory
 from .task_memory import TaskMemory
 from .spatial_memory import SpatialMemory
+from .checkpoint import MemoryCheckpoint
+
+
+logger = logging.getLogger('memory')
+
+
+class RenderedEntries:
+    """
+    Stringified storage entries that grow by appending newer entries
+
+    Keeps the rendered text and the last entry id it covers, so
+    PersistentStorage.extend_rendered only renders entries added since.
+
+    Args:
+        mode (str): stringify_entries mode
+        where (dict): Optional lookup filter selecting the entries
+    """
+
+    def __init__(self, mode='task_history', where=None, show_timestamp=True, show_type=True):
+        self.mode = mode
+        self.where = where
+        self.show_timestamp = show_timestamp
+        self.show_type = show_type
+        self.raw = ''
+        self.last_id = 0
+
+    def text(self):
+        if len(self.raw) == 0:
+            return '<no interactions performed yet>' if self.mode == 'task_history' else ''
+        return self.raw.strip()
 
 
 class PersistentStorageManager:
-    chroma_client = chromadb.Client()
+    # Without a persist directory the storages live in process memory and start empty on every run
+    persist_directory = None
+    # Bump when the document or metadata layout changes, old collections are then left untouched
+    collection_version = 1
+    # Write-behind buffer of every PersistentStorage: flushed at this many entries or this age (seconds)
+    write_batch_size = 32
+    write_flush_interval = 5.0
+    # Read on first use of a storage, unless configure() was called before
+    config_path = 'config.ini'
+    configured = False
+    chroma_client = None
     active_storages = {
         'primary': None,
         'knowledge': None
     }
-    
+
+    @classmethod
+    def configure(cls, persist_directory=None, collection_version=None, write_batch_size=None, write_flush_interval=None):
+        cls.persist_directory = persist_directory or None
+        if collection_version is not None:
+            cls.collection_version = int(collection_version)
+        if write_batch_size is not None:
+            cls.write_batch_size = int(write_batch_size)
+        if write_flush_interval is not None:
+            cls.write_flush_interval = float(write_flush_interval)
+        cls.chroma_client = None
+        cls.configured = True
+
+    @classmethod
+    def configure_from_config(cls, config):
+        """Apply the [memory] section of config.ini, if present"""
+        if not config.has_section('memory'):
+            return
+        memory_config = config['memory']
+        cls.configure(memory_config.get('persist_directory'), memory_config.get('collection_version'),
+                      memory_config.get('write_batch_size'), memory_config.get('write_flush_interval'))
+
+    @classmethod
+    def ensure_configured(cls):
+        """Apply the [memory] section of config_path the first time a storage is created"""
+        if cls.configured:
+            return
+        config = configparser.ConfigParser()
+        config.read(cls.config_path)
+        cls.configure_from_config(config)
+        cls.configured = True
+
+    @classmethod
+    def get_client(cls):
+        if cls.chroma_client is None:
+            if cls.persist_directory:
+                os.makedirs(cls.persist_directory, exist_ok=True)
+                cls.chroma_client = chromadb.PersistentClient(path=cls.persist_directory)
+            else:
+                cls.chroma_client = chromadb.Client()
+        return cls.chroma_client
+
+    @classmethod
+    def collection_name(cls, storage_id):
+        return f'{storage_id}_v{cls.collection_version}'
+
     @classmethod
     def create_storage(cls, storage_id):
-        try:
-            cls.chroma_client.delete_collection(name=storage_id)
-        except ValueError:
-            pass
+        start = time.time()
+        client = cls.get_client()
+        name = cls.collection_name(storage_id)
 
-        try:
-            cls.chroma_client.delete_collection(name=f'{storage_id}')
-        except ValueError:
-            pass
+        if cls.persist_directory is None:
+            try:
+                client.delete_collection(name=name)
+            except ValueError:
+                pass
 
-        cls.active_storages[storage_id] = cls.chroma_client.create_collection(name=storage_id)
+        # Stored embeddings are reused as is, opening a collection does not re-embed its documents
+        cls.active_storages[storage_id] = client.get_or_create_collection(name=name)
 
+        logger.info(f'Opened storage {name} with {cls.active_storages[storage_id].count()} entries in {time.time() - start:.2f}s')
         return cls.active_storages[storage_id]
 
 
 class PersistentStorage:
-    def __init__(self, name):
+    """
+    Chroma collection with monotonically increasing entry ids and a write-behind buffer
+
+    New entries get their id immediately but are written (and embedded) in
+    batches: when batch_size entries are pending, when the oldest pending
+    entry is flush_interval seconds old (a timer flushes a buffer that no
+    later write or read does), and before every read, so reads always see
+    earlier writes.
+
+    Entries are also kept in secondary indexes on the INDEXED_FIELDS metadata
+    (id lists in insertion order), so exact metadata lookups and "last k
+    entries" queries are served by lookup() without scanning the collection.
+    The entries already on disk are indexed on the first read, not at
+    construction, so opening a large storage stays cheap.
+    """
+
+    INDEXED_FIELDS = ('type', 'page', 'widget', 'task')
+
+    def __init__(self, name, batch_size=None, flush_interval=None):
+        PersistentStorageManager.ensure_configured()
         self.name = name
-        self.entry_id = 0
+        self.batch_size = batch_size or PersistentStorageManager.write_batch_size
+        self.flush_interval = flush_interval if flush_interval is not None else PersistentStorageManager.write_flush_interval
         self.db = PersistentStorageManager.create_storage(name)
 
+        # Entry id -> (document, metadata), all entry ids ascending and field -> value -> ascending entry ids
+        self._entries = {}
+        self._ids = []
+        self._indexes = {field: defaultdict(list) for field in self.INDEXED_FIELDS}
+        self._indexes_loaded = False
+        # Last id in use, new entries continue after the ones on disk. Ids are handed out
+        # consecutively from 1 and entries are never deleted, so the count is the last id
+        self.entry_id = self.db.count()
+
+        self._pending_ids = []
+        self._pending_documents = []
+        self._pending_metadatas = []
+        self._pending_since = None
+        self._flush_timer = None
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+        # Entry id -> (mode, show_timestamp, show_type) -> rendered line (None if the mode skips the entry)
+        self._rendered = {}
+        # Mode -> RenderedEntries of the whole storage, extended by stringify_all_entries
+        self._all_rendered = {}
+
+    def _ensure_indexes(self):
+        if self._indexes_loaded:
+            return
+        start = time.monotonic()
+        stored = self.db.get(include=['documents', 'metadatas'])
+        rows = sorted(
+            (int(entry_id), document, metadata)
+            for entry_id, document, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])
+            # Entries added since construction are indexed already
+            if entry_id.isdigit() and int(entry_id) not in self._entries
+        )
+        for entry_id, document, metadata in rows:
+            self._index_entry(entry_id, document, metadata)
+        self._indexes_loaded = True
+        logger.info(f'Indexed {len(rows)} stored entries of storage {self.name} in {time.monotonic() - start:.2f}s')
+
+    def _index_entry(self, entry_id, document, metadata):
+        # Copied in and out, callers modify returned metadata before passing it to upsert
+        self._entries[entry_id] = (document, dict(metadata))
+        bisect.insort(self._ids, entry_id)
+        for field in self.INDEXED_FIELDS:
+            if field in metadata:
+                # New entries go to the end, re-indexed ones (upsert) back to their place
+                bisect.insort(self._indexes[field][metadata[field]], entry_id)
+
+    def _unindex_entry(self, entry_id):
+        _, metadata = self._entries.pop(entry_id)
+        del self._ids[bisect.bisect_left(self._ids, entry_id)]
+        for field in self.INDEXED_FIELDS:
+            if field in metadata:
+                self._indexes[field][metadata[field]].remove(entry_id)
+
+    def lookup(self, where=None, last=None, predicate=None, after_id=None):
+        """
+        Entries whose metadata match where, oldest first, in the format of collection.get
+
+        Args:
+            where (dict): Indexed field -> value, or list of accepted values; all fields must match
+            last (int): Only return the last (newest) entries, reading no more of the index than needed
+            predicate (callable): Optional predicate(document, metadata) applied before counting last
+            after_id (int): Only return entries with a larger id
+        """
+        with self._lock:
+            self._ensure_indexes()
+            where = {field: value if isinstance(value, (list, tuple, set)) else [value] for field, value in (where or {}).items()}
+            unindexed = [field for field in where if field not in self._indexes]
+            if unindexed:
+                raise ValueError(f'Fields {unindexed} are not indexed, use get() instead')
+
+            if where:
+                # Walk the index of the most selective field from the newest entry backwards
+                driver = min(where, key=lambda field: sum(len(self._indexes[field].get(value, ())) for value in where[field]))
+                candidates = heapq.merge(*(reversed(self._indexes[driver].get(value, [])) for value in where[driver]), reverse=True)
+            else:
+                driver = None
+                candidates = reversed(self._ids)
+            if after_id is not None:
+                candidates = itertools.takewhile(lambda entry_id: entry_id > after_id, candidates)
+
+            def matches(entry_id):
+                document, metadata = self._entries[entry_id]
+                if any(metadata.get(field) not in values for field, values in where.items() if field != driver):
+                    return False
+                return predicate is None or predicate(document, metadata)
+
+            selected = list(itertools.islice(filter(matches, candidates), last))
+            selected.reverse()
+
+            return {
+                'ids': [str(entry_id) for entry_id in selected],
+                'documents': [self._entries[entry_id][0] for entry_id in selected],
+                'metadatas': [dict(self._entries[entry_id][1]) for entry_id in selected]
+            }
+
+    def flush(self):
+        """Write all pending entries with a single add, so they are embedded as one batch"""
+        with self._lock:
+            if not self._pending_ids:
+                return
+            ids, documents, metadatas = self._pending_ids, self._pending_documents, self._pending_metadatas
+            self._pending_ids, self._pending_documents, self._pending_metadatas = [], [], []
+            pending_since, self._pending_since = self._pending_since, None
+            self._cancel_flush_timer()
+            try:
+                self.db.add(documents=documents, metadatas=metadatas, ids=ids)
+            except Exception:
+                # Keep the entries for the next flush, their ids are already handed out
+                self._pending_ids, self._pending_documents, self._pending_metadatas = ids, documents, metadatas
+                self._pending_since = pending_since
+                self._start_flush_timer()
+                raise
+
+    def _start_flush_timer(self):
+        # Flush flush_interval seconds from now even if nothing else touches the storage
+        if self.flush_interval > 0 and self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _cancel_flush_timer(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _timed_flush(self):
+        with self._lock:
+            # A flush may have run and a newer timer started while this one waited for the lock
+            if self._flush_timer is threading.current_thread():
+                self._flush_timer = None
+            try:
+                self.flush()
+            except Exception as e:
+                # flush() has restarted the timer to retry
+                logger.error(f'Timed flush of storage {self.name} failed: {e}')
+
+    def _buffer(self, documents, metadatas):
+        with self._lock:
+            ids = [str(entry_id) for entry_id in range(self.entry_id + 1, self.entry_id + 1 + len(documents))]
+            self.entry_id += len(documents)
+
+            self._pending_ids.extend(ids)
+            self._pending_documents.extend(documents)
+            self._pending_metadatas.extend(metadatas)
+            for entry_id, document, metadata in zip(ids, documents, metadatas):
+                self._index_entry(int(entry_id), document, metadata)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._start_flush_timer()
+
+            if len(self._pending_ids) >= self.batch_size or time.monotonic() - self._pending_since >= self.flush_interval:
+                self.flush()
+            return ids
+
     def get(self, **kwargs):
+        self.flush()
         return self.db.get(**kwargs)
     
     def add(self, **kwargs):
-        item_count = len(kwargs['documents'])
-        ids = list(map(str, range(self.entry_id, self.entry_id + item_count)))
-        self.entry_id += item_count
-
-        return self.db.add(documents=kwargs['documents'], metadatas=kwargs['metadatas'], ids=ids)
+        self._buffer(list(kwargs['documents']), list(kwargs['metadatas']))
 
     def upsert(self, **kwargs):
-        self.db.upsert(**kwargs)
+        with self._lock:
+            self.flush()
+            self._ensure_indexes()
+            self.db.upsert(**kwargs)
+
+            documents = kwargs.get('documents')
+            metadatas = kwargs.get('metadatas')
+            for i, entry_id in enumerate(kwargs['ids']):
+                if not entry_id.isdigit():
+                    continue
+                entry_id = int(entry_id)
+                previous_document, previous_metadata = self._entries.get(entry_id, ('', {}))
+                if entry_id in self._entries:
+                    self._unindex_entry(entry_id)
+                self._rendered.pop(entry_id, None)
+                self._all_rendered = {}
+                self._index_entry(
+                    entry_id,
+                    documents[i] if documents is not None else previous_document,
+                    metadatas[i] if metadatas is not None else previous_metadata
+                )
 
     def query(self, **kwargs):
+        self.flush()
         return self.db.query(**kwargs)
 
     def add_entry(self, document, metadata):
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-        self.entry_id += 1
-
-        self.db.add(
-            documents = [document],
-            metadatas = [{
-                'timestamp': timestamp,
-                **metadata
-            }],
-            ids = [str(self.entry_id)]
-        )
 
-        return str(self.entry_id)
+        return self._buffer([document], [{
+            'timestamp': timestamp,
+            **metadata
+        }])[0]
 
     def _stringify_entry(self, memory_id, metadata, doc, show_timestamp=True, show_type=True):
         if show_type:
@@ -82,28 +364,39 @@ class PersistentStorage:
         else:
             return (int(memory_id), f'{memory_id}. {doc}')
 
-    def stringify_entries(self, raw_entries, mode='widget_knowledge', show_timestamp=True, show_type=True, max_len=None):
-        assert mode in ['task_history', 'widget_knowledge', 'task_knowledge']
+    def _render_entry(self, memory_id, metadata, doc, mode, show_timestamp, show_type):
+        # Rendered line of an entry, or None if the mode skips it. Cached by entry id, upsert invalidates it.
+        key = (mode, show_timestamp, show_type)
+        cached = self._rendered.get(int(memory_id))
+        if cached is not None and key in cached:
+            return cached[key]
+
+        if mode == 'task_history':
+            rendered = self._stringify_entry(memory_id, metadata, doc, show_timestamp=show_timestamp, show_type=show_type)[1] if len(doc) > 0 else None
+        elif mode == 'widget_knowledge':
+            knowledge = metadata['observation']
+            rendered = f'- result of {metadata["action"]}: {knowledge}\n' if len(knowledge) > 0 else None
+        elif mode == 'task_knowledge':
+            knowledge = metadata['reflection']
+            rendered = f'- {knowledge}\n' if len(knowledge) > 0 else None
+        else:
+            raise ValueError(f'Unsupported mode for stringifying permanant storage entries: {mode}')
+
+        self._rendered.setdefault(int(memory_id), {})[key] = rendered
+        return rendered
 
+    def _render_entries(self, raw_entries, mode, show_timestamp, show_type):
         entries = []
         for memory_id, metadata, doc in zip(raw_entries['ids'], raw_entries['metadatas'], raw_entries['documents']):
-            if mode == 'task_history':
-                if len(doc) == 0:
-                    continue
-                entries.append(self._stringify_entry(memory_id, metadata, doc, show_timestamp=show_timestamp, show_type=show_type))
-            elif mode == 'widget_knowledge':
-                knowledge = metadata['observation']
-                if len(knowledge) == 0:
-                    continue
-                action_type = metadata['action']
-                entries.append((int(memory_id), f'- result of {action_type}: {knowledge}\n'))
-            elif mode == 'task_knowledge':
-                knowledge = metadata['reflection']
-                if len(knowledge) == 0:
-                    continue
-                entries.append((int(memory_id), f'- {knowledge}\n'))
-            else:
-                raise ValueError(f'Unsupported mode for stringifying permanant storage entries: {mode}')
+            rendered = self._render_entry(memory_id, metadata, doc, mode, show_timestamp, show_type)
+            if rendered is not None:
+                entries.append((int(memory_id), rendered))
+        return entries
+
+    def stringify_entries(self, raw_entries, mode='widget_knowledge', show_timestamp=True, show_type=True, max_len=None):
+        assert mode in ['task_history', 'widget_knowledge', 'task_knowledge']
+
+        entries = self._render_entries(raw_entries, mode, show_timestamp, show_type)
 
         if len(entries) == 0 and mode == 'task_history':
             return '<no interactions performed yet>'
@@ -111,23 +404,49 @@ class PersistentStorage:
         if len(entries) == 0:
             return ''
             
-        entries.sort(key=lambda x: x[0])
-        if max_len is not None and isinstance(max_len, int):
-            entries = entries[max(-max_len, -len(entries)):]
+        if max_len is not None and isinstance(max_len, int) and 0 < max_len < len(entries):
+            # Only the newest max_len entries are kept, select them without sorting everything
+            entries = heapq.nlargest(max_len, entries, key=operator.itemgetter(0))
+            entries.reverse()
+        else:
+            entries.sort(key=operator.itemgetter(0))
         
-        memory_str = ''
-        for memory_id, entry in entries:
-            memory_str += entry
-
-        return memory_str.strip()
+        return ''.join(entry for memory_id, entry in entries).strip()
+
+    def extend_rendered(self, rendered, raw_entries=None):
+        """
+        Append the entries newer than rendered.last_id to a RenderedEntries
+
+        Args:
+            rendered (RenderedEntries): Previously rendered entries, updated in place
+            raw_entries (dict): Entries in the format of collection.get, by default looked up with rendered.where
+
+        Returns:
+            str: The rendered text, as stringify_entries would return it for all entries
+        """
+        with self._lock:
+            if raw_entries is None:
+                raw_entries = self.lookup(rendered.where, after_id=rendered.last_id)
+            entries = [
+                entry for entry in self._render_entries(raw_entries, rendered.mode, rendered.show_timestamp, rendered.show_type)
+                if entry[0] > rendered.last_id
+            ]
+            entries.sort(key=operator.itemgetter(0))
+
+            if len(entries) > 0:
+                rendered.raw += ''.join(entry for memory_id, entry in entries)
+                rendered.last_id = entries[-1][0]
+            return rendered.text()
 
     def stringify_all_entries(self, mode='widget_knowledge'):
-        raw_entries = self.db.get()
-        return self.stringify_entries(raw_entries, mode=mode)
+        with self._lock:
+            if mode not in self._all_rendered:
+                self._all_rendered[mode] = RenderedEntries(mode)
+            return self.extend_rendered(self._all_rendered[mode])
 
 
 class Memory:
-    def __init__(self, name):
+    def __init__(self, name, checkpoint_path=None, checkpoint_every=10):
         self.history = PersistentStorage(f'{name}_primary')
         self.knowledge = PersistentStorage(f'{name}_knowledge')
 
@@ -135,7 +454,27 @@ class Memory:
         self.task_memory = TaskMemory(self.history, self.knowledge)
         self.widget_knowledge = SpatialMemory(self.knowledge)
 
+        self.checkpoint = MemoryCheckpoint(self, checkpoint_path, checkpoint_every) if checkpoint_path else None
+
+    def flush(self):
+        self.history.flush()
+        self.knowledge.flush()
+
+    def restore_checkpoint(self):
+        """Resume from the checkpoint log, returns whether there was one to restore"""
+        if self.checkpoint is None:
+            return False
+        return self.checkpoint.restore()
+
+    def step_completed(self):
+        """Call once per agent step, writes a checkpoint frame every checkpoint_every steps"""
+        if self.checkpoint is not None:
+            self.checkpoint.step()
+
     def save_snapshot(self, output_dir):
+        if self.checkpoint is not None:
+            self.checkpoint.write()
+        self.flush()
         working_memory_record = self.working_memory.to_dict()
         with open(os.path.join(output_dir, 'scratch.json'), 'w') as f:
             json.dump(working_memory_record, f, indent=2)
@@ -145,8 +484,8 @@ class Memory:
             f.write(task_history_record)
 
     def collect_knowledge(self):
-        widget_knowledge_entries = self.knowledge.get({'where': {'type': 'WIDGET'}})
-        task_knowledge_entries = self.knowledge.get({'where': {'type': 'TASK'}})
+        widget_knowledge_entries = self.knowledge.lookup({'type': 'WIDGET'})
+        task_knowledge_entries = self.knowledge.lookup({'type': 'TASK'})
 
         task_knowledge = []
         widget_knowledge = defaultdict(lambda: defaultdict(list))
@@ -164,12 +503,13 @@ class Memory:
 
             task_knowledge.append((int(memory_id), (metadata['task'], metadata['reflection'])))
 
-        widget_knowledge_map = copy.deepcopy(self.widget_knowledge.knowledge_map)
+        widget_knowledge_map = copy.deepcopy(self.widget_knowledge.widget_knowledge_map)
 
         for page, widgets in widget_knowledge.items():
             for widget_signature, w_knowledge in widgets.items():
                 observations = widget_knowledge[page][widget_signature]
-                widget_knowledge_map[page][widget_signature] = {
+                # Entries loaded from an earlier run may belong to pages this run has not visited
+                widget_knowledge_map.setdefault(page, {})[widget_signature] = {
                     'summary': w_knowledge,
                     'entries': [obs_entry[1] for obs_entry in observations]
                 }
@@ -1,10 +1,21 @@
 from ..prompts.summarize_widget_knowledge import prompt_summarized_widget_knowledge
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import threading
 
 class SpatialMemory:    # Akin to human's long-term spatial memory and is stored in the permanent storage
+    # Widget knowledge summaries computed at once by prefetch_widget_knowledge
+    summary_workers = 8
+
     def __init__(self, storage):
         self.storage = storage
         self.widget_knowledge_map = {}
+        # (page, widget signature) -> (observation count, summary). A summary is reused until the
+        # widget gets a new observation, which changes the count it was computed for.
+        self.summary_cache = {}
+        # (page, widget signature) pairs changed since the last checkpoint
+        self.dirty_widgets = set()
+        self._lock = threading.Lock()
 
     def has_widget_knowledge(self, page, widget_signature):
         if page not in self.widget_knowledge_map:
@@ -14,7 +25,53 @@ class SpatialMemory:    # Akin to human's long-term spatial memory and is stored
 
         return self.widget_knowledge_map[page][widget_signature]['observation_count'] > 0
     
+    def _observation_count(self, page, widget_signature):
+        return self.widget_knowledge_map.get(page, {}).get(widget_signature, {}).get('observation_count', 0)
+
+    def get_cached_widget_knowledge(self, page, widget_signature):
+        """Return (True, summary) if the summary for the widget's current observations is cached, else (False, None)"""
+        cached = self.summary_cache.get((page, widget_signature))
+        if cached is not None and cached[0] == self._observation_count(page, widget_signature):
+            return True, cached[1]
+        return False, None
+
     def retrieve_widget_knowledge(self, state, widget, N=5, prompt_recorder=None):
+        found, widget_role_summary = self.get_cached_widget_knowledge(state.activity, widget.signature)
+        if found:
+            return widget_role_summary
+
+        observation_count = self._observation_count(state.activity, widget.signature)
+        widget_role_summary = self._summarize_widget_knowledge(state, widget, N=N, prompt_recorder=prompt_recorder)
+        with self._lock:
+            self.summary_cache[(state.activity, widget.signature)] = (observation_count, widget_role_summary)
+            self.dirty_widgets.add((state.activity, widget.signature))
+        return widget_role_summary
+
+    def prefetch_widget_knowledge(self, state, widgets, N=5, prompt_recorder=None):
+        """
+        Compute the uncached knowledge summaries of several widgets concurrently
+
+        Widgets without knowledge and widgets sharing a signature are only summarized once.
+        """
+        pending = {}
+        for widget in widgets:
+            if widget.signature in pending or not self.has_widget_knowledge(state.activity, widget.signature):
+                continue
+            if not self.get_cached_widget_knowledge(state.activity, widget.signature)[0]:
+                pending[widget.signature] = widget
+
+        if len(pending) == 0:
+            return
+        if len(pending) == 1:
+            self.retrieve_widget_knowledge(state, next(iter(pending.values())), N=N, prompt_recorder=prompt_recorder)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.summary_workers, len(pending))) as executor:
+            futures = [executor.submit(self.retrieve_widget_knowledge, state, widget, N, prompt_recorder) for widget in pending.values()]
+            for future in futures:
+                future.result()
+
+    def _summarize_widget_knowledge(self, state, widget, N=5, prompt_recorder=None):
         relevant_entries = self.storage.query(
             query_texts=[state.signature],
             n_results=N,
@@ -27,7 +84,7 @@ class SpatialMemory:    # Akin to human's long-term spatial memory and is stored
             'documents': relevant_entries['documents'][0]
         }
 
-        if len(relevant_entries) == 0:
+        if len(relevant_entries['ids']) == 0:
             return None
 
         relevant_widget_observations = self.storage.stringify_entries(relevant_entries, mode='widget_knowledge')
@@ -61,6 +118,7 @@ class SpatialMemory:    # Akin to human's long-term spatial memory and is stored
         action_count_map[action.event_type] += 1
 
         self.widget_knowledge_map[page][widget_signature]['action_count'][action.event_type] += 1
+        self.dirty_widgets.add((page, widget_signature))
         
         if observation is None:
             return
@@ -85,8 +143,10 @@ class SpatialMemory:    # Akin to human's long-term spatial memory and is stored
         if widget_signature not in self.widget_knowledge_map[page]:
             self.widget_knowledge_map[page][widget_signature] = {
                 'action_count': defaultdict(lambda: 0),
+                'observation_count': 0,
                 'role_inference': None
             }
         
         self.widget_knowledge_map[page][widget_signature]['role_inference'] = inference
+        self.dirty_widgets.add((page, widget_signature))
     
\ No newline at end of file
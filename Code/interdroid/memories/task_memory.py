@@ -5,6 +5,12 @@ class TaskMemory:
         self.storage = primary_storage
         self.knowledge_storage = knowledge_storage
         self.task_results = {} # To store experiment results
+        # Summaries of the task results added or changed since the last checkpoint
+        self.dirty_results = set()
+
+    def mark_result_changed(self, task_summary):
+        """Call after modifying task_results[task_summary] in place, so the next checkpoint includes it"""
+        self.dirty_results.add(task_summary)
 
     def record_task(self, task, description):
         entry_id = self.storage.add_entry(
@@ -47,6 +53,7 @@ class TaskMemory:
             'visited_pages_during_task': task.explored_activities,
             'task_execution_history': working_memory_record
         }
+        self.mark_result_changed(task.summary)
 
         # Add task result to permanent storages
         self._add_task_result_to_storage(task)
@@ -84,10 +91,12 @@ class TaskMemory:
         )
 
     def retrieve_task_history(self, max_len=20):
-        entries = self.storage.get(where={'$or': [
-            {'type': 'TASK_RESULT'},
-            {'type': 'INITIAL_KNOWLEDGE'}
-        ]})
+        # Only the last max_len non-empty entries are read, from the type index
+        entries = self.storage.lookup(
+            {'type': ['TASK_RESULT', 'INITIAL_KNOWLEDGE']},
+            last=max_len,
+            predicate=lambda document, metadata: len(document) > 0
+        )
 
         return self.storage.stringify_entries(entries, mode='task_history', max_len=max_len)
         
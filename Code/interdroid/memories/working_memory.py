@@ -7,35 +7,172 @@ from ..utils.stringutil import add_period, remove_period
 import time
 import re
 
+class WorkingMemoryStep:
+    """
+    One working memory entry
+
+    Iterates as the (description, step_type, timestamp, page) tuple the steps
+    used to be, with the "%H:%M:%S" timestamp rendered from the numeric one.
+    """
+    __slots__ = ('description', 'step_type', 'created_at', 'page')
+
+    def __init__(self, description, step_type, page, created_at=None):
+        self.description = description
+        self.step_type = step_type
+        self.page = page
+        self.created_at = time.time() if created_at is None else created_at
+
+    @property
+    def timestamp(self):
+        return time.strftime("%H:%M:%S", time.localtime(self.created_at))
+
+    def __iter__(self):
+        return iter((self.description, self.step_type, self.timestamp, self.page))
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __repr__(self):
+        return f'WorkingMemoryStep({self.description!r}, {self.step_type!r}, {self.timestamp!r}, {self.page!r})'
+
+
+def BASIC_FEEDBACK_MESSAGE(page_change):
+    return f'I performed the action you suggested. What should be the next action?' if page_change is None else f'I performed the action you suggested. The page changed from {page_change[0]} to {page_change[1]}. What should be the next action?'
+
+
+class ConversationBuilder:
+    """
+    Append-only builder of the virtual conversation of a WorkingMemory
+
+    Steps are folded in one at a time. Every user feedback message keeps its
+    shortened form (used for all but the last one) next to its full form,
+    so building the conversation after a new step only renders the newest
+    message and the critique instead of replaying every step.
+    """
+
+    def __init__(self):
+        self.assistant_messages = []
+        # Per user feedback message: full text, shortened text (page change only) and critique
+        self.feedback_messages = []
+        self.shortened_messages = []
+        self.critiques = []
+        self.last_critique_index = None
+
+        self.prev_critique = None
+        self.previous_item_type = None
+        self.has_critique = False
+        self.need_feedback_message = False
+        self.step_count = 0
+
+    def _add_feedback(self, feedback_message, critique):
+        page_change = None
+        m = re.search(r'(\(page changed from (.+) to (.+)\))', feedback_message)
+        if m is not None:
+            page_change = (m.group(2), m.group(3))
+
+        self.feedback_messages.append(feedback_message)
+        self.shortened_messages.append(BASIC_FEEDBACK_MESSAGE(page_change))
+        self.critiques.append(critique)
+        if critique is not None:
+            self.last_critique_index = len(self.critiques) - 1
+
+    def add_step(self, step):
+        entry, item_type = step.description, step.step_type
+
+        if item_type == 'ACTION':
+            if self.need_feedback_message:
+                self._add_feedback(BASIC_FEEDBACK_MESSAGE(None), self.prev_critique)
+                self.prev_critique = None
+            if isinstance(entry, Action):
+                self.assistant_messages.append(entry.get_action_str())
+            else:
+                self.assistant_messages.append(str(entry))
+            self.need_feedback_message = True
+
+        elif item_type == 'CRITIQUE':
+            # append to the last observation
+            if self.previous_item_type == 'OBSERVATION':
+                self.critiques[-1] = entry
+                self.last_critique_index = len(self.critiques) - 1
+            elif self.previous_item_type == 'ACTION':
+                self.prev_critique = entry
+            self.has_critique = True
+
+        elif item_type == 'OBSERVATION':
+            assert self.previous_item_type == 'ACTION'
+            self._add_feedback(f'''
+I performed the action, and as a result, {entry[0].lower() + add_period(entry[1:])} What should be the next action?'''.strip(), None)
+
+            self.need_feedback_message = False
+
+        self.previous_item_type = item_type
+        self.step_count += 1
+
+    def user_feedback_messages(self):
+        """The user messages after the first one: only the last keeps its observation, only the last critique is shown"""
+        messages = list(self.shortened_messages)
+        critique_index = self.last_critique_index
+
+        if self.need_feedback_message:
+            # Feedback for the last action, which has no observation yet
+            messages.append(BASIC_FEEDBACK_MESSAGE(None))
+            if self.prev_critique is not None:
+                critique_index = len(messages) - 1
+        elif len(messages) > 0:
+            messages[-1] = self.feedback_messages[-1]
+
+        if critique_index is not None:
+            critique = self.prev_critique if critique_index == len(self.critiques) else self.critiques[critique_index]
+            messages[critique_index] = messages[critique_index].replace('What should be the next action?', f'''
+However, I got the following critique for my actions so far: 
+> Criticizer: "{add_period(critique)}" 
+Considering the critique, what should be the next action?'''.strip())
+
+        return messages
+
+
 class WorkingMemory:
     def __init__(self, task=None):
         self.task = task
         self.steps = []
         self.previous_action = None
+        self._conversation = ConversationBuilder()
+        # Rendered stringify() lines, one per step (None for hidden critiques)
+        self._step_lines = []
 
     def register_task(self, task: Task):
         self.task = task
 
-    def add_step(self, step_description, page, step_type='ACTION'):
+    def add_step(self, step_description, page, step_type='ACTION', created_at=None):
         if step_type == 'ACTION' and isinstance(step_description, Action):
             self.previous_action = step_description
 
-        timestamp = time.strftime("%H:%M:%S", time.localtime())
-        self.steps.append((step_description, step_type, timestamp, page))
+        self.steps.append(WorkingMemoryStep(step_description, step_type, page, created_at=created_at))
+
+    def _sync(self):
+        # Fold in the steps added since the last call; start over if the step list was replaced
+        if self._conversation.step_count > len(self.steps) or len(self._step_lines) > len(self.steps):
+            self._conversation = ConversationBuilder()
+            self._step_lines = []
+        for step in self.steps[self._conversation.step_count:]:
+            self._conversation.add_step(step)
+        for step in self.steps[len(self._step_lines):]:
+            self._step_lines.append(self._render_step(step))
+
+    @staticmethod
+    def _render_step(step):
+        entry, item_type, timestamp, page = step
+        if isinstance(entry, Action):
+            entry = entry.get_action_record_str()
+        if item_type == 'CRITIQUE':
+            return None # hide previous critiques to avoid bias
+        return f'{timestamp}:{page}: [{item_type}] {entry}\n'
 
     def stringify(self):
         if len(self.steps) == 0:
             return '<no interactions performed>'
-        memory_str = ''
-        for i, (entry, item_type, timestamp, page) in enumerate(self.steps):
-            if isinstance(entry, Action):
-                entry = entry.get_action_record_str()
-            if item_type == 'CRITIQUE':
-                continue # hide previous critiques to avoid bias
-            
-            memory_str += f'{timestamp}:{page}: [{item_type}] {entry}\n'
-        
-        return memory_str.strip()
+        self._sync()
+        return ''.join(line for line in self._step_lines if line is not None).strip()
 
     def to_dict(self):
         task_execution_entries = []
@@ -56,88 +193,19 @@ class WorkingMemory:
 
     def make_virtual_conversation(self):
         # This should be called when we need a next action from the LLM
-        WM = list(enumerate(self.steps))
-        
-        user_messages_draft = []
-        user_messages = []
-        assistant_messages = []
-
-        BASIC_FEEDBACK_MESSAGE = lambda page_change: f'I performed the action you suggested. What should be the next action?' if page_change is None else f'I performed the action you suggested. The page changed from {page_change[0]} to {page_change[1]}. What should be the next action?'
-
-        prev_critique = None
-        previous_item_type = None
-        has_critique = False
-
-        need_feedback_message = False
-
-        for i, (entry, item_type, timestamp, page) in WM:
-            if item_type == 'ACTION':
-                if need_feedback_message:
-                    user_messages_draft.append((BASIC_FEEDBACK_MESSAGE(None), prev_critique, page))
-                    prev_critique = None
-                if isinstance(entry, Action):
-                    assistant_messages.append(entry.get_action_str())
-                else:
-                    assistant_messages.append(str(entry))
-                need_feedback_message = True
-
-            elif item_type == 'CRITIQUE':
-                # append to the last observation
-                if previous_item_type == 'OBSERVATION':
-                    user_messages_draft[-1] = (user_messages_draft[-1][0], entry, user_messages_draft[-1][2])
-                elif previous_item_type == 'ACTION':
-                    prev_critique = entry
-                has_critique = True
-                
-            elif item_type == 'OBSERVATION':
-                assert previous_item_type == 'ACTION'
-                user_messages_draft.append((f'''
-I performed the action, and as a result, {entry[0].lower() + add_period(entry[1:])} What should be the next action?'''.strip(), None, page))
-
-                need_feedback_message = False
-
-            previous_item_type = item_type
-
-        if need_feedback_message:
-            user_messages_draft.append((BASIC_FEEDBACK_MESSAGE(None), prev_critique, WM[-1][1][3]))
+        self._sync()
+        conversation = self._conversation
 
         # Final conversation generation: only include the last observation and last critique (if there is not critique, mention the initial plan made by planner)
-        ignore_observations = False
-        ignore_critiques = False
-
-        for feedback_message, critique, page in user_messages_draft[::-1]:
-            if ignore_observations:
-                page_change = None
-                m = re.search(r'(\(page changed from (.+) to (.+)\))', feedback_message)
-                if m is not None:
-                    page_change = (m.group(2), m.group(3))
-
-                feedback_message = BASIC_FEEDBACK_MESSAGE(page_change)
-
-            else:
-                ignore_observations = True
-
-            if not ignore_critiques and critique is not None:
-                feedback_message = feedback_message.replace('What should be the next action?', f'''
-However, I got the following critique for my actions so far: 
-> Criticizer: "{add_period(critique)}" 
-Considering the critique, what should be the next action?'''.strip())
-                
-                ignore_critiques = True
-
-            user_messages.insert(0, feedback_message)
-
-        initial_plan = f'{add_period(self.task.plan)} ' if not has_critique else ''
+        initial_plan = f'{add_period(self.task.plan)} ' if not conversation.has_critique else ''
 
         first_user_message = f'''
 My name is {agent_config.persona_name} and I am using an application named {agent_config.app_name} to accomplish the following task: 
 * Task: {self.task} ({remove_period(self.task.end_condition)})
 
-I'm currently on the {self.task.start_state.activity} page. {initial_plan}What should be the first action?
+I'm currently on the {self.task.start_activity} page. {initial_plan}What should be the first action?
         '''.strip()
 
-        user_messages.insert(0, first_user_message)
-
-        return user_messages, assistant_messages
+        user_messages = [first_user_message] + conversation.user_feedback_messages()
 
-    
+        return user_messages, list(conversation.assistant_messages)
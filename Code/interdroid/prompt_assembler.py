@@ -0,0 +1,64 @@
+"""
+Prefix-stable prompt assembly
+
+The reference demonstration (first screenshot, combined screenshots, reference
+answer and the thinking response) is identical for every step of a task.
+Providers cache prompt prefixes only when they are byte-identical, so the
+demonstration is frozen into a StaticPrefix that each backend formats once and
+reuses verbatim, with the per-step content appended after it.
+"""
+
+import threading
+from typing import List, Dict, Any, Optional, Union, Tuple
+
+
+class StaticPrefix:
+    """
+    Immutable run of messages placed at the start of a conversation
+
+    Backends expand a StaticPrefix inside format_messages. The formatted
+    messages (including base64 encoded images) are cached per backend type,
+    so every request sends exactly the same bytes even if the image files are
+    rewritten later. When the backend supports explicit cache markers, the
+    last message of the prefix is marked as a cache breakpoint.
+
+    Args:
+        messages (list): (role, content) tuples or already formatted dicts
+        parent (StaticPrefix): Optional prefix these messages are appended to
+    """
+
+    def __init__(self, messages: List[Union[Dict[str, Any], tuple]], parent: Optional["StaticPrefix"] = None):
+        self.messages = tuple(messages)
+        self.parent = parent
+        self._formatted = {}
+        self._lock = threading.Lock()
+
+    def extend(self, messages: List[Union[Dict[str, Any], tuple]]) -> "StaticPrefix":
+        """Return a longer prefix that reuses the formatting already done for this one"""
+        return StaticPrefix(messages, parent=self)
+
+    def all_messages(self) -> Tuple[Union[Dict[str, Any], tuple], ...]:
+        return (self.parent.all_messages() if self.parent is not None else ()) + self.messages
+
+    def _format_plain(self, client) -> List[Dict[str, Any]]:
+        key = type(client)
+        # The router formats from several threads when hedging
+        with self._lock:
+            if key not in self._formatted:
+                inherited = self.parent._format_plain(client) if self.parent is not None else []
+                self._formatted[key] = inherited + client.format_messages(list(self.messages))
+            return self._formatted[key]
+
+    def format_for(self, client) -> List[Dict[str, Any]]:
+        formatted = list(self._format_plain(client))
+        if formatted and client.cache_control:
+            formatted[-1] = client.mark_cacheable(formatted[-1])
+        return formatted
+
+    def __len__(self):
+        return len(self.all_messages())
+
+
+def assemble_messages(prefix: Optional[StaticPrefix], *messages: Union[Dict[str, Any], tuple]) -> List[Union[Dict[str, Any], tuple, StaticPrefix]]:
+    """Build the conversation for one request: the static prefix (if any) followed by the per-step messages"""
+    return ([prefix] if prefix is not None else []) + list(messages)
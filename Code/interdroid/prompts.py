@@ -150,3 +150,12 @@ Please provide your analysis in the following JSON format:
 ```
 """
     return prompt
+
+
+def get_action_repair_prompt(error: str):
+    return f"""
+Your previous answer could not be used as the next operation:
+{error}
+
+Please answer again with exactly one operation, written as a single JSON object in the expected output format.
+"""
@@ -0,0 +1,213 @@
+"""
+Micro-benchmark of GUIState widget lookups and diffs on large synthetic view trees
+
+Compares the linear scans get_widget_by_id/get_widget_by_signature used to do
+with the lookup tables built by GUIState.index_widgets, times the bounds
+array queries, and compares the ndiff-based GUIState.diff with the structural
+diff. Run from Code/ with:
+
+    python -m interdroid.types.benchmark_gui_state [<widget count> ...]
+    python -m interdroid.types.benchmark_gui_state diff [<widget count> ...]
+"""
+
+import difflib
+import random
+import sys
+import time
+
+from .gui_state import GUIState, traverse_widgets
+
+
+def random_view_tree(widget_count, branching=4, seed=0):
+    """
+    Random DroidBot-like view tree
+
+    Args:
+        widget_count (int): Number of views in the tree
+        branching (int): Maximum number of children per view
+        seed (int): Random seed
+
+    Returns:
+        tuple: (root view dict, views by temp_id as in droidbot_state.views)
+    """
+    rng = random.Random(seed)
+    classes = ['android.widget.TextView', 'android.widget.Button', 'android.widget.LinearLayout',
+               'android.widget.ImageView', 'android.widget.EditText', 'android.widget.CheckBox']
+    views = []
+
+    def make_view(bounds):
+        temp_id = len(views)
+        view = {
+            'temp_id': temp_id,
+            'class': rng.choice(classes),
+            'bounds': bounds,
+            'resource_id': f'com.example:id/view_{temp_id % 50}',
+            'text': f'item {temp_id}' if rng.random() < 0.5 else None,
+            'clickable': rng.random() < 0.4,
+            'scrollable': rng.random() < 0.05,
+            'view_str': f'view_{temp_id}',
+            'children': []
+        }
+        views.append(view)
+        return view
+
+    root = make_view([[0, 0], [1080, 2400]])
+    frontier = [root]
+    while len(views) < widget_count:
+        parent = frontier.pop(0)
+        (left, top), (right, bottom) = parent['bounds']
+        child_count = min(rng.randint(1, branching), widget_count - len(views))
+        height = max((bottom - top) // child_count, 1)
+        for i in range(child_count):
+            child = make_view([[left, top + i * height], [right, min(top + (i + 1) * height, bottom)]])
+            parent['children'].append(child)
+            frontier.append(child)
+
+    return root, views
+
+
+def build_state(widget_count, seed=0):
+    """GUIState over a random view tree, built the way from_droidbot_state builds it"""
+    root, views = random_view_tree(widget_count, seed=seed)
+    state = GUIState()
+    state.activity = 'BenchmarkActivity'
+    state.widgets = []
+    state.root_widgets = [traverse_widgets(root, state.widgets, views)]
+    return state
+
+
+def scan_by_id(state, view_id):
+    for widget in state.widgets:
+        if widget.view_id == view_id:
+            return widget
+    return None
+
+
+def scan_by_signature(state, signature):
+    for widget in state.widgets:
+        if widget.signature == signature:
+            return widget
+    return None
+
+
+def benchmark_lookups(widget_counts=(100, 1000, 10000), lookups=1000, seed=0):
+    """
+    Time the linear scans against the lookup tables
+
+    Args:
+        widget_counts (iterable): View tree sizes to test
+        lookups (int): Lookups per measurement
+        seed (int): Random seed
+
+    Returns:
+        list: One dict per tree size with timings in seconds and a correctness flag
+    """
+    rng = random.Random(seed)
+    rows = []
+    for widget_count in widget_counts:
+        state = build_state(widget_count, seed=seed)
+        row = {'widgets': len(state.widgets)}
+
+        start = time.perf_counter()
+        state.index_widgets()
+        row['index'] = time.perf_counter() - start
+
+        targets = [rng.choice(state.widgets) for _ in range(lookups)]
+        ids = [widget.view_id for widget in targets]
+        signatures = [widget.signature for widget in targets]
+        points = [(rng.randrange(1080), rng.randrange(2400)) for _ in range(lookups)]
+
+        start = time.perf_counter()
+        scanned = [scan_by_id(state, view_id) for view_id in ids] + [scan_by_signature(state, sig) for sig in signatures]
+        row['scan'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indexed = [state.get_widget_by_id(view_id) for view_id in ids] + [state.get_widget_by_signature(sig) for sig in signatures]
+        row['indexed'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        hits = sum(len(state.get_widgets_at(x, y)) for x, y in points)
+        row['widgets_at'] = time.perf_counter() - start
+        row['mean_hits'] = hits / lookups
+
+        row['same_results'] = all(a is b for a, b in zip(scanned, indexed))
+        rows.append(row)
+    return rows
+
+
+def ndiff_diff(old_state, new_state):
+    """GUIState.diff as it was: ndiff over the describe_widgets() lines of both states"""
+    diff = difflib.ndiff(old_state.describe_widgets().splitlines(keepends=True), new_state.describe_widgets().splitlines(keepends=True))
+    return ''.join(diff)
+
+
+def mutate_state(state, rng, rate=0.02):
+    """Change the state or text of, or remove, about rate of the widgets of a state whose properties were not read yet"""
+    for widget in list(state.widgets):
+        roll = rng.random()
+        if roll < rate / 3:
+            widget.elem_dict['state'] = widget.elem_dict.get('state', []) + ['checked']
+        elif roll < rate * 2 / 3:
+            widget.elem_dict['text'] = f'{widget.elem_dict.get("text", "")} (edited)'
+        elif roll < rate:
+            state.widgets.remove(widget)
+    return state
+
+
+def benchmark_diffs(widget_counts=(1000,), seed=0):
+    """
+    Time the ndiff-based diff against the structural diff, with and without rendering it to text
+
+    Args:
+        widget_counts (iterable): View tree sizes to test
+        seed (int): Random seed
+
+    Returns:
+        list: One dict per tree size with timings in seconds and the number of differing widgets
+    """
+    rows = []
+    for widget_count in widget_counts:
+        old_state = build_state(widget_count, seed=seed)
+        new_state = mutate_state(build_state(widget_count, seed=seed), random.Random(seed))
+        row = {'widgets': len(old_state.widgets)}
+
+        start = time.perf_counter()
+        ndiff_text = ndiff_diff(old_state, new_state)
+        row['ndiff'] = time.perf_counter() - start
+        row['ndiff_lines'] = sum(1 for line in ndiff_text.splitlines() if line[:1] in '-+')
+
+        start = time.perf_counter()
+        diff = old_state.structural_diff(new_state)
+        row['structural'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        diff = old_state.structural_diff(new_state)
+        row['structural_cached'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        diff.render()
+        row['render'] = time.perf_counter() - start
+
+        row['appeared'] = len(diff.appeared)
+        row['disappeared'] = len(diff.disappeared)
+        row['changed'] = len(diff.changed)
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['diff']:
+        widget_counts = [int(count) for count in sys.argv[2:]] or [1000]
+        for row in benchmark_diffs(widget_counts):
+            print(f"{row['widgets']} widgets:")
+            print(f"  ndiff: {row['ndiff']:.4f}s ({row['ndiff_lines']} changed lines)")
+            print(f"  structural: {row['structural']:.4f}s, with cached hashes: {row['structural_cached']:.4f}s, render: {row['render']:.4f}s")
+            print(f"  appeared: {row['appeared']}, disappeared: {row['disappeared']}, changed: {row['changed']}")
+        sys.exit(0)
+
+    widget_counts = [int(count) for count in sys.argv[1:]] or [100, 1000, 10000]
+    for row in benchmark_lookups(widget_counts):
+        print(f"{row['widgets']} widgets:")
+        print(f"  index: {row['index']:.4f}s")
+        print(f"  scan: {row['scan']:.4f}s, indexed: {row['indexed']:.4f}s, widgets_at: {row['widgets_at']:.4f}s")
+        print(f"  mean widgets per point: {row['mean_hits']:.1f}, same results: {row['same_results']}")
@@ -6,16 +6,18 @@ from ..utils.logger import Logger
 
 from .action import initialize_possible_actions, initialize_screen_scroll_action, initialize_go_back_action, initialize_enter_key_action
 from .widget import Widget
+from .state_diff import diff_states
+from .screen_description import BudgetedWriter, render_screen, write_json
 
 from abc import ABC, abstractmethod
 from collections import defaultdict, OrderedDict
 from functools import cached_property
 
-import json
 import copy
-import difflib
 import logging
 
+import numpy as np
+
 CONTEXT_LENGTH_LIMIT = 15000
 
 logger = Logger(__name__)
@@ -80,7 +82,23 @@ class GUIState(GUIStateBase):
         for root_elem in view_tree:
             self.root_widgets.append(traverse_widgets(root_elem, self.widgets, droidbot_state.views))
 
+        self.index_widgets()
+
         return self
+
+    def index_widgets(self):
+        """
+        Build the lookup tables over self.widgets: view ID -> widget, signature -> widget and the bounds array
+        When several widgets share an ID or a signature, the first one in self.widgets is kept, as a linear scan would find it.
+        """
+        self.widgets_by_id = {}
+        self.widgets_by_signature = {}
+        for widget in self.widgets:
+            self.widgets_by_id.setdefault(widget.view_id, widget)
+            self.widgets_by_signature.setdefault(widget.signature, widget)
+
+        # One (left, top, right, bottom) row per widget, in the order of self.widgets
+        self.widget_bounds = np.array([[*widget.bounds[0], *widget.bounds[1]] for widget in self.widgets], dtype=np.int32).reshape(-1, 4)
     
     def get_app_activity_depth(self):
         package_name = agent_config.package_name
@@ -98,11 +116,7 @@ class GUIState(GUIStateBase):
         :param view_id: int, the view ID
         :return: Widget, the widget with the given view ID
         """
-        for widget in self.widgets:
-            if widget.view_id == view_id:
-                return widget
-        
-        return None
+        return self.widgets_by_id.get(view_id, None)
 
     def get_widget_by_signature(self, signature):
         """
@@ -110,11 +124,33 @@ class GUIState(GUIStateBase):
         :param signature: str, the signature
         :return: Widget, the widget with the given signature
         """
-        for widget in self.widgets:
-            if widget.signature == signature:
-                return widget
-        
-        return None
+        return self.widgets_by_signature.get(signature, None)
+
+    def get_widgets_at(self, x, y):
+        """
+        Get the widgets whose bounds contain a point
+        :param x: int, the x coordinate
+        :param y: int, the y coordinate
+        :return: list, the widgets containing the point, in the order of self.widgets
+        """
+        b = self.widget_bounds
+        mask = (b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3])
+        return [self.widgets[i] for i in np.flatnonzero(mask)]
+
+    def get_widgets_in(self, bounds, fully_inside=False):
+        """
+        Get the widgets overlapping a region
+        :param bounds: list, the region as [[left, top], [right, bottom]]
+        :param fully_inside: bool, only return widgets lying entirely inside the region
+        :return: list, the matching widgets, in the order of self.widgets
+        """
+        (left, top), (right, bottom) = bounds
+        b = self.widget_bounds
+        if fully_inside:
+            mask = (b[:, 0] >= left) & (b[:, 1] >= top) & (b[:, 2] <= right) & (b[:, 3] <= bottom)
+        else:
+            mask = (b[:, 0] < right) & (b[:, 2] > left) & (b[:, 1] < bottom) & (b[:, 3] > top)
+        return [self.widgets[i] for i in np.flatnonzero(mask)]
 
     def __str__(self):
         return self.describe_screen()
@@ -124,7 +160,7 @@ class GUIState(GUIStateBase):
         From a given GUI state, creates a description of the GUI state including the list of interactable widgets and non-interactable widgets
         """
         def inject_widget_knowledge(widget, show_id):
-            widget_info = widget.to_dict(include_id=show_id)
+            widget_info = widget.to_dict(include_id=show_id, include_children=False)
 
             if ('Main' in self.activity or self.activity == agent_config.main_activity) and 'content_description' in widget_info:
                 # If "Navigate up" widget is in the main page, change its name to "Menu"
@@ -165,12 +201,18 @@ class GUIState(GUIStateBase):
                 for child in widget.children:
                     children_w_knowledge.append(inject_widget_knowledge(child, show_id))
 
-            if 'children' in widget_info:
-                del widget_info['children']
             if len(children_w_knowledge) > 0:
                 widget_info['children'] = children_w_knowledge
             return widget_info
 
+        if include_widget_knowledge:
+            # Summarize all known widgets up front and concurrently, inject_widget_knowledge then reads them from the cache
+            memory.widget_knowledge.prefetch_widget_knowledge(
+                self,
+                [widget for widget in self.widgets if len(widget.possible_action_types) > 0],
+                prompt_recorder=prompt_recorder
+            )
+
         view_hierarchy = {
             'page_name': self.activity,
             'children': []
@@ -178,28 +220,22 @@ class GUIState(GUIStateBase):
         for widget in self.root_widgets:
             view_hierarchy['children'].append(inject_widget_knowledge(widget, show_id))
 
-        screen_description = json.dumps(view_hierarchy, indent=2, ensure_ascii=False)
+        # Stream the indented JSON and stop once over the length limit instead of dumping everything and slicing
+        writer = BudgetedWriter(length_limit)
+        write_json(writer, view_hierarchy)
+        screen_description = writer.getvalue()
 
-        if length_limit and len(screen_description) > length_limit:
-            screen_description = screen_description[:length_limit] + '[...truncated...]'
+        if writer.full:
             logger.warning(f'Screen description is too long ({len(screen_description)} > {length_limit}). Truncated. (state tag: {self.tag}))')
         
         screen_description = remove_quotes(screen_description) # remove all quotes to reduce the number of tokens
         return screen_description
     
     def describe_screen(self, length_limit=CONTEXT_LENGTH_LIMIT, show_id=True):
-        view_hierarchy = {
-            'page_name': self.activity,
-            'children': []
-        }
+        # Same text as json.dumps(indent=2) of the widget tree cut to length_limit, written from the cached widget fragments
+        screen_description, truncated = render_screen(self.activity, self.root_widgets, length_limit=length_limit, include_id=show_id)
 
-        for widget in self.root_widgets:
-            view_hierarchy['children'].append(widget.to_dict(include_id=show_id))
-
-        screen_description = json.dumps(view_hierarchy, indent=2, ensure_ascii=False)
-
-        if length_limit and len(screen_description) > length_limit:
-            screen_description = screen_description[:length_limit] + '[...truncated...]'
+        if truncated:
             logger.warning(f'Screen description is too long ({len(screen_description)} > {length_limit}). Truncated. (state tag: {self.tag}))')
 
         screen_description = remove_quotes(screen_description) # remove all double quotes to reduce the number of tokens
@@ -215,7 +251,7 @@ class GUIState(GUIStateBase):
 
         if length_limit and len(desc) > length_limit:
             desc = desc[:length_limit] + '[...truncated...]'
-            logger.warning(f'Screen description is too long ({len(screen_description)} > {length_limit}). Truncated. (state tag: {self.tag}))')
+            logger.warning(f'Screen description is too long ({len(desc)} > {length_limit}). Truncated. (state tag: {self.tag}))')
         
         return desc
 
@@ -236,9 +272,16 @@ class GUIState(GUIStateBase):
     def diff(self, other):
         """
         Calculate the difference between two GUI states
+        :return: str, "- " lines for widgets only in or changed in this state, "+ " lines for those of the other state
         """
-        diff = difflib.ndiff(self.describe_widgets().splitlines(keepends=True), other.describe_widgets().splitlines(keepends=True))
-        return ''.join(diff)
+        return self.structural_diff(other).render()
+
+    def structural_diff(self, other):
+        """
+        Calculate the widgets that appeared, disappeared or changed from this state to the other
+        :return: GUIStateDiff, the rendering to text is done on demand
+        """
+        return diff_states(self, other)
 
     def diff_widgets(self, other):
         changed_widgets = []
@@ -293,6 +336,18 @@ class GUIState(GUIStateBase):
             gui_state += f'{widget.stringify()}, '
         return gui_state[:-2]
 
+    @cached_property
+    def widgets_by_occurrence(self):
+        """
+        (signature, k) -> the k-th widget with that signature, used to align the widgets of two states
+        """
+        occurrences = defaultdict(int)
+        widgets_by_occurrence = {}
+        for w in self.widgets:
+            widgets_by_occurrence[(w.signature, occurrences[w.signature])] = w
+            occurrences[w.signature] += 1
+        return widgets_by_occurrence
+
     @cached_property
     def actiontype2widgets(self):
         actiontype2widgets = defaultdict(dict)
@@ -0,0 +1,108 @@
+"""
+Budgeted rendering of screen descriptions
+
+Writes the same text as json.dumps(indent=2, ensure_ascii=False) followed by
+truncation to a length limit, but streams it into a buffer and stops as soon
+as the limit is passed instead of rendering the whole screen and slicing it.
+Widget subtrees are written from the fragments cached on each widget.
+"""
+
+import json
+
+TRUNCATION_MARK = '[...truncated...]'
+
+
+class BudgetedWriter:
+    """
+    String buffer that stops accepting text once it holds more than limit characters
+
+    Args:
+        limit (int): Length limit, no limit if None or 0
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+
+    @property
+    def full(self):
+        return bool(self.limit) and self.length > self.limit
+
+    def write(self, text):
+        if not self.full:
+            self.parts.append(text)
+            self.length += len(text)
+
+    def getvalue(self):
+        """The written text, cut to the limit and marked if it went over"""
+        text = ''.join(self.parts)
+        if self.full:
+            text = text[:self.limit] + TRUNCATION_MARK
+        return text
+
+
+def write_json(writer, value, depth=0):
+    """Write value as json.dumps(value, indent=2, ensure_ascii=False) would, nested at the given depth"""
+    if isinstance(value, dict) and len(value) > 0:
+        opener, closer, items = '{', '}', value.items()
+    elif isinstance(value, (list, tuple)) and len(value) > 0:
+        opener, closer, items = '[', ']', value
+    else:
+        writer.write(json.dumps(value, ensure_ascii=False))
+        return
+
+    indent = '  ' * (depth + 1)
+    writer.write(opener)
+    for i, item in enumerate(items):
+        if writer.full:
+            return
+        writer.write(f'{"," if i > 0 else ""}\n{indent}')
+        if opener == '{':
+            key, item = item
+            writer.write(f'{json.dumps(key, ensure_ascii=False)}: ')
+        write_json(writer, item, depth + 1)
+    writer.write(f'\n{"  " * depth}{closer}')
+
+
+def write_widget(writer, widget, depth, include_id=True):
+    """Write widget.to_dict(include_id) as json.dumps(indent=2) would, nested at the given depth"""
+    head, tail = widget.json_fragments(include_id, depth)
+    writer.write(head)
+    for i, child in enumerate(widget.children):
+        if writer.full:
+            return
+        if i > 0:
+            writer.write(f',\n{"  " * (depth + 2)}')
+        write_widget(writer, child, depth + 2, include_id)
+    writer.write(tail)
+
+
+def render_screen(page_name, root_widgets, length_limit=None, include_id=True):
+    """
+    Render {'page_name': page_name, 'children': [widget.to_dict(include_id), ...]} as truncated indented JSON
+
+    Args:
+        page_name (str): Activity name of the screen
+        root_widgets (list): Root widgets of the screen
+        length_limit (int): Length limit, no limit if None or 0
+        include_id (bool): Whether to include the widget IDs
+
+    Returns:
+        tuple: (text, whether it was truncated)
+    """
+    writer = BudgetedWriter(length_limit)
+    writer.write(f'{{\n  "page_name": {json.dumps(page_name, ensure_ascii=False)},\n  "children": ')
+    if len(root_widgets) == 0:
+        writer.write('[]')
+    else:
+        writer.write('[\n    ')
+        for i, widget in enumerate(root_widgets):
+            if writer.full:
+                break
+            if i > 0:
+                writer.write(',\n    ')
+            write_widget(writer, widget, 2, include_id)
+        writer.write('\n  ]')
+    writer.write('\n}')
+    return writer.getvalue(), writer.full
@@ -0,0 +1,81 @@
+"""
+Structural diff between two GUI states
+
+Widgets are aligned by signature (the k-th widget with a signature in one
+state pairs with the k-th one in the other), and aligned widgets are only
+compared property by property when their precomputed content hashes differ.
+The text rendering is built on demand and only for the widgets that differ.
+"""
+
+
+class GUIStateDiff:
+    """
+    Widgets that appeared, disappeared or changed between two GUI states
+
+    Args:
+        appeared (list): Widgets of the new state without a counterpart in the old one
+        disappeared (list): Widgets of the old state without a counterpart in the new one
+        changed (list): (old widget, new widget, {property: (old value, new value)}) of aligned widgets that differ
+    """
+
+    def __init__(self, appeared, disappeared, changed):
+        self.appeared = appeared
+        self.disappeared = disappeared
+        self.changed = changed
+
+    def __bool__(self):
+        return len(self.appeared) > 0 or len(self.disappeared) > 0 or len(self.changed) > 0
+
+    def render(self):
+        """
+        Text rendering in the style of difflib.ndiff: "- " lines for the old widgets and "+ " lines for the new ones
+        """
+        lines = [f'- {widget.dump(indent=None)}\n' for widget in self.disappeared]
+        for old_widget, new_widget, _ in self.changed:
+            lines.append(f'- {old_widget.dump(indent=None)}\n')
+            lines.append(f'+ {new_widget.dump(indent=None)}\n')
+        lines.extend(f'+ {widget.dump(indent=None)}\n' for widget in self.appeared)
+        return ''.join(lines)
+
+    def __str__(self):
+        return self.render()
+
+
+def changed_properties(old_widget, new_widget):
+    old_properties = dict(old_widget.content_properties)
+    new_properties = dict(new_widget.content_properties)
+    return {
+        key: (old_widget.elem_dict.get(key), new_widget.elem_dict.get(key))
+        for key in old_properties.keys() | new_properties.keys()
+        if old_properties.get(key) != new_properties.get(key)
+    }
+
+
+def diff_states(old_state, new_state):
+    """
+    Structural diff of two GUI states
+
+    Args:
+        old_state (GUIState): State before
+        new_state (GUIState): State after
+
+    Returns:
+        GUIStateDiff: Appeared and changed widgets in the order of new_state.widgets, disappeared ones in the order of old_state.widgets
+    """
+    old_widgets = old_state.widgets_by_occurrence
+    new_widgets = new_state.widgets_by_occurrence
+
+    appeared = []
+    changed = []
+    for key, new_widget in new_widgets.items():
+        old_widget = old_widgets.get(key)
+        if old_widget is None:
+            appeared.append(new_widget)
+        elif old_widget.content_hash != new_widget.content_hash:
+            properties = changed_properties(old_widget, new_widget)
+            if len(properties) > 0:
+                changed.append((old_widget, new_widget, properties))
+
+    disappeared = [old_widget for key, old_widget in old_widgets.items() if key not in new_widgets]
+
+    return GUIStateDiff(appeared, disappeared, changed)
@@ -1,6 +1,9 @@
 from collections import defaultdict
 
 class Task:
+    __slots__ = ('summary', 'assessment', 'result_summary', 'description', 'explored_activities', 'explored_states',
+                 'plan', 'end_condition', 'entry_id', 'start_activity')
+
     def __init__(self, summary, description, plan='', end_condition=''):
         self.summary = summary
         self.assessment = None
@@ -13,6 +16,7 @@ class Task:
         self.end_condition = end_condition
 
         self.entry_id = None
+        self.start_activity = None
 
     def add_result(self, assessment, result_summary):
         self.assessment = assessment
@@ -25,6 +29,8 @@ class Task:
         self.explored_activities[activity] += 1
 
     def add_explored_state(self, state):
+        if len(self.explored_states) == 0:
+            self.start_activity = state.activity
         self.explored_states.append(state)
 
     @property
@@ -33,5 +39,19 @@ class Task:
             return None
         return self.explored_states[0]
 
+    def to_dict(self):
+        # Explored GUI states hold device views and are not kept, start_activity stands in for start_state
+        task_dict = {name: getattr(self, name) for name in self.__slots__ if name != 'explored_states'}
+        task_dict['explored_activities'] = dict(self.explored_activities)
+        return task_dict
+
+    @classmethod
+    def from_dict(cls, task_dict):
+        task = cls(task_dict['summary'], task_dict['description'])
+        for name, value in task_dict.items():
+            setattr(task, name, value)
+        task.explored_activities = defaultdict(int, task.explored_activities)
+        return task
+
     def __str__(self):
         return f'{self.summary}'
@@ -1,7 +1,9 @@
 from functools import cached_property
 
 import json
-import copy
+
+# Properties that do not change what a widget shows: temporary view IDs, the full class name and the layout
+UNDISPLAYED_PROPERTIES = ('ID', 'view_str', 'class', 'bounds')
 
 
 class Widget:
@@ -9,6 +11,7 @@ class Widget:
         self.view_id = None
         self.widget_type = None
         self.possible_action_types = []
+        self._json_fragments = {}
 
     def from_dict(self, elem_dict):
         self.view_id = elem_dict.get('ID', None)
@@ -23,30 +26,43 @@ class Widget:
 
         return self
 
-    def to_dict(self, include_id=True, only_rep_property=True):
-        children = [child.to_dict(include_id=include_id) for child in self.children]
-        elem_dict = copy.deepcopy(self.elem_dict)
-
-        del elem_dict['class']
-        del elem_dict['bounds']
-        if not include_id and 'ID' in elem_dict:
-            del elem_dict['ID']
+    def to_dict(self, include_id=True, only_rep_property=True, include_children=True):
+        """
+        Representation of the widget for screen descriptions, built without copying elem_dict
+        """
+        hidden = {'class', 'bounds', 'view_str'}
+        if not include_id:
+            hidden.add('ID')
+        if only_rep_property and 'text' in self.elem_dict:
+            hidden.update(('resource_id', 'content_description'))
 
-        if only_rep_property:
-            if 'text' in elem_dict:
-                if 'resource_id' in elem_dict:
-                    del elem_dict['resource_id']
-                if 'content_description' in elem_dict:
-                    del elem_dict['content_description']
-            
-        if 'view_str' in elem_dict:
-            del elem_dict['view_str']
+        elem_dict = {key: list(value) if isinstance(value, list) else value for key, value in self.elem_dict.items() if key not in hidden}
 
-        if len(children) > 0:
-            elem_dict['children'] = children
+        if include_children and len(self.children) > 0:
+            elem_dict['children'] = [child.to_dict(include_id=include_id) for child in self.children]
 
         return elem_dict
 
+    def json_fragments(self, include_id, depth):
+        """
+        Text before and after the children of the widget in json.dumps(indent=2) output, with the widget at the given indentation depth
+        Cached per widget, as states are described again at later steps.
+        """
+        key = (include_id, depth)
+        if key not in self._json_fragments:
+            indent = '  ' * depth
+            own_text = json.dumps(self.to_dict(include_id=include_id, include_children=False), indent=2, ensure_ascii=False)
+            # JSON strings never hold raw newlines, so every newline starts a line to indent
+            own_text = own_text.replace('\n', '\n' + indent)
+            if len(self.children) == 0:
+                self._json_fragments[key] = (own_text, '')
+            else:
+                closing = '\n' + indent + '}'
+                head = own_text[:-len(closing)] + ',\n' if own_text != '{}' else '{\n'
+                head += f'{indent}  "children": [\n{indent}    '
+                self._json_fragments[key] = (head, f'\n{indent}  ]{closing}')
+        return self._json_fragments[key]
+
     @cached_property
     def bounds(self):
         return self.elem_dict['bounds']
@@ -103,6 +119,21 @@ class Widget:
 
         return '-'.join(ingredients)
 
+    @cached_property
+    def content_hash(self):
+        """
+        Hash of the widget's own displayed properties (children excluded), precomputed once per widget
+        so that diffing states only compares the properties of widgets whose hashes differ
+        """
+        return hash(self.content_properties)
+
+    @cached_property
+    def content_properties(self):
+        return tuple(
+            (key, tuple(value) if isinstance(value, list) else value)
+            for key, value in self.elem_dict.items() if key not in UNDISPLAYED_PROPERTIES
+        )
+
     def __repr__(self):
         return self.dump()
 
@@ -60,6 +60,83 @@ def extract_json_from_str(json_str):
     return target_json
 
 
+class IncrementalJSONExtractor:
+    """
+    Detect the first complete JSON object in a streamed LLM response
+
+    Chunks are fed as they arrive; brace depth is tracked outside of string
+    literals so the object is returned as soon as its closing brace is seen,
+    without waiting for the rest of the response.
+
+    Args:
+        required_keys (tuple): Keys an object must contain to be accepted
+    """
+
+    def __init__(self, required_keys=('action_type',)):
+        self.required_keys = required_keys
+        self.buffer = ''
+        self.result = None
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        """
+        Append a chunk of text and scan it
+
+        Returns:
+            dict: The first accepted JSON object, or None if not complete yet
+        """
+        self.buffer += chunk
+        if self.result is not None:
+            return self.result
+
+        while self._pos < len(self.buffer):
+            ch = self.buffer[self._pos]
+            if self._start is None:
+                if ch == '{':
+                    self._start = self._pos
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = self._parse(self.buffer[self._start:self._pos + 1])
+                    if candidate is not None:
+                        self.result = candidate
+                        self._pos += 1
+                        return candidate
+                    # Not an acceptable object, rescan from just after its opening brace
+                    self._pos = self._start
+                    self._start = None
+                    self._in_string = False
+                    self._escape = False
+            self._pos += 1
+
+        return None
+
+    def _parse(self, text):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict) or any(key not in obj for key in self.required_keys):
+            return None
+        return obj
+
+
 def draw_bounds(i, bounds):
     image_path = os.path.join("screenshots", f"{i}.jpg")
     image = cv2.imread(image_path)